@@ -16,20 +16,55 @@ class CoolLexer(Lexer):
               POOL, THEN, WHILE, NUMBER, STR_CONST, LE, DARROW, ASSIGN}
     #ignore = '\t '
     literals = {}
-    # Ejemplo
-    ELSE = r'\b[eE][lL][sS][eE]\b'
+    line_index = True
+
+    # Número de veces que se usa cada regla en 01/grading, para probar antes
+    # las más frecuentes (se regenera con "python benchmark.py ordering train")
+    rule_counts = 'CoolLexer.counts.json'
+    TYPEID = r'[A-Z][a-zA-Z0-9_]*'
+    OBJECTID = r'[a-z][a-zA-Z0-9_]*'
+
+    # Palabras clave: no distinguen mayúsculas, salvo la primera letra de
+    # true y false, que debe ser minúscula (si no, es un TYPEID)
+    OBJECTID.nocase['true'] = BOOL_CONST
+    OBJECTID.nocase['false'] = BOOL_CONST
+    OBJECTID.nocase['class'] = TYPEID.nocase['class'] = CLASS
+    OBJECTID.nocase['else'] = TYPEID.nocase['else'] = ELSE
+    OBJECTID.nocase['fi'] = TYPEID.nocase['fi'] = FI
+    OBJECTID.nocase['if'] = TYPEID.nocase['if'] = IF
+    OBJECTID.nocase['in'] = TYPEID.nocase['in'] = IN
+    OBJECTID.nocase['inherits'] = TYPEID.nocase['inherits'] = INHERITS
+    OBJECTID.nocase['isvoid'] = TYPEID.nocase['isvoid'] = ISVOID
+    OBJECTID.nocase['let'] = TYPEID.nocase['let'] = LET
+    OBJECTID.nocase['loop'] = TYPEID.nocase['loop'] = LOOP
+    OBJECTID.nocase['pool'] = TYPEID.nocase['pool'] = POOL
+    OBJECTID.nocase['then'] = TYPEID.nocase['then'] = THEN
+    OBJECTID.nocase['while'] = TYPEID.nocase['while'] = WHILE
+    OBJECTID.nocase['case'] = TYPEID.nocase['case'] = CASE
+    OBJECTID.nocase['esac'] = TYPEID.nocase['esac'] = ESAC
+    OBJECTID.nocase['new'] = TYPEID.nocase['new'] = NEW
+    OBJECTID.nocase['of'] = TYPEID.nocase['of'] = OF
+    OBJECTID.nocase['not'] = TYPEID.nocase['not'] = NOT
+
+    # El valor de BOOL_CONST es un bool, que convierte el propio lexer
+    BOOL_CONST.convert = equals('true', nocase=True)
 
     CARACTERES_CONTROL = [bytes.fromhex(i+hex(j)[-1]).decode('ascii')
                           for i in ['0', '1']
                           for j in range(16)] + [bytes.fromhex(hex(127)[-2:]).decode("ascii")]
 
-    @_(r'\t| |\v|\r|\f')
-    def spaces(self, t):
-        pass
+    # Espacios en blanco: se saltan de una vez, sin llamar a ninguna regla
+    whitespace = ' \t\v\r\f\n'
+
+    # Comentarios: (* ... *) se pueden anidar y \ escapa el carácter siguiente
+    ignore_comment = region('(*', '*)', nested=True, escape='\\')
+    ignore_line_comment = r'--.*'
 
-    @_(r'\n+')
-    def newline(self, t):
-        self.lineno += t.value.count('\n')
+    def unterminated(self, t):
+        t.type = 'ERROR'
+        t.value = '"EOF in comment"'
+        t.lineno = self.lineno
+        return t
 
     
     def error(self, t):
@@ -0,0 +1,1032 @@
+# coding: utf-8
+#
+# Benchmarks for the sly lexers and parsers used in the practicas.
+#
+#     python benchmark.py <benchmark> [args...]
+#
+# Run without arguments to list the available benchmarks.
+
+import contextlib
+import glob
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+COMPILERS = os.path.join(DIRECTORIO, '..', 'Teoria_y_Ejercicios', 'compilers')
+sys.path.insert(0, DIRECTORIO)
+sys.path.insert(1, COMPILERS)
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def memory_status():
+    '''
+    Resident and private dirty memory of the current process, in kB.
+    '''
+    status = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('Rss', 'Private_Dirty'):
+                    status[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return status
+
+
+# ----------------------------------------------------------------------
+# Worker startup
+
+WORKERS = 32
+
+
+def _worker_init(t0):
+    global _worker_startup
+    from Lexer import CoolLexer
+    from gone.parser import GoneParser
+    _worker_startup = time.time() - t0
+
+
+def _worker_report(_):
+    time.sleep(0.2)
+    return os.getpid(), _worker_startup, memory_status()
+
+
+@benchmark
+def workers(*methods):
+    '''
+    Per-worker startup time and memory for every start method.
+    '''
+    from sly.pool import freeze, get_context
+    for method in methods or ('fork', 'forkserver', 'spawn'):
+        ctx = get_context(method, preload=['Lexer', 'gone.parser'])
+        if method == 'fork':
+            from Lexer import CoolLexer
+            from gone.parser import GoneParser
+            freeze(CoolLexer, GoneParser)
+        t0 = time.time()
+        with ctx.Pool(WORKERS, initializer=_worker_init, initargs=(t0,)) as pool:
+            reports = dict((pid, (startup, mem)) for pid, startup, mem in
+                           pool.map(_worker_report, range(WORKERS * 2), chunksize=1))
+        n = len(reports)
+        startup = sum(s for s, _ in reports.values()) / n
+        rss = sum(m.get('Rss', 0) for _, m in reports.values()) / n
+        dirty = sum(m.get('Private_Dirty', 0) for _, m in reports.values()) / n
+        print(f'{method:<12} workers={n:<3} startup={startup * 1000:8.1f} ms  '
+              f'rss={rss:8.0f} kB  private_dirty={dirty:8.0f} kB')
+
+
+# ----------------------------------------------------------------------
+# Lexer construction at import time
+
+STARTUP_RUNS = 20
+
+
+def _import_time(module, env):
+    code = ('import time, sys; sys.path[:0] = %r; import sly; t0 = time.perf_counter(); '
+            'import %s; print(time.perf_counter() - t0)' % ([DIRECTORIO, COMPILERS], module))
+    times = []
+    for _ in range(STARTUP_RUNS):
+        out = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                             capture_output=True, text=True).stdout
+        times.append(float(out))
+    return min(times)
+
+
+@benchmark
+def startup(*modules):
+    '''
+    Time to import (and build) lexer modules in a fresh interpreter.
+    '''
+    for module in modules or ('Lexer', 'gone.tokenizer'):
+        env = dict(os.environ)
+        env.pop('SLY_CACHE_DIR', None)
+        cold = _import_time(module, env)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env['SLY_CACHE_DIR'] = cache_dir
+            _import_time(module, env)
+            warm = _import_time(module, env)
+        print(f'{module:<16} no cache={cold * 1000:7.2f} ms  '
+              f'validated cache={warm * 1000:7.2f} ms')
+
+
+# ----------------------------------------------------------------------
+# Lexing errors
+
+GARBAGE = '$@?`~'
+
+
+def _lex_time(lexer_class, text):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+        t0 = time.perf_counter()
+        for _ in lexer_class().tokenize(text):
+            pass
+        return time.perf_counter() - t0
+
+
+@benchmark
+def garbage(megabytes='2'):
+    '''
+    Lexing megabytes of illegal characters, with and without coalescing.
+    '''
+    from Lexer import CoolLexer
+    from gone.tokenizer import GoneLexer
+
+    class CoalescingCoolLexer(CoolLexer):
+        tokens = CoolLexer.tokens
+        coalesce_errors = True
+
+    class CoalescingGoneLexer(GoneLexer):
+        tokens = GoneLexer.tokens
+        coalesce_errors = True
+
+    size = 1 << 18
+    while size <= int(megabytes) << 20:
+        text = (GARBAGE * (size // len(GARBAGE) + 1))[:size]
+        for lexer_class in (CoolLexer, CoalescingCoolLexer, GoneLexer, CoalescingGoneLexer):
+            elapsed = _lex_time(lexer_class, text)
+            print(f'{lexer_class.__name__:<22} {size >> 10:6} kB  {elapsed * 1000:9.1f} ms')
+        size *= 2
+
+
+# ----------------------------------------------------------------------
+# Corpora
+
+def corpus(pattern):
+    '''
+    Concatenated text of every file matching pattern.
+    '''
+    texts = []
+    for name in sorted(glob.glob(pattern)):
+        with open(name, newline='') as f:
+            texts.append(f.read())
+    return '\n'.join(texts)
+
+
+def cool_corpus():
+    return corpus(os.path.join(DIRECTORIO, '01', 'grading', '*.cool'))
+
+
+def gone_corpus():
+    return corpus(os.path.join(COMPILERS, 'Tests', '*.g'))
+
+
+def lexers():
+    '''
+    (lexer class, corpus) pairs used by the throughput benchmarks.
+    '''
+    from Lexer import CoolLexer
+    from gone.tokenizer import GoneLexer
+    return [(CoolLexer, cool_corpus()), (GoneLexer, gone_corpus())]
+
+
+def _tokens_per_second(lexer_class, text, runs=10):
+    best = None
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+        for _ in range(runs):
+            t0 = time.process_time()
+            n = sum(1 for _ in lexer_class().tokenize(text))
+            elapsed = time.process_time() - t0
+            best = elapsed if best is None else min(best, elapsed)
+    return n, n / best
+
+
+@benchmark
+def throughput(repeat='10'):
+    '''
+    Tokens per second of every lexer on its test corpus.
+    '''
+    for lexer_class, text in lexers():
+        n, rate = _tokens_per_second(lexer_class, text * int(repeat))
+        print(f'{lexer_class.__name__:<10} tokens={n:<8} {rate:12,.0f} tokens/s')
+
+
+# ----------------------------------------------------------------------
+# Automaton backend
+
+def _token_stream(lexer_class, text):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+        return [(tok.type, tok.value, tok.lineno, tok.index) for tok in lexer_class().tokenize(text)]
+
+
+@benchmark
+def automaton(repeat='10'):
+    '''
+    Tokens per second with re and with the sly.dfa automaton.
+    '''
+    for lexer_class, text in lexers():
+        class dfa_class(lexer_class):
+            tokens = lexer_class.tokens
+            automaton = True
+
+        pattern = dfa_class._dispatch_default
+        _, re_rate = _tokens_per_second(lexer_class, text * int(repeat))
+        n, dfa_rate = _tokens_per_second(dfa_class, text * int(repeat))
+        print(f'{lexer_class.__name__:<10} tokens={n:<8} re={re_rate:12,.0f} tokens/s  '
+              f'automaton={dfa_rate:12,.0f} tokens/s  states={len(pattern.sets)} '
+              f'fallback={[pattern.names[rule] for rule, _ in pattern.fallback]}')
+
+
+# ----------------------------------------------------------------------
+# Matching engines
+
+@benchmark
+def engines(repeat='10'):
+    '''
+    Tokens per second with every regex_module engine, checking the tokens.
+    '''
+    from sly.engine import available_engines, compare_engines
+    print(f'engines: {", ".join(available_engines())}')
+    for lexer_class, text in lexers():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+            runs = compare_engines(lexer_class, [text * int(repeat)], runs=5)
+        for run in runs:
+            print(f'{lexer_class.__name__:<10} {run.name:<10} tokens={run.tokens:<8} '
+                  f'{run.tokens_per_second:12,.0f} tokens/s  '
+                  f'{"identical" if not run.mismatches else "DIFFERENT TOKENS"}')
+
+
+# ----------------------------------------------------------------------
+# Many short texts
+
+@benchmark
+def many(count='100000'):
+    '''
+    Tokens per second lexing one-line texts with tokenize() and tokenize_many().
+    '''
+    for lexer_class, text in lexers():
+        lines = [line for line in text.splitlines() if line.strip()]
+        lines = (lines * (int(count) // len(lines) + 1))[:int(count)]
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+            lexer = lexer_class()
+            t0 = time.process_time()
+            separate = [list(lexer.tokenize(line)) for line in lines]
+            t1 = time.process_time()
+            many = list(lexer_class().tokenize_many(lines))
+            t2 = time.process_time()
+        n = sum(map(len, many))
+        print(f'{lexer_class.__name__:<10} texts={len(lines):<7} tokens={n:<8} '
+              f'tokenize={n / (t1 - t0):12,.0f} tokens/s  tokenize_many={n / (t2 - t1):12,.0f} tokens/s')
+
+
+# ----------------------------------------------------------------------
+# Whitespace
+
+def _whitespace_lexers():
+    from Lexer import CoolLexer
+
+    # Whitespace skipped by rules, as CoolLexer used to do
+    class CallbackCoolLexer(CoolLexer):
+        tokens = CoolLexer.tokens
+        whitespace = ''
+
+        @_(r'\t| |\v|\r|\f')
+        def spaces(self, t):
+            pass
+
+        @_(r'\n+')
+        def ignore_newline(self, t):
+            self.lineno += len(t.value)
+
+    class CountingCoolLexer(CoolLexer):
+        tokens = CoolLexer.tokens
+        line_index = False
+
+    class CountingCallbackCoolLexer(CallbackCoolLexer):
+        tokens = CoolLexer.tokens
+        line_index = False
+
+    return [(CallbackCoolLexer, CoolLexer), (CountingCallbackCoolLexer, CountingCoolLexer)]
+
+
+@benchmark
+def whitespace(indent='8', repeat='10'):
+    '''
+    Tokens per second of CoolLexer with whitespace rules and with whitespace runs.
+    '''
+    import textwrap
+    text = textwrap.indent(cool_corpus(), ' ' * int(indent)) * int(repeat)
+    for rules_class, runs_class in _whitespace_lexers():
+        n, rules_rate = _tokens_per_second(rules_class, text)
+        _, runs_rate = _tokens_per_second(runs_class, text)
+        print(f'line_index={runs_class.line_index!s:<5} tokens={n:<8} rules={rules_rate:12,.0f} tokens/s  '
+              f'whitespace={runs_rate:12,.0f} tokens/s  {runs_rate / rules_rate:5.2f}x')
+
+
+# ----------------------------------------------------------------------
+# Lexer states
+
+def _state_lexers():
+    from sly import Lexer
+    from Lexer import CoolLexer
+
+    # Strings lexed in a state of their own, entered at every "
+    class StringCoolLexer(CoolLexer):
+        tokens = CoolLexer.tokens | {'STR_END'}
+
+        @_(r'"')
+        def STR_CONST(self, t):
+            self.push_state(StringState)
+            return t
+
+    class StringState(Lexer):
+        tokens = {STR_CONST, STR_END}
+        STR_CONST = r'[^"\\\n]+|\\.|\n'
+
+        @_(r'"')
+        def STR_END(self, t):
+            self.pop_state()
+            return t
+
+        def error(self, t):
+            self.index += 1
+
+    return CoolLexer, StringCoolLexer
+
+
+@benchmark
+def states(strings='20', repeat='10'):
+    '''
+    Tokens per second with strings as single tokens and lexed in a state.
+    '''
+    single_class, state_class = _state_lexers()
+    text = cool_corpus() * int(repeat)
+    for extra in ('', ' "x" "\\n" ""' * int(strings)):
+        lines = text.replace('\n', extra + '\n')
+        n, single_rate = _tokens_per_second(single_class, lines)
+        m, state_rate = _tokens_per_second(state_class, lines)
+        print(f'strings={lines.count(chr(34)) // 2:<7} '
+              f'single token={single_rate:12,.0f} tokens/s ({n} tokens)  '
+              f'string state={state_rate:12,.0f} tokens/s ({m} tokens)')
+
+
+# ----------------------------------------------------------------------
+# Rule ordering
+
+def _rule_counts(lexer_class, text):
+    from sly.lex import LexerProfile
+    lexer = lexer_class()
+    lexer.profile = LexerProfile()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+        for _ in lexer.tokenize(text):
+            pass
+    return lexer.profile
+
+
+@benchmark
+def ordering(train='no', repeat='10'):
+    '''
+    Tokens per second with the rules as written and ordered by their counts.
+    '''
+    import re
+    from sly.engine import RegexModule
+    # The master pattern for every character, where the order matters most
+    master = RegexModule('re (master pattern)', re.compile)
+    for lexer_class, text in lexers():
+        if train == 'train':
+            path = lexer_class._rule_counts_path()
+            _rule_counts(lexer_class, text).save(path)
+            print(f'{lexer_class.__name__:<10} rule counts saved to {os.path.relpath(path)}')
+        counts = _rule_counts(lexer_class, text).rule_counts()
+
+        for module in (re, master):
+            class written_class(lexer_class):
+                tokens = lexer_class.tokens
+                regex_module = module
+                rule_counts = None
+
+            class ordered_class(written_class):
+                tokens = lexer_class.tokens
+                rule_counts = counts
+
+            _, written_rate = _tokens_per_second(written_class, text * int(repeat))
+            n, ordered_rate = _tokens_per_second(ordered_class, text * int(repeat))
+            print(f'{lexer_class.__name__:<10} {module.__name__:<20} tokens={n:<8} '
+                  f'as written={written_rate:12,.0f} tokens/s  ordered={ordered_rate:12,.0f} tokens/s  '
+                  f'{ordered_rate / written_rate:5.2f}x')
+        print(f'{"":<10} order: {" ".join(name for name, _ in ordered_class._parts)}')
+
+
+# ----------------------------------------------------------------------
+# Value converters
+
+def _converter_lexers():
+    from Lexer import CoolLexer
+    from gone.tokenizer import GoneLexer
+
+    # Values converted by rule functions, as GoneParser used to do
+    class CallbackGoneLexer(GoneLexer):
+        tokens = GoneLexer.tokens
+        INTEGER.convert = FLOAT.convert = CHAR.convert = BOOL.convert = None
+
+        @_(r'\d+\.\d+|\d+\.|\.\d+')
+        def FLOAT(self, t):
+            t.value = float(t.value)
+            return t
+
+        @_(r'\d+')
+        def INTEGER(self, t):
+            t.value = int(t.value)
+            return t
+
+        @_(r'\'([^\'\\]|\\[n\\\'x][0-9a-fA-F]{0,2})\'')
+        def CHAR(self, t):
+            t.value = eval(t.value)
+            return t
+
+        @_(r'true|false')
+        def BOOL(self, t):
+            t.value = t.value == 'true'
+            return t
+
+    # BOOL_CONST values left as matched
+    class UnconvertedCoolLexer(CoolLexer):
+        tokens = CoolLexer.tokens
+        BOOL_CONST.convert = None
+
+    return [(CallbackGoneLexer, GoneLexer), (UnconvertedCoolLexer, CoolLexer)]
+
+
+@benchmark
+def converters(literals='20', repeat='10'):
+    '''
+    Tokens per second converting literal values with rule functions and with converters.
+    '''
+    extra = {'GoneLexer': " 123 4.5 'a' '\\n' true", 'CoolLexer': ' true false'}
+    corpora = {lexer_class.__name__: text for lexer_class, text in lexers()}
+    for before_class, after_class in _converter_lexers():
+        name = after_class.__name__
+        text = corpora[name].replace('\n', extra[name] * int(literals) + '\n') * int(repeat)
+        n, before_rate = _tokens_per_second(before_class, text)
+        _, after_rate = _tokens_per_second(after_class, text)
+        best = {}
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+            for _ in range(5):
+                for lexer_class in (before_class, after_class):
+                    t0 = time.process_time()
+                    lexer_class().tokenize_columns(text)
+                    elapsed = time.process_time() - t0
+                    best[lexer_class] = min(best.get(lexer_class, elapsed), elapsed)
+        print(f'{name:<10} tokens={n:<8} {before_class.__name__}={before_rate:12,.0f} tokens/s  '
+              f'converters={after_rate:12,.0f} tokens/s  {after_rate / before_rate:5.2f}x  '
+              f'columns {best[before_class] / best[after_class]:5.2f}x')
+
+
+# ----------------------------------------------------------------------
+# Bytes
+
+def _grading_files(lexer_class):
+    if lexer_class.__name__ == 'CoolLexer':
+        return sorted(glob.glob(os.path.join(DIRECTORIO, '01', 'grading', '*.cool')))
+    return sorted(glob.glob(os.path.join(COMPILERS, 'Tests', '*.g')))
+
+
+@benchmark
+def binary(repeat='10'):
+    '''
+    Tokens per second lexing decoded str, bytes and mmap (the tokens are
+    checked by test_equivalence.py).
+    '''
+    import mmap
+    for lexer_class, _ in lexers():
+        with tempfile.TemporaryFile() as f:
+            for path in _grading_files(lexer_class):
+                with open(path, 'rb') as g:
+                    f.write(g.read() * int(repeat))
+            f.flush()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data = bytes(mm)
+                rates = []
+                for source in (lambda: data.decode('ascii'), lambda: data, lambda: mm):
+                    best = None
+                    with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+                        for _ in range(5):
+                            t0 = time.process_time()
+                            n = sum(1 for _ in lexer_class().tokenize(source()))
+                            elapsed = time.process_time() - t0
+                            best = elapsed if best is None else min(best, elapsed)
+                    rates.append(n / best)
+        print(f'{lexer_class.__name__:<10} tokens={n:<8} decoded str={rates[0]:12,.0f} tokens/s  '
+              f'bytes={rates[1]:12,.0f} tokens/s  mmap={rates[2]:12,.0f} tokens/s')
+
+
+# ----------------------------------------------------------------------
+# Line numbers
+
+def _line_lexers():
+    from sly import Lexer
+
+    class TrackingLexer(Lexer):
+        tokens = {ID, NUMBER}
+        ignore = ' \t\r'
+        literals = set('+-*/%=<>!&|(){}[];,.:~@\'"')
+        ID = r'[a-zA-Z_][a-zA-Z0-9_]*'
+        NUMBER = r'\d+'
+
+        @_(r'/\*[^*]*\*+(?:[^/*][^*]*\*+)*/', r'\(\*[^*]*\*+(?:[^)*][^*]*\*+)*\)')
+        def ignore_comment(self, t):
+            self.lineno += t.value.count('\n')
+
+        @_(r'(//|--).*')
+        def ignore_line_comment(self, t):
+            pass
+
+        @_(r'\n+')
+        def ignore_newline(self, t):
+            self.lineno += len(t.value)
+
+        def error(self, t):
+            self.index += 1
+
+    class IndexedLexer(Lexer):
+        tokens = TrackingLexer.tokens
+        ignore = TrackingLexer.ignore
+        literals = TrackingLexer.literals
+        line_index = True
+        ID = TrackingLexer.ID
+        NUMBER = TrackingLexer.NUMBER
+        ignore_comment = r'/\*[^*]*\*+(?:[^/*][^*]*\*+)*/|\(\*[^*]*\*+(?:[^)*][^*]*\*+)*\)'
+        ignore_line_comment = r'(//|--).*'
+        ignore_newline = r'\n+'
+
+        def error(self, t):
+            self.index += 1
+
+    return TrackingLexer, IndexedLexer
+
+
+@benchmark
+def lines(repeat='10'):
+    '''
+    Tokens per second tracking lineno in rules and with line_index.
+    '''
+    tracking, indexed = _line_lexers()
+    comments = ''.join(f'x = {n}; /* block\n comment */\n\n-- line comment\n\n' for n in range(2000))
+    for name, text in (('cool', cool_corpus()), ('gone', gone_corpus()), ('comments', comments)):
+        text *= int(repeat)
+        n, tracking_rate = _tokens_per_second(tracking, text)
+        _, indexed_rate = _tokens_per_second(indexed, text)
+        print(f'{name:<10} tokens={n:<8} lineno={tracking_rate:12,.0f} tokens/s  '
+              f'line_index={indexed_rate:12,.0f} tokens/s')
+
+
+# ----------------------------------------------------------------------
+# Keywords
+
+_COOL_KEYWORDS = ('class', 'else', 'fi', 'if', 'in', 'inherits', 'isvoid', 'let', 'loop',
+                  'pool', 'then', 'while', 'case', 'esac', 'new', 'of', 'not')
+
+
+def _nocase(word):
+    return r'\b' + ''.join(f'[{c}{c.upper()}]' for c in word) + r'\b'
+
+
+def _keyword_lexers():
+    from sly import Lexer
+    from Lexer import CoolLexer
+
+    class RegexKeywordLexer(Lexer):
+        tokens = CoolLexer.tokens
+        ignore = ' \t\r\v\f'
+        line_index = True
+        BOOL_CONST = r'\bt[rR][uU][eE]\b|\bf[aA][lL][sS][eE]\b'
+        BOOL_CONST.convert = equals('true', nocase=True)
+        CLASS, ELSE, FI, IF, IN, INHERITS, ISVOID, LET, LOOP = map(_nocase, _COOL_KEYWORDS[:9])
+        POOL, THEN, WHILE, CASE, ESAC, NEW, OF, NOT = map(_nocase, _COOL_KEYWORDS[9:])
+        TYPEID = r'[A-Z][a-zA-Z0-9_]*'
+        OBJECTID = r'[a-z][a-zA-Z0-9_]*'
+        ignore_newline = r'\n+'
+        literals = set('+-*/~<=.,:;@(){}')
+        INT_CONST = r'\d+'
+        STR_CONST = r'"([^"\\\n]|\\.)*"'
+        ignore_comment = r'--.*'
+
+        def error(self, t):
+            self.index += 1
+
+    # CoolLexer itself, with whitespace skipped by ignore and the same
+    # extra rules as above, so that errors don't dominate the timings
+    class MapKeywordLexer(CoolLexer):
+        tokens = CoolLexer.tokens
+        ignore = RegexKeywordLexer.ignore
+        literals = RegexKeywordLexer.literals
+        INT_CONST = RegexKeywordLexer.INT_CONST
+        STR_CONST = RegexKeywordLexer.STR_CONST
+        ignore_comment = RegexKeywordLexer.ignore_comment
+
+    return RegexKeywordLexer, MapKeywordLexer
+
+
+@benchmark
+def keywords(repeat='10'):
+    '''
+    Tokens per second with a regex per keyword and with a nocase keyword map.
+    '''
+    regex, mapped = _keyword_lexers()
+    text = cool_corpus() * int(repeat)
+    n, regex_rate = _tokens_per_second(regex, text)
+    _, map_rate = _tokens_per_second(mapped, text)
+    print(f'{"cool":<10} tokens={n:<8} regex={regex_rate:12,.0f} tokens/s  '
+          f'nocase map={map_rate:12,.0f} tokens/s')
+    print(f'{"":<10} master regex: {len(regex._master_re.pattern)} vs '
+          f'{len(mapped._master_re.pattern)} characters')
+
+
+# ----------------------------------------------------------------------
+# Where the time goes
+
+@benchmark
+def profile(repeat='1'):
+    '''
+    Per-rule profile of every lexer on its test corpus.
+    '''
+    from sly import LexerProfile
+    for lexer_class, text in lexers():
+        lexer = lexer_class()
+        lexer.profile = LexerProfile()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+            for _ in lexer.tokenize(text * int(repeat)):
+                pass
+        print(lexer_class.__name__)
+        print(lexer.profile.report())
+        print()
+
+
+# ----------------------------------------------------------------------
+# Delimited regions
+
+def _comment_lexers():
+    from sly import Lexer
+
+    # Block comments as written in gone/tokenizer.py
+    class RegexCommentLexer(Lexer):
+        tokens = {ID}
+        ignore = ' \t'
+        ID = r'[a-zA-Z_][a-zA-Z0-9_]*'
+
+        @_(r'/\*(.|\n)*?\*/')
+        def COMMENT(self, t):
+            self.lineno += t.value.count('\n')
+
+        @_(r'/\*(.|\n)*')
+        def comment_error(self, t):
+            self.lineno += t.value.count('\n')
+
+        @_(r'\n+')
+        def newline(self, t):
+            self.lineno += len(t.value)
+
+        def error(self, t):
+            self.index += 1
+
+    class RegionCommentLexer(Lexer):
+        tokens = {ID}
+        ignore = ' \t'
+        ID = RegexCommentLexer.ID
+        ignore_comment = region('/*', '*/')
+
+        @_(r'\n+')
+        def newline(self, t):
+            self.lineno += len(t.value)
+
+        def unterminated(self, t):
+            pass
+
+        def error(self, t):
+            self.index += 1
+
+    return RegexCommentLexer, RegionCommentLexer
+
+
+@benchmark
+def regions(kilobytes='4096'):
+    '''
+    Block comments matched by a regex and scanned as a region().
+    '''
+    regex, scanned = _comment_lexers()
+    size = 1 << 16
+    while size <= int(kilobytes) << 10:
+        for name, text in (('comment', 'a /*' + 'x\n' * (size // 2) + '*/ b'),
+                           ('unterminated', 'a ' + '/* x\n' * (size // 5))):
+            times = []
+            for lexer_class in (regex, scanned):
+                t0 = time.process_time()
+                tokens = [(tok.type, tok.value, tok.lineno) for tok in lexer_class().tokenize(text)]
+                times.append(time.process_time() - t0)
+            print(f'{name:<14} {size >> 10:6} kB  regex={times[0] * 1000:9.1f} ms  '
+                  f'region={times[1] * 1000:9.1f} ms  tokens={tokens}')
+        size *= 2
+
+    from Lexer import CoolLexer
+    for name in ('twice_512_nested_comments.cl.cool', 'longcomment.cool'):
+        with open(os.path.join(DIRECTORIO, '01', 'grading', name), newline='') as f:
+            text = f.read() * 100
+        n, rate = _tokens_per_second(CoolLexer, text)
+        print(f'{name:<34} x100 {len(text) >> 10:6} kB  tokens={n:<6} '
+              f'{len(text) * rate / n / 2**20 if n else 0:8.1f} MB/s')
+
+
+# ----------------------------------------------------------------------
+# Many files in a process pool
+
+@benchmark
+def files(processes='0', repeat='4'):
+    '''
+    Tokens per second lexing every corpus file in a process pool.
+    '''
+    import pickle
+    from sly.pool import tokenize_files
+    from Lexer import CoolLexer
+    from gone.tokenizer import GoneLexer
+    for lexer_class, pattern in ((CoolLexer, os.path.join(DIRECTORIO, '01', 'grading', '*.cool')),
+                                 (GoneLexer, os.path.join(COMPILERS, 'Tests', '*.g'))):
+        paths = sorted(glob.glob(pattern)) * int(repeat)
+        largest = max(paths, key=os.path.getsize)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+            results = tokenize_files(lexer_class, paths, int(processes) or None, timeout=10)
+            with open(largest, newline='') as f:
+                tokens = list(lexer_class().tokenize(f.read()))
+        slowest = max(results, key=lambda result: result.elapsed)
+        print(f'{lexer_class.__name__:<10} files={len(results):<5} tokens={results.tokens:<8} '
+              f'{results.tokens_per_second:12,.0f} tokens/s  slowest={os.path.basename(slowest.path)} '
+              f'({slowest.elapsed * 1000:.1f} ms, {slowest.tokens_per_second:,.0f} tokens/s)')
+        print(f'{"":<10} {os.path.basename(largest)}: pickled Tokens={len(pickle.dumps(tokens))} bytes  '
+              f'FileTokens={len(pickle.dumps(results[paths.index(largest)]))} bytes')
+
+
+# ----------------------------------------------------------------------
+# One large file in a process pool
+
+def _generated(lexer_class, megabytes):
+    # The corpus files without lexing errors (an unterminated comment would
+    # swallow the rest of the text), repeated up to the given size
+    texts = []
+    for name in _grading_files(lexer_class):
+        with open(name, newline='') as f:
+            text = f.read()
+        if all(tok.type != 'ERROR' for tok in lexer_class().tokenize(text)):
+            texts.append(text)
+    text = '\n'.join(texts) + '\n'
+    return text * max(1, int(float(megabytes) * 2**20) // len(text))
+
+
+@benchmark
+def parallel(megabytes='8', processes='0', kilobytes='1024'):
+    '''
+    Wall time lexing one large generated file in chunks in a process pool.
+    '''
+    from sly.pool import tokenize_parallel
+    from Lexer import CoolLexer
+    from gone.tokenizer import GoneLexer
+    processes = int(processes) or os.cpu_count()
+    for lexer_class in (CoolLexer, GoneLexer):
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), \
+             contextlib.redirect_stderr(devnull):
+            text = _generated(lexer_class, megabytes)
+            t0 = time.perf_counter()
+            lexer_class().tokenize_columns(text)
+            elapsed = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            columns = tokenize_parallel(lexer_class(), text, chunksize=int(kilobytes) << 10,
+                                        processes=processes, context='fork')
+            parallel_elapsed = time.perf_counter() - t0
+        print(f'{lexer_class.__name__:<10} {len(text) / 2**20:.1f} MB tokens={len(columns):<8} '
+              f'sequential={elapsed:6.3f} s  {processes} processes={parallel_elapsed:6.3f} s '
+              f'({elapsed / parallel_elapsed:.2f}x)')
+
+
+# ----------------------------------------------------------------------
+# Memory used to keep the tokens
+
+def _peak_memory(func):
+    tracemalloc.start()
+    try:
+        result = func()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+@benchmark
+def columns(repeat='20'):
+    '''
+    Memory per million tokens kept as Token objects and as TokenColumns.
+    '''
+    for lexer_class, text in lexers():
+        text *= int(repeat)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+            toks, tok_mem = _peak_memory(lambda: list(lexer_class().tokenize(text)))
+            cols, col_mem = _peak_memory(lambda: lexer_class().tokenize_columns(text))
+        n = len(toks)
+        print(f'{lexer_class.__name__:<10} tokens={n:<8} '
+              f'Token={tok_mem * 1e6 / n / 2**20:8.1f} MB/Mtok  '
+              f'TokenColumns={col_mem * 1e6 / n / 2**20:8.1f} MB/Mtok')
+
+
+
+# ----------------------------------------------------------------------
+# Backtracking-prone rules
+
+# Inputs that make the rules of each lexer scan the same characters again
+_ADVERSARIAL = {
+    'GoneLexer': (('comment', lambda n: '/*' + 'x\n' * (n // 2) + '*/'),
+                  ('unterminated', lambda n: '/*' + 'x\n' * (n // 2)),
+                  ('slashes', lambda n: '//' * (n // 2))),
+    'CoolLexer': (('comment', lambda n: '(*' + 'x\n' * (n // 2) + '*)'),
+                  ('unterminated', lambda n: '(*' * (n // 2)),
+                  ('dashes', lambda n: '--' * (n // 2))),
+}
+
+
+@benchmark
+def backtracking(kilobytes='64'):
+    '''
+    Adversarial inputs with the rules as written and with rewrite_patterns.
+    '''
+    import warnings
+    from sly.lex import LexerBuildWarning, _rewrite_pattern
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always', LexerBuildWarning)
+        from Lexer import CoolLexer
+        from gone.tokenizer import GoneLexer
+    for warning in caught:
+        print(warning.message)
+    print()
+
+    for lexer_class in (GoneLexer, CoolLexer):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', LexerBuildWarning)
+            class rewritten(lexer_class):
+                tokens = lexer_class.tokens
+                rewrite_patterns = True
+
+        for name, value in lexer_class._rules:
+            pattern = value if isinstance(value, str) else value.pattern
+            if _rewrite_pattern(pattern, lexer_class.reflags) != pattern:
+                print(f'{lexer_class.__name__}.{name}: {pattern}  ->  '
+                      f'{_rewrite_pattern(pattern, lexer_class.reflags)}')
+
+        for name, make in _ADVERSARIAL[lexer_class.__name__]:
+            size = 1 << 12
+            while size <= int(kilobytes) << 10:
+                text = make(size)
+                times = [min(_lex_time(cls, text) for _ in range(3)) for cls in (lexer_class, rewritten)]
+                print(f'{lexer_class.__name__:<10} {name:<13} {size >> 10:5} kB  '
+                      f'as written={times[0] * 1000:9.1f} ms  rewritten={times[1] * 1000:9.1f} ms')
+                size *= 2
+        print()
+
+
+# ----------------------------------------------------------------------
+# Worst cases and scaling
+
+# Block comment opener and line comment opener of each lexer
+_DELIMITERS = {
+    'CoolLexer': ('(*', '--'),
+    'GoneLexer': ('/*', '//'),
+}
+
+# Worst-case inputs of about n characters, given the comment openers
+_WORST_CASES = (
+    ('identifier', lambda n, block, line: 'a' * n),
+    ('string', lambda n, block, line: '"' + 'a' * (n - 2) + '"'),
+    ('unterminated string', lambda n, block, line: '"' + 'a' * (n - 1)),
+    ('nested openers', lambda n, block, line: block * (n // len(block))),
+    ('unterminated comment', lambda n, block, line: block + 'x\n' * (n // 2)),
+    ('line openers', lambda n, block, line: line * (n // len(line))),
+    ('illegal bytes', lambda n, block, line: '\x01' * n),
+    ('newlines', lambda n, block, line: '\n' * n),
+)
+
+# Growth exponent above which a case is flagged (1 is linear, 2 quadratic)
+SUPERLINEAR = 1.3
+
+
+def _growth(points):
+    '''
+    Exponent k of the best fit of size**k to (size, measure) points.
+    '''
+    import math
+    xs = [math.log(size) for size, _ in points]
+    ys = [math.log(measure) for _, measure in points]
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    return (sum((x - mx) * (y - my) for x, y in zip(xs, ys)) /
+            sum((x - mx) ** 2 for x in xs))
+
+
+def _lex_peak(lexer_class, text):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+        tracemalloc.start()
+        try:
+            for _ in lexer_class().tokenize(text):
+                pass
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+
+def scale(lexer_class, make, kilobytes=1024, seconds=1.0, runs=3):
+    '''
+    Lex make(n) with lexer_class doubling n from 4 kB up to kilobytes, or
+    until a run takes longer than seconds. Return a list of (n, time,
+    peak memory) with the best time of runs and the peak traced memory.
+    '''
+    points = []
+    size = 1 << 12
+    while size <= kilobytes << 10:
+        text = make(size)
+        elapsed = min(_lex_time(lexer_class, text) for _ in range(runs))
+        points.append((size, elapsed, _lex_peak(lexer_class, text)))
+        if elapsed > seconds:
+            break
+        size *= 2
+    return points
+
+
+@benchmark
+def scaling(kilobytes='1024', *names):
+    '''
+    Time and peak memory of worst-case inputs as they double in size.
+    '''
+    for lexer_class, text in lexers():
+        if names and lexer_class.__name__ not in names:
+            continue
+        block, line = _DELIMITERS.get(lexer_class.__name__, ('/*', '//'))
+        cases = _WORST_CASES + (('corpus', lambda n, block, line: (text * (n // len(text) + 1))[:n]),)
+        for name, make in cases:
+            points = scale(lexer_class, lambda n: make(n, block, line), int(kilobytes))
+            # Too short to time or to measure reliably
+            times = [(size, t) for size, t, _ in points if t >= 1e-2]
+            peaks = [(size, peak) for size, _, peak in points if peak >= 64 << 10]
+            time_k = _growth(times) if len(times) > 1 else None
+            peak_k = _growth(peaks) if len(peaks) > 1 else None
+            size, elapsed, peak = points[-1]
+            flags = [what for what, k in (('TIME', time_k), ('MEMORY', peak_k))
+                     if k is not None and k > SUPERLINEAR]
+            growth = '  '.join(f'{what} ~n^{k:.2f}' if k is not None else f'{what} ~n^ -  '
+                               for what, k in (('time', time_k), ('memory', peak_k)))
+            print(f'{lexer_class.__name__:<10} {name:<20} {size >> 10:5} kB  '
+                  f'{elapsed * 1000:9.1f} ms  peak={peak >> 10:7} kB ({peak / size:6.1f}x)  '
+                  f'{growth}  {" ".join("SUPER-LINEAR " + f for f in flags)}')
+        print()
+
+
+# ----------------------------------------------------------------------
+# Lookahead for hand-written parsers
+
+def _lookahead(tokens):
+    # What a predictive parser does: look at the next token, then consume it
+    from sly.lex import TokenStream
+    stream = TokenStream(tokens)
+    n = 0
+    while stream.peek() is not None:
+        stream.peek(1)
+        next(stream)
+        n += 1
+    return n
+
+
+@benchmark
+def stream(repeat='10'):
+    '''
+    Tokens per second and peak memory with a TokenStream and with a list.
+    '''
+    for lexer_class, text in lexers():
+        text *= int(repeat)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+            results = []
+            for name, consume in (('generator', lambda: sum(1 for _ in lexer_class().tokenize(text))),
+                                  ('TokenStream', lambda: _lookahead(lexer_class().tokenize(text))),
+                                  ('list', lambda: len(list(lexer_class().tokenize(text))))):
+                best = None
+                for _ in range(5):
+                    t0 = time.process_time()
+                    n = consume()
+                    elapsed = time.process_time() - t0
+                    best = elapsed if best is None else min(best, elapsed)
+                tracemalloc.start()
+                consume()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                results.append(f'{name}={n / best:10,.0f} tokens/s {peak >> 10:6} kB')
+        print(f'{lexer_class.__name__:<10} ' + '  '.join(results))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        for name, func in BENCHMARKS.items():
+            print(f'{name:<12} {func.__doc__.strip()}')
+        raise SystemExit(1)
+    BENCHMARKS[sys.argv[1]](*sys.argv[2:])
@@ -1,6 +1,8 @@
 
 from .lex import *
 from .yacc import *
+from .pool import *
+from .engine import *
 
 __version__ = "0.5"
-__all__ = [ *lex.__all__, *yacc.__all__ ]
+__all__ = [ *lex.__all__, *yacc.__all__, *pool.__all__, *engine.__all__ ]
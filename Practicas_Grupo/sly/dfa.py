@@ -0,0 +1,499 @@
+# sly/dfa.py
+#
+# Deterministic finite automaton backend for lexers.
+#
+# The rules of a lexer are compiled into a single NFA (Thompson construction)
+# which is turned into a DFA by the subset construction.  The DFA states
+# reachable with ASCII input are built up front; states and transitions for
+# other characters are added on demand the first time they are needed.
+#
+# Scanning gives the tokens of the re alternation used by Lexer: the first
+# rule (in definition order) that matches at the current position wins.
+# The automaton finds the longest match of a rule, which is only the match
+# of re when every choice in the rule is decided by the next character (see
+# _decided() below), or for rules made of literals around one non-greedy
+# repetition of a single character, as comments written /\*(.|\n)*?\*/, where
+# re finds the shortest match.  Other rules, such as a|ab or a+(ab)*, and
+# rules using constructs that have no automaton equivalent (backreferences,
+# anchors, lookarounds, case-insensitive matching, ...) are matched with re
+# instead, in their proper order.
+#
+# The automaton runs in Python, one character at a time, so it is slower
+# than re on ordinary rules (about 0.5-0.7 times the tokens per second on
+# the Cool and Gone lexers).  Its point is a time linear in the length of
+# the token for rules that make re backtrack heavily.
+
+__all__ = [ 'DFAPattern', 'DFAMatch' ]
+
+import re
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    import sre_parse, sre_constants
+
+# Largest repetition count expanded into NFA states
+MAXCOUNT = 64
+
+# Largest number of DFA states built for ASCII input
+MAXSTATES = 4096
+
+class Unsupported(Exception):
+    '''
+    Exception raised for regex constructs that can't be put in an automaton.
+    '''
+    pass
+
+class DFAMatch(object):
+    '''
+    Match object returned by DFAPattern.match(). It supports the subset of
+    the re.Match interface used by Lexer.
+    '''
+    __slots__ = ('string', 'pos', 'endpos', 'lastgroup')
+    def __init__(self, string, pos, endpos, lastgroup):
+        self.string = string
+        self.pos = pos
+        self.endpos = endpos
+        self.lastgroup = lastgroup
+
+    def start(self):
+        return self.pos
+
+    def end(self):
+        return self.endpos
+
+    def group(self):
+        return self.string[self.pos:self.endpos]
+
+# -----------------------------------------------------------------------------
+# Character predicates.  Every set of characters appearing in the rules is
+# represented by a function of one character, following the semantics of
+# the re module for str patterns.
+# -----------------------------------------------------------------------------
+
+def _category(category, flags):
+    C = sre_constants
+    tests = {
+        C.CATEGORY_DIGIT: str.isdecimal,
+        C.CATEGORY_WORD: lambda c: c.isalnum() or c == '_',
+        C.CATEGORY_SPACE: str.isspace,
+    }
+    for positive, negative in ((C.CATEGORY_DIGIT, C.CATEGORY_NOT_DIGIT),
+                               (C.CATEGORY_WORD, C.CATEGORY_NOT_WORD),
+                               (C.CATEGORY_SPACE, C.CATEGORY_NOT_SPACE)):
+        test = tests[positive]
+        if flags & re.ASCII:
+            test = lambda c, test=test: c < '\x80' and test(c)
+        if category is positive:
+            return test
+        if category is negative:
+            return lambda c, test=test: not test(c)
+    raise Unsupported(f'category {category}')
+
+def _charset(items, flags):
+    C = sre_constants
+    negate = False
+    chars = set()
+    tests = []
+    for op, av in items:
+        if op is C.NEGATE:
+            negate = True
+        elif op is C.LITERAL:
+            chars.add(chr(av))
+        elif op is C.RANGE:
+            lo, hi = av
+            tests.append(lambda c, lo=lo, hi=hi: lo <= ord(c) <= hi)
+        elif op is C.CATEGORY:
+            tests.append(_category(av, flags))
+        else:
+            raise Unsupported(f'character set item {op}')
+
+    def test(c):
+        return (c in chars or any(t(c) for t in tests)) != negate
+    return test
+
+# -----------------------------------------------------------------------------
+# NFA construction
+# -----------------------------------------------------------------------------
+
+class _NFA(object):
+    def __init__(self):
+        self.edges = []         # state -> [(predicate number, target)]
+        self.eps = []           # state -> [target]
+        self.accept = {}        # state -> rule number
+        self.predicates = []
+
+    def state(self):
+        self.edges.append([])
+        self.eps.append([])
+        return len(self.edges) - 1
+
+    def edge(self, test):
+        start, end = self.state(), self.state()
+        self.predicates.append(test)
+        self.edges[start].append((len(self.predicates) - 1, end))
+        return start, end
+
+    def build(self, items, flags):
+        '''
+        Build a fragment for a parsed regex. Returns (start, end, nongreedy)
+        '''
+        C = sre_constants
+        start = end = self.state()
+        nongreedy = False
+        for op, av in items:
+            if op is C.LITERAL:
+                if flags & re.IGNORECASE:
+                    raise Unsupported('case-insensitive matching')
+                s, e = self.edge(lambda c, ch=chr(av): c == ch)
+            elif op is C.NOT_LITERAL:
+                if flags & re.IGNORECASE:
+                    raise Unsupported('case-insensitive matching')
+                s, e = self.edge(lambda c, ch=chr(av): c != ch)
+            elif op is C.ANY:
+                if flags & re.DOTALL:
+                    s, e = self.edge(lambda c: True)
+                else:
+                    s, e = self.edge(lambda c: c != '\n')
+            elif op is C.IN:
+                if flags & re.IGNORECASE:
+                    raise Unsupported('case-insensitive matching')
+                s, e = self.edge(_charset(av, flags))
+            elif op is C.SUBPATTERN:
+                _, add_flags, del_flags, sub = av
+                s, e, ng = self.build(sub, (flags | add_flags) & ~del_flags)
+                nongreedy |= ng
+            elif op is C.BRANCH:
+                s, e = self.state(), self.state()
+                for sub in av[1]:
+                    bs, be, ng = self.build(sub, flags)
+                    self.eps[s].append(bs)
+                    self.eps[be].append(e)
+                    nongreedy |= ng
+            elif op in (C.MAX_REPEAT, C.MIN_REPEAT):
+                s, e, ng = self.repeat(av, flags)
+                nongreedy |= ng or op is C.MIN_REPEAT
+            else:
+                raise Unsupported(f'regex construct {op}')
+            self.eps[end].append(s)
+            end = e
+        return start, end, nongreedy
+
+    def repeat(self, av, flags):
+        minimum, maximum, sub = av
+        if minimum > MAXCOUNT or (maximum != sre_constants.MAXREPEAT and maximum > MAXCOUNT):
+            raise Unsupported('repetition count too large')
+        start = end = self.state()
+        nongreedy = False
+        for _ in range(minimum):
+            s, e, nongreedy = self.build(sub, flags)
+            self.eps[end].append(s)
+            end = e
+        if maximum == sre_constants.MAXREPEAT:
+            s, e, nongreedy = self.build(sub, flags)
+            self.eps[end].append(s)
+            self.eps[e].append(end)
+        else:
+            last = self.state()
+            for _ in range(maximum - minimum):
+                s, e, nongreedy = self.build(sub, flags)
+                self.eps[end].append(s)
+                self.eps[end].append(last)
+                end = e
+            self.eps[end].append(last)
+            end = last
+        return start, end, nongreedy
+
+# -----------------------------------------------------------------------------
+# Rules the automaton matches like re.  re tries the choices of a rule in
+# order (more repetitions first for a greedy repetition) and returns the
+# first way the whole rule matches, while the automaton returns its longest
+# match.  Both agree when every choice is decided by the next character:
+# the alternatives of a branch, and repeating or not, start with different
+# characters.  A greedy repetition may also end the rule, since re only
+# gives it back when the next iteration fails.
+#
+# First sets are (chars, wide, end): the ASCII characters a regex can
+# start with, whether it can start with a non-ASCII one, and whether it
+# can end the rule.
+# -----------------------------------------------------------------------------
+
+_ASCII = [ chr(n) for n in range(128) ]
+_END = (frozenset(), False, True)
+
+def _item_first(op, av, flags):
+    # First set of one parsed item, end meaning that it may match nothing
+    C = sre_constants
+    if op is C.LITERAL:
+        return (frozenset(chr(av)) if av < 128 else frozenset()), av >= 128, False
+    if op in (C.NOT_LITERAL, C.ANY, C.IN):
+        test = _charset(av, flags) if op is C.IN else (
+            (lambda c: c != chr(av)) if op is C.NOT_LITERAL else
+            (lambda c: True) if flags & re.DOTALL else (lambda c: c != '\n'))
+        wide = op is not C.IN or any(iop in (C.NEGATE, C.CATEGORY) or
+                                     (iop is C.LITERAL and iav >= 128) or
+                                     (iop is C.RANGE and iav[1] >= 128) for iop, iav in av)
+        return frozenset(c for c in _ASCII if test(c)), wide, False
+    if op is C.SUBPATTERN:
+        _, add_flags, del_flags, sub = av
+        return _first(sub, (flags | add_flags) & ~del_flags, _END)
+    if op is C.BRANCH:
+        return _union(*[ _first(sub, flags, _END) for sub in av[1] ])
+    minimum, _, sub = av
+    chars, wide, end = _first(sub, flags, _END)
+    return chars, wide, end or minimum == 0
+
+def _first(items, flags, follow):
+    # First set of a sequence of items followed by follow
+    firsts = []
+    for op, av in items:
+        first = _item_first(op, av, flags)
+        firsts.append(first)
+        if not first[2]:
+            return _union(*firsts)[:2] + (False,)
+    return _union(*[ first[:2] + (False,) for first in firsts ], follow)
+
+def _union(*firsts):
+    return (frozenset().union(*[ f[0] for f in firsts ]), any(f[1] for f in firsts),
+            any(f[2] for f in firsts))
+
+def _overlap(a, b):
+    # Whether the next character (or the end) can't tell a and b apart
+    return bool(a[0] & b[0]) or (a[1] and b[1]) or (a[2] and any(b)) or (b[2] and any(a))
+
+def _decided(items, flags, follow):
+    # Whether every choice in items, followed by follow, is decided by the
+    # next character
+    C = sre_constants
+    for n in reversed(range(len(items))):
+        op, av = items[n]
+        if op is C.SUBPATTERN:
+            _, add_flags, del_flags, sub = av
+            if not _decided(sub, (flags | add_flags) & ~del_flags, follow):
+                return False
+        elif op is C.BRANCH:
+            starts = [ _first(sub, flags, follow) for sub in av[1] ]
+            if any(_overlap(a, b) for i, a in enumerate(starts) for b in starts[i + 1:]):
+                return False
+            if not all(_decided(sub, flags, follow) for sub in av[1]):
+                return False
+        elif op is C.MAX_REPEAT:
+            minimum, maximum, sub = av
+            first = _first(sub, flags, _END)
+            if maximum != minimum and (first[2] or _overlap(first, follow[:2] + (False,))):
+                return False
+            if not _decided(sub, flags, _union(first, follow)):
+                return False
+        elif op not in (C.LITERAL, C.NOT_LITERAL, C.ANY, C.IN):
+            return False
+        follow = _first(items[n:n + 1], flags, follow)
+    return True
+
+def _single(items):
+    # Items of a single-item group, recursively
+    while len(items) == 1 and items[0][0] is sre_constants.SUBPATTERN:
+        items = items[0][1][3]
+    return items
+
+def _shortest_scan(items):
+    # Whether a rule with a non-greedy repetition is literals, one
+    # non-greedy repetition of a single character and literals, as in
+    # /\*(.|\n)*?\*/.  re then stops at the first place where the literals
+    # after the repetition match, which is the shortest match.
+    C = sre_constants
+    items = list(_single(items))
+    lazy = [ n for n, (op, _) in enumerate(items) if op is C.MIN_REPEAT ]
+    if len(lazy) != 1 or lazy[0] == len(items) - 1:
+        return False
+    if any(op is not C.LITERAL for n, (op, _) in enumerate(items) if n != lazy[0]):
+        return False
+    _, _, body = items[lazy[0]][1]
+    body = _single(body)
+    if len(body) == 1 and body[0][0] is C.BRANCH:
+        return all(len(_single(sub)) == 1 and _single(sub)[0][0] in (C.LITERAL, C.NOT_LITERAL, C.ANY, C.IN)
+                   for sub in body[0][1][1])
+    return len(body) == 1 and body[0][0] in (C.LITERAL, C.NOT_LITERAL, C.ANY, C.IN)
+
+# -----------------------------------------------------------------------------
+# DFA
+# -----------------------------------------------------------------------------
+
+class DFAPattern(object):
+    '''
+    Automaton matching a list of (tokname, regex) lexer rules. match(text,
+    pos) returns a DFAMatch for the first rule that matches at pos, or None.
+    '''
+    def __init__(self, parts, flags=0):
+        self.names = [ tokname for tokname, _ in parts ]
+        self.pattern = '|'.join(part for _, part in parts)
+        self.flags = flags
+        self.fallback = []                    # (rule number, compiled regex)
+        self.nomatch = len(parts)             # rule number meaning "no rule"
+        self.shortest = [ False ] * len(parts) + [ True ]
+
+        nfa = self.nfa = _NFA()
+        self.start_nfa = nfa.state()
+        for n, (tokname, part) in enumerate(parts):
+            mark = len(nfa.edges), len(nfa.predicates)
+            try:
+                parsed = sre_parse.parse(part, flags)
+                s, e, nongreedy = nfa.build(parsed, parsed.state.flags)
+                if not (_shortest_scan(parsed) if nongreedy else
+                        _decided(list(parsed), parsed.state.flags, _END)):
+                    raise Unsupported('longest match may differ from re')
+            except Unsupported:
+                # Discard the partially built fragment and use re for this rule
+                del nfa.edges[mark[0]:], nfa.eps[mark[0]:], nfa.predicates[mark[1]:]
+                self.fallback.append((n, re.compile(part, flags)))
+                continue
+            nfa.eps[self.start_nfa].append(s)
+            nfa.accept[e] = n
+            self.shortest[n] = nongreedy
+
+        self._compute_reach()
+
+        # DFA states: sets of NFA states, transitions and accept information
+        self.states = { }
+        self.sets = [ ]
+        self.trans = [ ]
+        self.char_trans = [ ]
+        self.best = [ ]
+        self.reach = [ ]
+
+        # Character classes.  Characters are grouped by the predicates they
+        # satisfy; ASCII classes are computed now, others on first use.
+        self.signatures = { }
+        self.class_members = [ ]
+        self.ascii_class = [ self._class_of(chr(n)) for n in range(128) ]
+        self.char_class = { }
+
+        self.dead = self._state(frozenset())
+        self.start = self._state(self._closure({ self.start_nfa }))
+        self._build_ascii()
+
+    def _compute_reach(self):
+        # Smallest rule number whose accepting state is reachable from each NFA state
+        nfa = self.nfa
+        reach = [ self.nomatch ] * len(nfa.edges)
+        for state, n in nfa.accept.items():
+            reach[state] = n
+        changed = True
+        while changed:
+            changed = False
+            for state in range(len(nfa.edges)):
+                targets = nfa.eps[state] + [ t for _, t in nfa.edges[state] ]
+                r = min([ reach[state] ] + [ reach[t] for t in targets ])
+                if r < reach[state]:
+                    reach[state] = r
+                    changed = True
+        self.nfa_reach = reach
+
+    def _class_of(self, c):
+        signature = tuple(test(c) for test in self.nfa.predicates)
+        cls = self.signatures.get(signature)
+        if cls is None:
+            cls = self.signatures[signature] = len(self.class_members)
+            self.class_members.append(signature)
+            for row in self.trans:
+                row.append(-1)
+        return cls
+
+    def _closure(self, states):
+        stack = list(states)
+        closure = set(states)
+        while stack:
+            for t in self.nfa.eps[stack.pop()]:
+                if t not in closure:
+                    closure.add(t)
+                    stack.append(t)
+        return frozenset(closure)
+
+    def _state(self, nfa_states):
+        state = self.states.get(nfa_states)
+        if state is None:
+            state = self.states[nfa_states] = len(self.sets)
+            self.sets.append(nfa_states)
+            self.trans.append([ -1 ] * len(self.class_members))
+            self.char_trans.append({ })
+            accepting = [ self.nfa.accept[s] for s in nfa_states if s in self.nfa.accept ]
+            self.best.append(min(accepting, default=self.nomatch))
+            self.reach.append(min((self.nfa_reach[s] for s in nfa_states), default=self.nomatch))
+        return state
+
+    def _step(self, state, cls):
+        signature = self.class_members[cls]
+        targets = { t for s in self.sets[state] for p, t in self.nfa.edges[s] if signature[p] }
+        nxt = self._state(self._closure(targets)) if targets else self.dead
+        self.trans[state][cls] = nxt
+        return nxt
+
+    def _char_step(self, state, c):
+        # Transition on character c, memoized per state by character
+        if c < '\x80':
+            cls = self.ascii_class[ord(c)]
+        else:
+            cls = self.char_class.get(c)
+            if cls is None:
+                cls = self.char_class[c] = self._class_of(c)
+        nxt = self.trans[state][cls]
+        if nxt < 0:
+            nxt = self._step(state, cls)
+        self.char_trans[state][c] = nxt
+        return nxt
+
+    def _build_ascii(self):
+        classes = sorted(set(self.ascii_class))
+        pending = [ self.start ]
+        seen = { self.start }
+        while pending:
+            state = pending.pop()
+            for cls in classes:
+                nxt = self._step(state, cls)
+                if nxt not in seen:
+                    seen.add(nxt)
+                    pending.append(nxt)
+            if len(self.sets) > MAXSTATES:
+                raise Unsupported('too many automaton states')
+        for state, row in enumerate(self.char_trans):
+            row.update((chr(n), self.trans[state][cls]) for n, cls in enumerate(self.ascii_class))
+
+    def match(self, text, pos=0):
+        char_trans = self.char_trans
+        best = self.best
+        reach = self.reach
+        shortest = self.shortest
+        dead = self.dead
+
+        state = self.start
+        winner = self.nomatch
+        end = pos
+        index = pos
+        n = len(text)
+        while True:
+            rule = best[state]
+            if rule < winner or (rule == winner and not shortest[rule]):
+                winner = rule
+                end = index
+            r = reach[state]
+            if r >= winner and (r > winner or shortest[winner]) or index == n:
+                break
+            c = text[index]
+            nxt = char_trans[state].get(c)
+            if nxt is None:
+                nxt = self._char_step(state, c)
+            state = nxt
+            if state == dead:
+                break
+            index += 1
+
+        # Rules handled by re come before the automaton winner
+        for rule, regex in self.fallback:
+            if rule > winner:
+                break
+            m = regex.match(text, pos)
+            if m:
+                return DFAMatch(text, pos, m.end(), self.names[rule])
+
+        if winner == self.nomatch:
+            return None
+        return DFAMatch(text, pos, end, self.names[winner])
@@ -0,0 +1,199 @@
+# sly/engine.py
+#
+# Matching engines for Lexer.regex_module.
+#
+# A lexer compiles its rules with regex_module.compile(pattern, flags), where
+# pattern is the alternation (?P<NAME1>regex1)|(?P<NAME2>regex2)|... of its
+# rules, and only relies on this part of the re interface:
+#
+#     compiled.pattern             source of the pattern
+#     compiled.match(text, pos)    match object or None
+#     compiled.search(text, pos)   match object or None (coalesce_errors)
+#     m.lastgroup, m.end(), m.group()
+#
+# RegexModule adapts an engine to that interface.  Two engines are provided
+# besides re: the third-party regex package, if installed, and the sly.dfa
+# automaton, which matches in time linear in the length of the token but
+# is usually slower than re (see sly/dfa.py).
+
+__all__ = [ 'RegexModule', 'available_engines', 'compare_engines' ]
+
+import re
+import time
+
+from .dfa import DFAPattern, Unsupported
+from .lex import _REGEX_TOKEN
+
+try:
+    import regex as _regex
+except ImportError:
+    _regex = None
+
+class RegexModule(object):
+    '''
+    Matching engine usable as the regex_module of a Lexer. compile(pattern,
+    flags) is called with the flags of the re module and must return an
+    object with the interface described at the top of sly/engine.py.
+    '''
+    error = re.error
+
+    def __init__(self, name, compile):
+        self.__name__ = name
+        self._compile = compile
+
+    def __repr__(self):
+        return f'RegexModule({self.__name__!r})'
+
+    def compile(self, pattern, flags=0):
+        return self._compile(pattern, flags)
+
+# -----------------------------------------------------------------------------
+# regex package.  Its flags have the names of those of re, but not always
+# the same values.
+# -----------------------------------------------------------------------------
+
+_FLAG_NAMES = ('ASCII', 'IGNORECASE', 'LOCALE', 'MULTILINE', 'DOTALL', 'UNICODE', 'VERBOSE')
+
+def _regex_compile(pattern, flags):
+    rflags = 0
+    for name in _FLAG_NAMES:
+        if flags & getattr(re, name):
+            rflags |= getattr(_regex, name)
+    try:
+        return _regex.compile(pattern, rflags)
+    except _regex.error as e:
+        raise re.error(str(e), pattern) from e
+
+# The regex package, or None if it is not installed
+regex = RegexModule('regex', _regex_compile) if _regex else None
+
+# -----------------------------------------------------------------------------
+# sly.dfa automaton.  The alternation is split back into its rules, which
+# become the rules of a DFAPattern.  Searches are left to re.
+# -----------------------------------------------------------------------------
+
+class _AutomatonPattern(object):
+    __slots__ = ('pattern', 'flags', 'match', '_search')
+    def __init__(self, pattern, flags, dfa):
+        self.pattern = pattern
+        self.flags = flags
+        self.match = dfa.match
+        self._search = None
+
+    def search(self, text, pos=0):
+        if self._search is None:
+            self._search = re.compile(self.pattern, self.flags).search
+        return self._search(text, pos)
+
+def _alternatives(pattern):
+    '''
+    Split a regex at the | of its top level.
+    '''
+    alternatives = [[]]
+    depth = 0
+    for tok in _REGEX_TOKEN.findall(pattern):
+        if tok == '|' and depth == 0:
+            alternatives.append([])
+            continue
+        if tok.startswith('(') and not tok.endswith(')'):
+            depth += 1
+        elif tok == ')':
+            depth -= 1
+        alternatives[-1].append(tok)
+    return [ ''.join(toks) for toks in alternatives ]
+
+def _automaton_compile(pattern, flags):
+    if flags & re.VERBOSE:
+        return re.compile(pattern, flags)
+    parts = []
+    for alternative in _alternatives(pattern):
+        names = list(re.compile(alternative, flags).groupindex)
+        if names and alternative.startswith(f'(?P<{names[0]}>') and alternative.endswith(')'):
+            parts.append((names[0], alternative))
+        else:
+            parts.append((None, alternative))
+    try:
+        return _AutomatonPattern(pattern, flags, DFAPattern(parts, flags))
+    except Unsupported:
+        return re.compile(pattern, flags)
+
+# The sly.dfa automaton.  Rules it can't handle are matched with re, and
+# re is used for the whole pattern if the automaton grows too large.
+automaton = RegexModule('sly.dfa', _automaton_compile)
+
+def available_engines():
+    '''
+    Return a dictionary of the engines available, by name.
+    '''
+    available = { 're': re, 'automaton': automaton }
+    if regex is not None:
+        available['regex'] = regex
+    return available
+
+# -----------------------------------------------------------------------------
+# Comparison of engines
+# -----------------------------------------------------------------------------
+
+class EngineRun(object):
+    '''
+    Result of lexing a corpus with one engine in compare_engines(). elapsed
+    is the best processor time of the runs and mismatches lists the numbers
+    of the texts whose token stream differs from that of the first engine.
+    '''
+    __slots__ = ('name', 'tokens', 'elapsed', 'mismatches')
+    def __init__(self, name, tokens, elapsed, mismatches):
+        self.name = name
+        self.tokens = tokens
+        self.elapsed = elapsed
+        self.mismatches = mismatches
+
+    def __repr__(self):
+        return (f'EngineRun({self.name!r}, tokens={self.tokens}, elapsed={self.elapsed:.4f}, '
+                f'mismatches={self.mismatches})')
+
+    @property
+    def tokens_per_second(self):
+        return self.tokens / self.elapsed if self.elapsed else 0.0
+
+def _token_stream(lexer_class, text):
+    return [ (tok.type, tok.value, tok.lineno, tok.index, tok.end)
+             for tok in lexer_class().tokenize(text) ]
+
+def compare_engines(lexer_class, texts, engines=None, runs=1):
+    '''
+    Lex every text with a copy of lexer_class for each of the engines (a
+    dictionary of regex modules by name, all the available ones by default)
+    and return a list of EngineRun, one per engine. Token streams are
+    compared with those of the first engine:
+
+        for run in compare_engines(GoneLexer, texts):
+            print(run.name, run.tokens_per_second, run.mismatches)
+
+    Lexer states entered with begin() keep the regex module of their class.
+    '''
+    if engines is None:
+        engines = available_engines()
+    texts = list(texts)
+    results = []
+    expected = None
+    for name, module in engines.items():
+        class engine_class(lexer_class):
+            tokens = lexer_class.tokens
+            regex_module = module
+
+        streams = [ _token_stream(engine_class, text) for text in texts ]
+        best = None
+        for _ in range(runs):
+            t0 = time.process_time()
+            for text in texts:
+                for _ in engine_class().tokenize(text):
+                    pass
+            elapsed = time.process_time() - t0
+            best = elapsed if best is None else min(best, elapsed)
+
+        if expected is None:
+            expected = streams
+        mismatches = [ n for n, (stream, reference) in enumerate(zip(streams, expected))
+                       if stream != reference ]
+        results.append(EngineRun(name, sum(map(len, streams)), best, mismatches))
+    return results
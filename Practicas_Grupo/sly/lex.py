@@ -31,10 +31,455 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 # -----------------------------------------------------------------------------
 
-__all__ = ['Lexer', 'LexerStateChange']
+__all__ = ['Lexer', 'LexerStateChange', 'LexerProfile', 'TokenStream']
 
 import re
+import os
 import copy
+import codecs
+import hashlib
+import json
+import sys
+import time
+import warnings
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import partial
+from types import MappingProxyType
+
+from .dfa import DFAPattern, Unsupported, _charset
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    import sre_parse, sre_constants
+
+# Directory where the signatures of already validated rule sets are
+# recorded, with the backtracking risks found in their rules, so that
+# later processes building the same lexer can skip the validation of
+# every individual rule.  Disabled if None.
+CACHE_DIR = os.environ.get('SLY_CACHE_DIR')
+
+# Master regular expressions compiled in this process, by rule set signature
+_build_cache = { }
+
+def _signature_path(signature):
+    digest = hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, f'{digest}.lex')
+
+def _cached_signature(signature):
+    # The (tokname, risk) pairs recorded for signature, or None
+    if not CACHE_DIR:
+        return None
+    try:
+        with open(_signature_path(signature)) as f:
+            return [ tuple(risk) for risk in json.load(f) ]
+    except (OSError, ValueError, TypeError):
+        return None
+
+def _cache_signature(signature, risks):
+    if CACHE_DIR:
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(_signature_path(signature), 'w') as f:
+                json.dump(risks, f)
+        except OSError:
+            pass
+
+# -----------------------------------------------------------------------------
+# First character analysis of regular expressions.
+#
+# _first_chars() computes the characters a parsed regex can start with as a
+# tuple (chars, wide, nullable).  chars is a set of characters or None if
+# the regex can start with any character.  wide is True if it may also start
+# with non-ASCII characters not listed in chars (as \w or \d do) and
+# nullable is True if it can match the empty string.
+# -----------------------------------------------------------------------------
+
+_ASCII = [ chr(n) for n in range(128) ]
+
+_ATOMIC_GROUP = getattr(sre_constants, 'ATOMIC_GROUP', None)
+_REPEATS = { sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+             getattr(sre_constants, 'POSSESSIVE_REPEAT', sre_constants.MAX_REPEAT) }
+_ZERO_WIDTH = { sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT }
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: r'\d',
+    sre_constants.CATEGORY_WORD: r'\w',
+    sre_constants.CATEGORY_SPACE: r'\s',
+}
+
+def _casefold(chars, flags, source=None):
+    # Add the characters that match chars without regard to case, as found
+    # by re itself (which also matches s and U+017F, k and U+212A, i and
+    # U+0130), and tell if other non-ASCII characters may match.  source is
+    # the class chars was taken from, if it has more characters.
+    if not flags & re.IGNORECASE:
+        return chars, False
+    if source is None:
+        source = ''.join(map(re.escape, chars))
+    match = re.compile(f'[{source}]', flags & (re.IGNORECASE | re.ASCII)).match
+    folded = { c for c in _ASCII if match(c) }
+    folded.update(f for c in chars for f in (c, c.lower(), c.upper(), c.swapcase()) if len(f) == 1 and match(f))
+    return folded, not flags & re.ASCII and any(c.lower() != c.upper() for c in folded)
+
+def _first_class(items, flags):
+    chars = set()
+    wide = False
+    source = []
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            chars.add(chr(av))
+            source.append(re.escape(chr(av)))
+        elif op is sre_constants.RANGE:
+            lo, hi = av
+            chars.update(map(chr, range(lo, min(hi, 127) + 1)))
+            wide |= hi > 127
+            source.append(f'{re.escape(chr(lo))}-{re.escape(chr(hi))}')
+        elif op is sre_constants.CATEGORY and av in _CATEGORIES:
+            pattern = re.compile(_CATEGORIES[av], flags & re.ASCII)
+            chars.update(c for c in _ASCII if pattern.match(c))
+            wide |= not flags & re.ASCII
+            source.append(_CATEGORIES[av])
+        else:
+            return None, True
+    chars, folded = _casefold(chars, flags, ''.join(source))
+    return chars, wide or folded
+
+def _first_chars(items, flags):
+    chars = set()
+    wide = False
+    for op, av in items:
+        nullable = False
+        if op is sre_constants.LITERAL:
+            first, fwide = _casefold({ chr(av) }, flags)
+        elif op is sre_constants.IN:
+            first, fwide = _first_class(av, flags)
+        elif op is sre_constants.SUBPATTERN:
+            _, add_flags, del_flags, sub = av
+            first, fwide, nullable = _first_chars(sub, (flags | add_flags) & ~del_flags)
+        elif op is _ATOMIC_GROUP:
+            first, fwide, nullable = _first_chars(av, flags)
+        elif op is sre_constants.BRANCH:
+            first, fwide, nullable = set(), False, False
+            for sub in av[1]:
+                bfirst, bwide, bnullable = _first_chars(sub, flags)
+                if bfirst is None:
+                    return None, True, False
+                first |= bfirst
+                fwide |= bwide
+                nullable |= bnullable
+        elif op in _REPEATS:
+            minimum, _, sub = av
+            first, fwide, nullable = _first_chars(sub, flags)
+            nullable |= minimum == 0
+        elif op in _ZERO_WIDTH:
+            first, fwide, nullable = set(), False, True
+        else:
+            return None, True, False
+
+        if first is None:
+            return None, True, False
+        chars |= first
+        wide |= fwide
+        if not nullable:
+            return chars, wide, False
+    return chars, wide, True
+
+def _build_dispatch(parts, flags, compile):
+    '''
+    Build a table mapping a first character to the compiled alternation of
+    the (tokname, regex) parts that can start with it, in rule order.
+    Returns the table and the pattern for characters not in the table.
+    A None pattern means that no rule can match.
+    '''
+    firsts = []
+    for _, part in parts:
+        parsed = sre_parse.parse(part, flags)
+        chars, wide, _ = _first_chars(parsed, parsed.state.flags)
+        firsts.append((chars, wide))
+
+    keys = set(_ASCII)
+    for chars, _ in firsts:
+        keys.update(chars or ())
+
+    compiled = { }
+    def subset(selected):
+        selected = tuple(selected)
+        if selected not in compiled:
+            compiled[selected] = (compile('|'.join(parts[n][1] for n in selected), flags)
+                                  if selected else None)
+        return compiled[selected]
+
+    dispatch = { }
+    for c in keys:
+        dispatch[c] = subset(n for n, (chars, wide) in enumerate(firsts)
+                             if chars is None or c in chars or (wide and c > '\x7f'))
+    default = subset(n for n, (chars, wide) in enumerate(firsts) if chars is None or wide)
+    return dispatch, default
+
+# -----------------------------------------------------------------------------
+# Profile-guided rule ordering.
+#
+# The order of two rules in an alternation only matters if both can match at
+# the same position.  _prefix_sets() computes the characters every match of
+# a rule has at each of its first positions; two rules are exclusive if they
+# differ at some position, and exclusive rules can be tried in any order.
+# _order_parts() moves the rules matched most often in a training corpus
+# (as recorded by LexerProfile) ahead of the exclusive rules before them.
+# -----------------------------------------------------------------------------
+
+# Number of leading positions compared
+_PREFIX_LENGTH = 4
+
+def _prefix_sets(items, flags, limit=_PREFIX_LENGTH):
+    '''
+    Return (prefix, complete) where prefix lists the (chars, wide) sets of
+    the characters that every match of a parsed regex has at each of its
+    first positions, as far as they are known, and complete is True if
+    the whole regex was accounted for (so that what follows it extends
+    the prefix).
+    '''
+    prefix = []
+    for op, av in items:
+        if len(prefix) >= limit:
+            return prefix, False
+        if op is sre_constants.LITERAL:
+            chars, wide = _casefold({ chr(av) }, flags)
+        elif op is sre_constants.IN:
+            chars, wide = _first_class(av, flags)
+        elif op is sre_constants.SUBPATTERN:
+            _, add_flags, del_flags, sub = av
+            sub, complete = _prefix_sets(sub, (flags | add_flags) & ~del_flags, limit - len(prefix))
+            prefix.extend(sub)
+            if not complete:
+                return prefix, False
+            continue
+        elif op in _REPEATS and av[0] > 0:
+            # One copy at least, then an unknown number of them
+            sub, _ = _prefix_sets(av[2], flags, limit - len(prefix))
+            return prefix + sub, False
+        elif op is sre_constants.BRANCH:
+            branches = [ _prefix_sets(sub, flags, limit - len(prefix))[0] for sub in av[1] ]
+            for position in zip(*branches):
+                prefix.append((set().union(*(chars for chars, _ in position)),
+                               any(wide for _, wide in position)))
+            return prefix, False
+        else:
+            return prefix, False
+        if chars is None:
+            return prefix, False
+        prefix.append((chars, wide))
+    return prefix, True
+
+def _exclusive(first, second):
+    '''
+    True if two prefixes computed by _prefix_sets() can't both match at
+    the same position.
+    '''
+    for (chars1, wide1), (chars2, wide2) in zip(first, second):
+        if chars1 & chars2 or (wide1 and wide2):
+            continue
+        if wide1 and any(c > '\x7f' for c in chars2) or wide2 and any(c > '\x7f' for c in chars1):
+            continue
+        return True
+    return False
+
+def _order_parts(parts, flags, counts):
+    '''
+    Reorder the (tokname, regex) parts by decreasing count, only moving
+    a part ahead of the parts it is exclusive with. counts maps token
+    names to their number of matches.
+    '''
+    prefixes = []
+    for _, part in parts:
+        parsed = sre_parse.parse(part, flags)
+        prefixes.append(_prefix_sets(parsed, parsed.state.flags)[0])
+    exclusive = [ [ _exclusive(p, q) for q in prefixes ] for p in prefixes ]
+
+    count = [ counts.get(tokname, 0) for tokname, _ in parts ]
+    remaining = list(range(len(parts)))
+    order = []
+    while remaining:
+        # Parts that no remaining part before them could match instead,
+        # ranked by the count of the most frequent part they hold back
+        ready = { }
+        for i, n in enumerate(remaining):
+            if all(exclusive[m][n] for m in remaining[:i]):
+                held = [ count[m] for m in remaining[i + 1:] if not exclusive[n][m] ]
+                ready[n] = (max([count[n], *held]), count[n])
+        best = max(ready, key=ready.get)
+        order.append(best)
+        remaining.remove(best)
+    return [ parts[n] for n in order ]
+
+# -----------------------------------------------------------------------------
+# Backtracking analysis of regular expressions.
+#
+# _backtracking_risks() looks in a parsed regex for the constructs that make
+# a backtracking matcher retry the same characters many times: alternations
+# of single characters inside a repetition such as (.|\n)*, nested unbounded
+# repetitions, .* followed by a character it cannot match such as '.*\n,
+# and alternatives starting with the same expression.
+#
+# _rewrite_pattern() rewrites the constructs that have an equivalent form
+# matching exactly the same text: (.|\n) becomes (?s:.) and X* or X+
+# followed by a character that X cannot match becomes possessive (X*+,
+# X++) where the re module supports it.
+# -----------------------------------------------------------------------------
+
+_SINGLE = { sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN }
+_POSSESSIVE = hasattr(sre_constants, 'POSSESSIVE_REPEAT')
+
+def _canonical(value):
+    if isinstance(value, (sre_parse.SubPattern, list, tuple)):
+        return tuple(_canonical(v) for v in value)
+    return value
+
+def _unbounded(items):
+    for op, av in items:
+        if op in _REPEATS:
+            if av[1] == sre_constants.MAXREPEAT or _unbounded(av[2]):
+                return True
+        elif op is sre_constants.SUBPATTERN:
+            if _unbounded(av[3]):
+                return True
+        elif op is sre_constants.BRANCH:
+            if any(_unbounded(sub) for sub in av[1]):
+                return True
+    return False
+
+def _char_test(item, flags):
+    '''
+    Return a function telling if a single character item matches a
+    character, or None if the item is not a single character.
+    '''
+    op, av = item
+    if op is sre_constants.SUBPATTERN and len(av[3]) == 1:
+        return _char_test(av[3][0], (flags | av[1]) & ~av[2])
+    if op not in _SINGLE or flags & re.IGNORECASE:
+        return None
+    if op is sre_constants.LITERAL:
+        return lambda c: c == chr(av)
+    if op is sre_constants.NOT_LITERAL:
+        return lambda c: c != chr(av)
+    if op is sre_constants.ANY:
+        return (lambda c: True) if flags & re.DOTALL else (lambda c: c != '\n')
+    try:
+        return _charset(av, flags)
+    except Unsupported:
+        return None
+
+def _literal_chars(item, flags):
+    '''
+    Return the set of characters matched by a literal or a class of
+    literals, or None for any other item.
+    '''
+    op, av = item
+    if flags & re.IGNORECASE:
+        return None
+    if op is sre_constants.LITERAL:
+        return { chr(av) }
+    if op is sre_constants.IN and all(iop is sre_constants.LITERAL for iop, _ in av):
+        return { chr(iav) for _, iav in av }
+    return None
+
+def _disjoint(test, chars):
+    return test is not None and chars is not None and not any(test(c) for c in chars)
+
+def _backtracking_risks(items, flags, repeated=False):
+    '''
+    Generate a description of every backtracking-prone construct in a
+    parsed regex. repeated is True inside an unbounded repetition.
+    '''
+    items = list(items)
+    for n, (op, av) in enumerate(items):
+        if op is sre_constants.SUBPATTERN:
+            _, add_flags, del_flags, sub = av
+            yield from _backtracking_risks(sub, (flags | add_flags) & ~del_flags, repeated)
+
+        elif op is sre_constants.BRANCH:
+            alternatives = av[1]
+            if repeated and all(len(sub) == 1 and sub[0][0] in _SINGLE for sub in alternatives):
+                yield 'alternation of single characters inside a repetition, use a character class or (?s:.)'
+            firsts = [ _canonical(sub[0]) for sub in alternatives if len(sub) ]
+            if len(set(firsts)) < len(firsts):
+                yield 'alternatives starting with the same expression are matched again from the start'
+            for sub in alternatives:
+                yield from _backtracking_risks(sub, flags, repeated)
+
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            _, maximum, sub = av
+            unbounded = maximum == sre_constants.MAXREPEAT
+            if unbounded and _unbounded(sub):
+                yield 'nested unbounded repetitions'
+            if (op is sre_constants.MAX_REPEAT and unbounded and n + 1 < len(items) and
+                len(sub) == 1 and sub[0][0] is sre_constants.ANY and
+                _disjoint(_char_test(sub[0], flags), _literal_chars(items[n + 1], flags))):
+                yield 'greedy .* followed by a character it cannot match, it could be possessive'
+            yield from _backtracking_risks(sub, flags, repeated or unbounded)
+
+        elif op is sre_constants.ASSERT or op is sre_constants.ASSERT_NOT:
+            yield from _backtracking_risks(av[1], flags, repeated)
+
+# Tokens of the source of a regex.  Multi-character escapes and character
+# classes are single tokens, group openers include their (?...) prefix.
+_REGEX_TOKEN = re.compile(r'''
+    \\x[0-9a-fA-F]{2} | \\u[0-9a-fA-F]{4} | \\U[0-9a-fA-F]{8} | \\N\{[^}]*\} | \\[0-9]{1,3} | \\.
+  | \[\^?\]?(?:\\.|[^\]\\])*\]
+  | \(\?\#[^)]*\) | \(\?P=\w+\) | \(\?[aiLmsux]+\)
+  | \((?:\?(?:P<\w+>|<[=!]|[=!>:]|[aiLmsux]*(?:-[imsx]+)?:))?
+  | \{\d*,?\d*\}[?+]? | [*+?][?+]?
+  | [\s\S]
+''', re.VERBOSE)
+
+_QUANTIFIER = re.compile(r'[*+?{]')
+_NEWLINE = { r'\n', '\n' }
+
+def _parse_item(source, flags):
+    try:
+        items = sre_parse.parse(source, flags)
+    except re.error:
+        return None, flags
+    return (items[0] if len(items) == 1 else None), items.state.flags
+
+def _rewrite_pattern(pattern, flags, possessive=True):
+    '''
+    Rewrite the backtracking-prone constructs of a regex into equivalent,
+    cheaper forms. The pattern is returned unchanged if it can't be analyzed.
+    '''
+    if flags & re.VERBOSE or '(?(' in pattern or re.search(r'\\[1-9]|\(\?P=|\(\?[-aiLmsux]', pattern):
+        return pattern
+    toks = _REGEX_TOKEN.findall(pattern)
+
+    # (.|\n) and (\n|.) match any character
+    n = 0
+    while n + 4 < len(toks):
+        if (toks[n] in ('(', '(?:') and toks[n + 2] == '|' and toks[n + 4] == ')' and
+            { toks[n + 1], toks[n + 3] } in ({ '.', r'\n' }, { '.', '\n' })):
+            toks[n:n + 5] = ['(?s:.)']
+        n += 1
+
+    # X* and X+ followed by a character that X cannot match never give back
+    if possessive and _POSSESSIVE:
+        for n in range(1, len(toks) - 1):
+            if toks[n] not in ('*', '+'):
+                continue
+            if n + 2 < len(toks) and _QUANTIFIER.match(toks[n + 2]):
+                continue
+            atom, atom_flags = _parse_item(toks[n - 1], flags)
+            follower, follower_flags = _parse_item(toks[n + 1], flags)
+            if atom and follower and _disjoint(_char_test(atom, atom_flags),
+                                               _literal_chars(follower, follower_flags)):
+                toks[n] += '+'
+
+    rewritten = ''.join(toks)
+    try:
+        if re.compile(rewritten, flags).groupindex != re.compile(pattern, flags).groupindex:
+            return pattern
+    except re.error:
+        return pattern
+    return rewritten
 
 class LexError(Exception):
     '''
@@ -55,6 +500,12 @@ class PatternError(Exception):
     '''
     pass
 
+class LexerBuildWarning(UserWarning):
+    '''
+    Warning issued if a rule of a lexer is prone to heavy backtracking.
+    '''
+    pass
+
 class LexerBuildError(Exception):
     '''
     Exception raised if there's some sort of problem building the lexer.
@@ -77,14 +528,453 @@ class Token(object):
     def __repr__(self):
         return f'Token(type={self.type!r}, value={self.value!r}, lineno={self.lineno}, index={self.index}, end={self.end})'
 
+def _newline_counter(text):
+    '''
+    Return a function of (start, end) counting the newlines in
+    text[start:end], for str, bytes, bytearray or mmap text.
+    '''
+    if isinstance(text, str):
+        return partial(text.count, '\n')
+    if hasattr(text, 'count'):
+        return partial(text.count, b'\n')
+    return lambda start, end: text[start:end].count(b'\n')
+
+def _decoded(value):
+    # Token values read from bytes are Latin-1, which leaves ASCII unchanged
+    return value if isinstance(value, str) else value.decode('latin-1')
+
+class LineIndex(object):
+    '''
+    Line numbers and columns of the offsets of a text. Offsets asked for
+    in increasing order are resolved by counting the newlines since the
+    previous one; otherwise the sorted offsets of all the newlines are
+    built once and searched by bisection. lineno is the line number at
+    offset start. offset is the position of text in the whole input, for
+    tokens lexed from a part of it.
+    '''
+    __slots__ = ('text', 'start', 'base', 'offset', '_newlines', '_pos', '_line', '_count')
+    def __init__(self, text, lineno=1, start=0, offset=0):
+        self.text = text
+        self.start = start
+        self.base = lineno
+        self.offset = offset
+        self._newlines = None
+        self._pos = start
+        self._line = lineno
+        self._count = _newline_counter(text)
+
+    @property
+    def newlines(self):
+        if self._newlines is None:
+            newlines = array('q')
+            find = self.text.find
+            newline = '\n' if isinstance(self.text, str) else b'\n'
+            pos = find(newline)
+            while pos >= 0:
+                newlines.append(pos)
+                pos = find(newline, pos + 1)
+            self._newlines = newlines
+            self.base -= bisect_left(newlines, self.start)
+        return self._newlines
+
+    def lineno(self, index):
+        if index >= self._pos:
+            self._line += self._count(self._pos, index)
+            self._pos = index
+            return self._line
+        newlines = self.newlines
+        return self.base + bisect_left(newlines, index)
+
+    def column(self, index):
+        '''
+        Column of offset index, counting from 1.
+        '''
+        newlines = self.newlines
+        n = bisect_left(newlines, index)
+        return index - (newlines[n - 1] if n else -1)
+
+class IndexedToken(Token):
+    '''
+    Token produced by a lexer with line_index set. Its line number and
+    column are computed from the position of the token when first used.
+    Assigning lineno overrides the computed value.
+    '''
+    __slots__ = ('lines',)
+
+    @property
+    def lineno(self):
+        try:
+            return Token.lineno.__get__(self)
+        except AttributeError:
+            return self.lines.lineno(self.index - self.lines.offset)
+
+    @lineno.setter
+    def lineno(self, value):
+        Token.lineno.__set__(self, value)
+
+    @property
+    def column(self):
+        return self.lines.column(self.index - self.lines.offset)
+
+class BytesToken(Token):
+    '''
+    Token produced by a lexer tokenizing bytes. Its value is kept as the
+    bytes matched and only decoded (as Latin-1) to str when first used.
+    '''
+    __slots__ = ()
+
+    def _decoded_value(self):
+        value = Token.value.__get__(self)
+        if type(value) is bytes:
+            value = value.decode('latin-1')
+            Token.value.__set__(self, value)
+        return value
+
+    # Setting the value stays a plain slot assignment
+    value = property(_decoded_value, Token.value.__set__)
+
+class IndexedBytesToken(IndexedToken, BytesToken):
+    '''
+    BytesToken produced by a lexer with line_index set.
+    '''
+    __slots__ = ()
+
+class TokenColumns(object):
+    '''
+    Tokens of a text stored column by column in typed arrays. Entry i of
+    the type, index, end and lineno arrays describes the i-th token, with
+    type holding a code into the types list. Token values are sliced from
+    the text when requested and passed through the converter of their
+    type, if any, except values replaced by a rule function, which are
+    kept in the values dictionary. The converter is taken from converters
+    or, for the codes whose entry in the states list is a lexer state
+    class, from the converters of that state.
+    '''
+    def __init__(self, text, types=(), converters={}):
+        self.text = text
+        self.types = list(types)
+        self.states = [None] * len(self.types)
+        self.type = array('H')
+        self.index = array('q')
+        self.end = array('q')
+        self.lineno = array('L')
+        self.values = { }
+        self.converters = dict(converters)
+        self._codes = { (name, None): code for code, name in enumerate(self.types) }
+
+    def append(self, tok, state=None):
+        '''
+        Append tok. state is the lexer state class that produced it, if
+        its converters are not those of the columns.
+        '''
+        if state is not None and state._converters.get(tok.type) is self.converters.get(tok.type):
+            state = None
+        code = self._codes.get((tok.type, state))
+        if code is None:
+            code = self._codes[tok.type, state] = len(self.types)
+            self.types.append(tok.type)
+            self.states.append(state)
+        value = Token.value.__get__(tok)
+        if type(value) is bytes and not isinstance(self.text, str):
+            # Matched in the text and never decoded
+            pass
+        elif (type(value) is not str or len(value) != tok.end - tok.index
+              or not isinstance(self.text, str) or not self.text.startswith(value, tok.index)):
+            self.values[len(self.type)] = value
+        self.type.append(code)
+        self.index.append(tok.index)
+        self.end.append(tok.end)
+        self.lineno.append(tok.lineno)
+
+    def extend(self, other, lineno_delta=0, start=0):
+        '''
+        Append the tokens of another TokenColumns of the same text, from
+        the start-th on, adding lineno_delta to their line numbers.
+        '''
+        codes = []
+        for key in zip(other.types, other.states):
+            code = self._codes.get(key)
+            if code is None:
+                code = self._codes[key] = len(self.types)
+                self.types.append(key[0])
+                self.states.append(key[1])
+            codes.append(code)
+        offset = len(self.type) - start
+        if codes == list(range(len(codes))):
+            self.type.extend(other.type[start:])
+        else:
+            self.type.extend(array('H', [ codes[code] for code in other.type[start:] ]))
+        self.index.extend(other.index[start:])
+        self.end.extend(other.end[start:])
+        if lineno_delta:
+            self.lineno.extend(array('L', [ lineno + lineno_delta for lineno in other.lineno[start:] ]))
+        else:
+            self.lineno.extend(other.lineno[start:])
+        for n, value in other.values.items():
+            if n >= start:
+                self.values[offset + n] = value
+
+    # The type codes are rebuilt instead of pickled
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_codes']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._codes = { key: code for code, key in enumerate(zip(self.types, self.states)) }
+
+    def value(self, n):
+        if n in self.values:
+            return self.values[n]
+        value = _decoded(self.text[self.index[n]:self.end[n]])
+        code = self.type[n]
+        state = self.states[code]
+        converters = self.converters if state is None else state._converters
+        if converters:
+            converter = converters.get(self.types[code])
+            if converter is not None:
+                return converter(value)
+        return value
+
+    def __len__(self):
+        return len(self.type)
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += len(self)
+        tok = Token()
+        tok.type = self.types[self.type[n]]
+        tok.value = self.value(n)
+        tok.lineno = self.lineno[n]
+        tok.index = self.index[n]
+        tok.end = self.end[n]
+        return tok
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+class TextView(object):
+    '''
+    Read-only view of text[start:end].  The characters are only copied
+    when they are actually used, so error tokens can refer to the rest
+    of the input without copying it. Views of bytes are decoded as
+    Latin-1.
+
+    A view supports len(), indexing, slicing, comparisons, in, +,
+    format() and the methods of str, and is pickled and copied as a str,
+    but it is not a str: isinstance(view, str) is false and the functions
+    of re only accept str(view).
+    '''
+    __slots__ = ('text', 'start', 'end')
+    def __init__(self, text, start, end=None):
+        self.text = text
+        self.start = start
+        self.end = len(text) if end is None else end
+
+    def __str__(self):
+        return _decoded(self.text[self.start:self.end])
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return str(self)[key]
+            return _decoded(self.text[self.start + start:self.start + max(start, stop)])
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('TextView index out of range')
+        return _decoded(self.text[self.start + key:self.start + key + 1])
+
+    def __eq__(self, other):
+        return str(self) == str(other) if isinstance(other, (str, TextView)) else NotImplemented
+
+    def __lt__(self, other):
+        return str(self) < str(other) if isinstance(other, (str, TextView)) else NotImplemented
+
+    def __le__(self, other):
+        return str(self) <= str(other) if isinstance(other, (str, TextView)) else NotImplemented
+
+    def __gt__(self, other):
+        return str(self) > str(other) if isinstance(other, (str, TextView)) else NotImplemented
+
+    def __ge__(self, other):
+        return str(self) >= str(other) if isinstance(other, (str, TextView)) else NotImplemented
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __contains__(self, sub):
+        return (str(sub) if isinstance(sub, TextView) else sub) in str(self)
+
+    def __add__(self, other):
+        return str(self) + str(other) if isinstance(other, (str, TextView)) else NotImplemented
+
+    def __radd__(self, other):
+        return other + str(self) if isinstance(other, str) else NotImplemented
+
+    def __format__(self, spec):
+        return format(str(self), spec)
+
+    # Pickled and copied as the text it views
+    def __reduce__(self):
+        return str, (str(self),)
+
+    # Any other str method works on a copy
+    def __getattr__(self, name):
+        if name.startswith('__') or name in TextView.__slots__:
+            raise AttributeError(name)
+        return getattr(str(self), name)
+
+class TokenStream(object):
+    '''
+    Buffered stream of tokens for hand-written (recursive descent)
+    parsers. Tokens are pulled from the iterator as they are needed and
+    kept in a ring buffer, which only grows to hold the tokens after the
+    oldest mark:
+
+        stream = TokenStream(lexer.tokenize(text))
+        if stream.peek().type == 'ID' and stream.peek(1).type == 'ASSIGN':
+            stream.advance(2)         # stream.last is the ASSIGN token
+        mark = stream.mark()
+        try:
+            ...
+        except SyntaxError:
+            stream.reset(mark)        # Back to the token at mark, no relexing
+        else:
+            stream.release(mark)
+
+    peek() returns None past the last token and last is the last token
+    consumed.
+    '''
+    __slots__ = ('_next', '_buffer', '_mask', '_pos', '_end', '_marks', 'last')
+    def __init__(self, tokens, size=16):
+        capacity = 1
+        while capacity < size:
+            capacity *= 2
+        self._next = iter(tokens).__next__
+        self._buffer = [None] * capacity
+        self._mask = capacity - 1
+        self._pos = 0              # Position of the next token
+        self._end = 0              # Position after the last token read
+        self._marks = []           # (position, last) of every mark, oldest first
+        self.last = None
+
+    def _fill(self, end):
+        # Read tokens up to position end. False if the input ends before
+        keep = self._marks[0][0] if self._marks else self._pos
+        while self._end < end:
+            if self._end - keep > self._mask:
+                self._grow(keep)
+            try:
+                tok = self._next()
+            except StopIteration:
+                return False
+            self._buffer[self._end & self._mask] = tok
+            self._end += 1
+        return True
+
+    def _grow(self, keep):
+        buffer = [None] * (2 * len(self._buffer))
+        mask = len(buffer) - 1
+        for pos in range(keep, self._end):
+            buffer[pos & mask] = self._buffer[pos & self._mask]
+        self._buffer = buffer
+        self._mask = mask
+
+    @property
+    def position(self):
+        '''
+        Number of tokens consumed so far.
+        '''
+        return self._pos
+
+    def peek(self, k=0):
+        '''
+        Return the k-th token after the current one without consuming it,
+        or None if the input ends before.
+        '''
+        pos = self._pos + k
+        if pos >= self._end and not self._fill(pos + 1):
+            return None
+        return self._buffer[pos & self._mask]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        pos = self._pos
+        if pos >= self._end and not self._fill(pos + 1):
+            raise StopIteration
+        self.last = tok = self._buffer[pos & self._mask]
+        self._pos = pos + 1
+        return tok
+
+    def advance(self, n=1):
+        '''
+        Consume up to n tokens and return the last one consumed (None if
+        the input had ended).
+        '''
+        end = self._pos + n
+        if end > self._end:
+            self._fill(end)
+            end = min(end, self._end)
+        if end > self._pos:
+            self.last = self._buffer[(end - 1) & self._mask]
+            self._pos = end
+            return self.last
+        return None
+
+    def mark(self):
+        '''
+        Remember the current position for reset() and return it.
+        '''
+        self._marks.append((self._pos, self.last))
+        return self._pos
+
+    def _find(self, mark):
+        for n in range(len(self._marks) - 1, -1, -1):
+            if self._marks[n][0] == mark:
+                return n
+        raise ValueError(f'No mark at position {mark}')
+
+    def reset(self, mark):
+        '''
+        Go back to the position of mark, forgetting it and every later mark.
+        '''
+        n = self._find(mark)
+        self._pos, self.last = self._marks[n]
+        del self._marks[n:]
+
+    def release(self, mark):
+        '''
+        Forget mark (and every later mark) without moving.
+        '''
+        del self._marks[self._find(mark):]
+
 class TokenStr(str):
     @staticmethod
-    def __new__(cls, value, key=None, remap=None):
+    def __new__(cls, value, key=None, remap=None, remap_nocase=None, converters=None):
         self = super().__new__(cls, value)
         self.key = key
         self.remap = remap
+        self.remap_nocase = remap_nocase
+        self.converters = converters
         return self
 
+    # Implementation of TOKEN.nocase[value] = NEWTOKEN
+    @property
+    def nocase(self):
+        return _NoCase(self.key, self.remap_nocase)
+
     # Implementation of TOKEN[value] = NEWTOKEN
     def __setitem__(self, key, value):
         if self.remap is not None:
@@ -95,28 +985,372 @@ class TokenStr(str):
         if self.remap is not None:
             self.remap[self.key, key] = self.key
 
+    # Implementation of TOKEN.convert = converter
+    @property
+    def convert(self):
+        return self.converters.get(self.key) if self.converters is not None else None
+
+    @convert.setter
+    def convert(self, converter):
+        if self.converters is not None:
+            self.converters[self.key] = converter
+
+class _NoCase:
+    '''
+    Remapping of the values of a token compared without regard to case.
+    '''
+    def __init__(self, key, remap):
+        self.key = key
+        self.remap = remap
+
+    def __setitem__(self, key, value):
+        if self.remap is not None:
+            self.remap[self.key, key.casefold()] = value
+
+    def __delitem__(self, key):
+        if self.remap is not None:
+            self.remap[self.key, key.casefold()] = self.key
+
+# Largest number of token values whose remapping is remembered per token
+MAXREMEMBERED = 65536
+
+class _NoCaseLookup(dict):
+    '''
+    New token type for each value of token key. Values are looked up in
+    the exact remapping first and then casefolded in the nocase one. The
+    result for each value is remembered, so repeated values (the usual
+    case for identifiers) take a single dictionary lookup.
+    '''
+    __slots__ = ('key', 'folded', 'limit')
+    def __init__(self, key, exact, folded, limit=MAXREMEMBERED):
+        super().__init__(exact)
+        self.key = key
+        self.folded = folded
+        self.limit = limit
+
+    def __missing__(self, value):
+        newtok = self.folded.get(value.casefold(), self.key)
+        if len(self) < self.limit:
+            self[value] = newtok
+        return newtok
+
+class _BytesNoCaseLookup(_NoCaseLookup):
+    '''
+    _NoCaseLookup for values matched in bytes, folded with bytes.lower().
+    '''
+    __slots__ = ()
+    def __missing__(self, value):
+        newtok = self.folded.get(value.lower(), self.key)
+        if len(self) < self.limit:
+            self[value] = newtok
+        return newtok
+
+class _ValueCache(dict):
+    '''
+    Converter of token values declared with equals() or unescape(). The
+    result for each value is remembered, so the lexer converts repeated
+    values with a single dictionary lookup.
+    '''
+    __slots__ = ('limit',)
+    def __init__(self, limit=MAXREMEMBERED):
+        self.limit = limit
+
+    def __missing__(self, value):
+        converted = self.convert(value)
+        if len(self) < self.limit:
+            self[value] = converted
+        return converted
+
+    # Pickled without the values remembered
+    def __reduce__(self):
+        return type(self), self._arguments()
+
+class _Equals(_ValueCache):
+    '''
+    TOKEN.convert = equals(text): the value becomes True if it is text
+    and False otherwise. With nocase, values are compared casefolded.
+    '''
+    __slots__ = ('text', 'nocase')
+    def __init__(self, text, nocase=False):
+        super().__init__()
+        self.text = text.casefold() if nocase else text
+        self.nocase = nocase
+
+    def _arguments(self):
+        return self.text, self.nocase
+
+    def convert(self, value):
+        return (value.casefold() if self.nocase else value) == self.text
+
+class _Unescape(_ValueCache):
+    '''
+    TOKEN.convert = unescape(strip): the value becomes the text between
+    its first and last strip characters (the quotes of a literal) with
+    its backslash escapes decoded as in a Python string literal.
+    '''
+    __slots__ = ('strip',)
+    def __init__(self, strip=0):
+        super().__init__()
+        self.strip = strip
+
+    def _arguments(self):
+        return self.strip,
+
+    def convert(self, value):
+        if self.strip:
+            value = value[self.strip:-self.strip]
+        return value.encode('latin-1', 'backslashreplace').decode('unicode_escape')
+
+def _latin1(text):
+    return { key.encode('latin-1'): value for key, value in text.items()
+             if all(c < '\u0100' for c in key) }
+
+class _BytesTables(object):
+    '''
+    Tables of a lexer class for tokenizing bytes: the rules compiled as
+    bytes patterns and the dispatch table keyed by byte value.
+    '''
+    def __init__(self, cls):
+        flags = cls.reflags & ~re.UNICODE
+        def compile(pattern, flags):
+            try:
+                return re.compile(pattern.encode('latin-1'), flags)
+            except (UnicodeEncodeError, ValueError, re.error) as e:
+                raise LexerBuildError(f"{cls.__qualname__} rules can't be matched on bytes: {e}") from e
+
+        self.dispatch, self.default = { }, None
+        if cls._parts:
+            dispatch, self.default = _build_dispatch(cls._parts, flags, compile)
+            self.dispatch = { ord(c): pattern for c, pattern in dispatch.items() if c < '\u0100' }
+        self.ignore = cls.ignore.encode('latin-1')
+        self.whitespace = cls.whitespace.encode('latin-1')
+        self.whitespace_re = (re.compile(b'[' + re.escape(self.whitespace) + b']+')
+                              if self.whitespace else None)
+        self.literals = frozenset(ord(c) for c in cls.literals if c < '\u0100')
+        self.remapping = { key: _latin1(val) for key, val in cls._remapping.items() }
+        self.nocase_lookup = { key: _BytesNoCaseLookup(key, _latin1(cls._remapping.get(key, {})),
+                                                       _latin1(folded))
+                               for key, folded in cls._remapping_nocase.items() }
+        self.error_re = compile(cls._error_re.pattern, flags) if cls._error_re is not None else None
+
 class _Before:
     def __init__(self, tok, pattern):
         self.tok = tok
         self.pattern = pattern
 
+class LexerProfile(object):
+    '''
+    Statistics collected by Lexer.tokenize() while the profile attribute
+    of the lexer is set to an instance of this class:
+
+        lexer = CoolLexer()
+        lexer.profile = LexerProfile()
+        for tok in lexer.tokenize(text):
+            ...
+        print(lexer.profile.report())
+
+    For every rule (by the group name of the match) it records the number
+    of matches and the time spent in the regex, and separately the time
+    spent in the rule function. Positions where no rule matches are
+    charged to 'literal' or 'error', the latter including the time of
+    the error() method of each state. Times are in nanoseconds.
+    '''
+    def __init__(self):
+        self.counts = { }
+        self.times = { }
+        self._tables = { }
+
+    def add(self, key, elapsed):
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.times[key] = self.times.get(key, 0) + elapsed
+
+    def report(self):
+        '''
+        Text table of the entries sorted by decreasing total time.
+        '''
+        total = sum(self.times.values()) or 1
+        lines = [f'{"entry":<32} {"count":>9} {"total ms":>10} {"us/call":>9} {"%":>6}']
+        for key in sorted(self.times, key=self.times.get, reverse=True):
+            kind, name = key
+            elapsed = self.times[key]
+            count = self.counts[key]
+            lines.append(f'{kind + " " + name:<32} {count:9} {elapsed / 1e6:10.2f} '
+                         f'{elapsed / count / 1e3:9.2f} {100 * elapsed / total:6.1f}')
+        return '\n'.join(lines)
+
+    def rule_counts(self):
+        '''
+        Dictionary of the number of matches of every rule.
+        '''
+        return { name: count for (kind, name), count in self.counts.items() if kind == 'match' }
+
+    def save(self, path):
+        '''
+        Write the match counts of the rules to a JSON file that can be
+        used as the rule_counts of a lexer:
+
+            lexer.profile = LexerProfile()
+            for text in corpus:
+                for tok in lexer.tokenize(text):
+                    pass
+            lexer.profile.save('CoolLexer.counts.json')
+        '''
+        with open(path, 'w') as f:
+            json.dump(self.rule_counts(), f, indent=4, sort_keys=True)
+            f.write('\n')
+
+    def tables(self, cls):
+        '''
+        Instrumented dispatch table, default pattern, rule functions and
+        error() method of the lexer state class cls.
+        '''
+        if cls not in self._tables:
+            patterns = { }
+            def wrap(pattern):
+                if id(pattern) not in patterns:
+                    patterns[id(pattern)] = _ProfiledPattern(pattern, self, cls.literals)
+                return patterns[id(pattern)]
+            dispatch = { c: wrap(pattern) for c, pattern in cls._dispatch.items() }
+            funcs = { name: self.timed(('callback', name), func)
+                      for name, func in cls._token_funcs.items() }
+            error = self.timed(('error', 'error()'), cls.error)
+            self._tables[cls] = (dispatch, wrap(cls._dispatch_default), funcs, error)
+        return self._tables[cls]
+
+    def timed(self, key, func):
+        '''
+        Wrap func so that the time of every call is recorded under key.
+        '''
+        clock = time.perf_counter_ns
+        def call(*args):
+            t0 = clock()
+            try:
+                return func(*args)
+            finally:
+                self.add(key, clock() - t0)
+        return call
+
+class _ProfiledPattern(object):
+    __slots__ = ('pattern', 'profile', 'literals')
+    def __init__(self, pattern, profile, literals):
+        self.pattern = pattern
+        self.profile = profile
+        self.literals = literals
+
+    def match(self, text, pos):
+        t0 = time.perf_counter_ns()
+        m = self.pattern.match(text, pos) if self.pattern else None
+        elapsed = time.perf_counter_ns() - t0
+        if m:
+            self.profile.add(('match', m.lastgroup), elapsed)
+        elif text[pos] in self.literals:
+            self.profile.add(('literal', text[pos]), elapsed)
+        else:
+            self.profile.add(('error', 'no match'), elapsed)
+        return m
+
+class _Region:
+    '''
+    Text delimited by open and close, as declared by region() in a lexer
+    class. If nested, inner open/close pairs must balance. If escape is
+    given, the character that follows it never starts a delimiter.
+    '''
+    def __init__(self, open, close, nested=False, escape=None):
+        self.open = open
+        self.close = close
+        self.nested = nested
+        self.escape = escape
+        self._encoded = None
+
+    def encoded(self):
+        '''
+        The same region with Latin-1 encoded delimiters, to scan bytes.
+        '''
+        if self._encoded is None:
+            self._encoded = _Region(self.open.encode('latin-1'), self.close.encode('latin-1'), self.nested,
+                                    self.escape.encode('latin-1') if self.escape else None)
+        return self._encoded
+
+    def scan(self, text, pos):
+        '''
+        Return the end of a region whose opening delimiter ends at pos, or
+        -1 if it is not terminated. Runs in linear time: every delimiter
+        is searched for with str.find() from the last one found.
+        '''
+        find = text.find
+        close = find(self.close, pos)
+        if not self.nested and not self.escape:
+            return close + len(self.close) if close >= 0 else -1
+
+        opening = find(self.open, pos) if self.nested else -1
+        escape = find(self.escape, pos) if self.escape else -1
+        depth = 1
+        while close >= 0:
+            if 0 <= escape < close and (opening < 0 or escape < opening):
+                pos = escape + len(self.escape) + 1
+            elif 0 <= opening < close:
+                depth += 1
+                pos = opening + len(self.open)
+            else:
+                depth -= 1
+                pos = close + len(self.close)
+                if depth == 0:
+                    return pos
+            if close < pos:
+                close = find(self.close, pos)
+            if 0 <= opening < pos:
+                opening = find(self.open, pos)
+            if 0 <= escape < pos:
+                escape = find(self.escape, pos)
+        return -1
+
+class _Incomplete(Exception):
+    # Raised by a region that may end past the text read so far
+    pass
+
+def _region_rule(region, func=None):
+    # Token function scanning the rest of a region once its opening
+    # delimiter has been matched. func is the rule function, if any.
+    def scan(self, t):
+        text = self.text
+        end = (region if isinstance(text, str) else region.encoded()).scan(text, t.end)
+        if end < 0:
+            if self._partial:
+                raise _Incomplete()
+            self.lineno += _newline_counter(text)(t.index, len(text))
+            self.index = t.end = len(text)
+            t.value = TextView(text, t.index)
+            return self.unterminated(t)
+        self.lineno += _newline_counter(text)(t.index, end)
+        self.index = t.end = end
+        t.value = text[t.index:end]
+        return func(self, t) if func else t
+    return scan
+
 class LexerMetaDict(dict):
     '''
     Special dictionary that prohibits duplicate definitions in lexer specifications.
     '''
     def __init__(self):
         self.before = { }
+        self.regions = { }
         self.delete = [ ]
         self.remap = { }
+        self.remap_nocase = { }
+        self.convert = { }
 
     def __setitem__(self, key, value):
         if isinstance(value, str):
-            value = TokenStr(value, key, self.remap)
+            value = TokenStr(value, key, self.remap, self.remap_nocase, self.convert)
             
         if isinstance(value, _Before):
             self.before[key] = value.tok
-            value = TokenStr(value.pattern, key, self.remap)
-            
+            value = TokenStr(value.pattern, key, self.remap, self.remap_nocase, self.convert)
+
+        if isinstance(value, _Region):
+            self.regions[key] = value
+            value = TokenStr(re.escape(value.open), key, self.remap, self.remap_nocase, self.convert)
+
         if key in self and not isinstance(value, property):
             prior = self[key]
             if isinstance(prior, str):
@@ -136,7 +1370,7 @@ class LexerMetaDict(dict):
 
     def __getitem__(self, key):
         if key not in self and key.split('ignore_')[-1].isupper() and key[:1] != '_':
-            return TokenStr(key, key, self.remap)
+            return TokenStr(key, key, self.remap, self.remap_nocase, self.convert)
         else:
             return super().__getitem__(key)
 
@@ -161,11 +1395,18 @@ class LexerMeta(type):
 
         d['_'] = _
         d['before'] = _Before
+        d['region'] = _Region
+        d['equals'] = _Equals
+        d['unescape'] = _Unescape
         return d
 
     def __new__(meta, clsname, bases, attributes):
         del attributes['_']
         del attributes['before']
+        del attributes['region']
+        for name, helper in (('equals', _Equals), ('unescape', _Unescape)):
+            if attributes.get(name) is helper:
+                del attributes[name]
 
         # Create attributes for use in the actual class body
         cls_attributes = { str(key): str(val) if isinstance(val, TokenStr) else val
@@ -175,7 +1416,11 @@ class LexerMeta(type):
         # Attach various metadata to the class
         cls._attributes = dict(attributes)
         cls._remap = attributes.remap
+        cls._remap_nocase = attributes.remap_nocase
+        cls._convert = attributes.convert
         cls._before = attributes.before
+        cls._regions = { **{ key: val for key, val in cls._regions.items() if key not in attributes },
+                         **attributes.regions }
         cls._delete = attributes.delete
         cls._build()
         return cls
@@ -186,18 +1431,64 @@ class Lexer(metaclass=LexerMeta):
     literals = set()
     ignore = ''
     reflags = 0
+
+    # Characters skipped a whole run at a time before any rule is tried,
+    # as with ignore. The newlines in a run are added to lineno.
+    whitespace = ''
+
+    # Module compiling the rules: re, or an engine of sly.engine
     regex_module = re
 
+    # Report a run of consecutive unmatched characters as a single error
+    coalesce_errors = False
+
+    # Match the rules with a deterministic automaton (sly.dfa) instead of
+    # re.  Slower than re for most rules, but never backtracks.
+    automaton = False
+
+    # Compute line numbers from the positions of the newlines in the text
+    # instead of the lineno kept up to date by the rules.  Tokens are then
+    # IndexedToken instances, which also have a column.
+    line_index = False
+
+    # LexerProfile collecting statistics of the rules, if not None
+    profile = None
+
+    # Set by tokenize_stream() while more text may follow the buffer
+    _partial = False
+
+    # Rewrite rules prone to backtracking into equivalent cheaper forms
+    # instead of only warning about them
+    rewrite_patterns = False
+
+    # Match counts of the rules in a training corpus, as saved by
+    # LexerProfile.save(): a dictionary or the path of a JSON file, relative
+    # to the module that sets it.  Rules that can never match at the same
+    # position are tried in decreasing order of count.
+    rule_counts = None
+
     _token_names = set()
     _token_funcs = {}
     _ignored_tokens = set()
     _remapping = {}
+    _remapping_nocase = {}
+    _nocase_lookup = {}
     _delete = {}
     _remap = {}
+    _remap_nocase = {}
+    _converters = {}
+    _convert = {}
+    _regions = {}
+    _error_re = None
+    _whitespace_re = None
+    _parts = ()
+    _dispatch = {}
+    _dispatch_default = None
 
     # Internal attributes
     __state_stack = None
-    __set_state = None
+    __begin = None
+    __state_log = None
 
     @classmethod
     def _collect_rules(cls):
@@ -252,7 +1543,7 @@ class Lexer(metaclass=LexerMeta):
                     rules.append((key, value))
                     existing[key] = value
 
-            elif isinstance(value, str) and not key.startswith('_') and key not in {'ignore', 'literals'}:
+            elif isinstance(value, str) and not key.startswith('_') and key not in {'ignore', 'whitespace', 'literals', 'rule_counts'}:
                 raise LexerBuildError(f'{key} does not match a name in tokens')
 
         # Apply deletion rules
@@ -272,15 +1563,21 @@ class Lexer(metaclass=LexerMeta):
         cls._token_names = cls._token_names | set(cls.tokens)
         cls._ignored_tokens = set(cls._ignored_tokens)
         cls._token_funcs = dict(cls._token_funcs)
-        cls._remapping = dict(cls._remapping)
+        cls._remapping = { key: dict(val) for key, val in cls._remapping.items() }
+        cls._remapping_nocase = { key: dict(val) for key, val in cls._remapping_nocase.items() }
 
         for (key, val), newtok in cls._remap.items():
             if key not in cls._remapping:
                 cls._remapping[key] = {}
             cls._remapping[key][val] = newtok
 
+        for (key, val), newtok in cls._remap_nocase.items():
+            if key not in cls._remapping_nocase:
+                cls._remapping_nocase[key] = {}
+            cls._remapping_nocase[key][val] = newtok
+
         remapped_toks = set()
-        for d in cls._remapping.values():
+        for d in (*cls._remapping.values(), *cls._remapping_nocase.values()):
             remapped_toks.update(d.values())
             
         undefined = remapped_toks - set(cls._token_names)
@@ -288,43 +1585,106 @@ class Lexer(metaclass=LexerMeta):
             missing = ', '.join(undefined)
             raise LexerBuildError(f'{missing} not included in token(s)')
 
+        cls._nocase_lookup = { key: _NoCaseLookup(key, cls._remapping.get(key, {}), folded)
+                               for key, folded in cls._remapping_nocase.items() }
+
+        # Value converters, called by the lexer itself (a _ValueCache
+        # through its dictionary lookup). TOKEN.convert = None drops one.
+        cls._converters = dict(cls._converters)
+        for key, converter in cls._convert.items():
+            if key not in cls._token_names:
+                raise LexerBuildError(f'{key} not included in token(s)')
+            if converter is None:
+                cls._converters.pop(key, None)
+                continue
+            if not callable(converter) and not isinstance(converter, _ValueCache):
+                raise LexerBuildError(f'Converter of {key} is not callable')
+            cls._converters[key] = (converter.__getitem__ if isinstance(converter, _ValueCache)
+                                    else converter)
+
         cls._collect_rules()
 
+        if not isinstance(cls.whitespace, str):
+            raise LexerBuildError('whitespace specifier must be a string')
+        if cls.whitespace:
+            cls._whitespace_re = re.compile(f'[{re.escape(cls.whitespace)}]+')
+
         parts = []
         for tokname, value in cls._rules:
+            region = cls._regions.get(tokname)
             if tokname.startswith('ignore_'):
                 tokname = tokname[7:]
                 cls._ignored_tokens.add(tokname)
 
             if isinstance(value, str):
                 pattern = value
+                if region:
+                    cls._token_funcs[tokname] = _region_rule(region)
+                else:
+                    # Drop the function of an inherited rule redefined as a pattern
+                    cls._token_funcs.pop(tokname, None)
 
             elif callable(value):
-                cls._token_funcs[tokname] = value
+                cls._token_funcs[tokname] = _region_rule(region, value) if region else value
                 pattern = getattr(value, 'pattern')
 
-            # Form the regular expression component
-            part = f'(?P<{tokname}>{pattern})'
-
-            # Make sure the individual regex compiles properly
-            try:
-                cpat = cls.regex_module.compile(part, cls.reflags)
-            except Exception as e:
-                raise PatternError(f'Invalid regex for token {tokname}') from e
+            if cls.rewrite_patterns and cls.regex_module is re:
+                pattern = _rewrite_pattern(pattern, cls.reflags, possessive=not cls.automaton)
 
-            # Verify that the pattern doesn't match the empty string
-            if cpat.match(''):
-                raise PatternError(f'Regex for token {tokname} matches empty input')
+            # Form the regular expression component
+            parts.append((tokname, f'(?P<{tokname}>{pattern})'))
 
-            parts.append(part)
+        counts = cls._load_rule_counts()
+        if counts:
+            parts = _order_parts(parts, cls.reflags, counts)
 
+        cls._parts = parts
         if not parts:
             return
 
-        # Form the master regular expression
-        #previous = ('|' + cls._master_re.pattern) if cls._master_re else ''
-        # cls._master_re = cls.regex_module.compile('|'.join(parts) + previous, cls.reflags)
-        cls._master_re = cls.regex_module.compile('|'.join(parts), cls.reflags)
+        # Reuse the master regular expression of an identical rule set
+        # (typically a lexer state that inherits its rules unchanged)
+        signature = (cls.regex_module.__name__, cls.reflags, cls.automaton, tuple(parts))
+        if signature not in _build_cache:
+            risks = _cached_signature(signature)
+            if risks is None:
+                cls._validate_parts(parts)
+                risks = cls._check_backtracking(parts) if cls.regex_module is re else []
+                _cache_signature(signature, risks)
+
+            # Reported at the class definition
+            for tokname, risk in risks:
+                warnings.warn(f'{cls.__qualname__}: rule {tokname}: {risk}', LexerBuildWarning,
+                              stacklevel=3)
+
+            # Form the master regular expression
+            master_re = cls.regex_module.compile('|'.join(part for _, part in parts), cls.reflags)
+
+            # Form the first character dispatch table.  Rule analysis relies on
+            # the syntax of the re module, other regex modules use the master
+            # expression for every character.  With automaton set, a single
+            # DFA matches every rule, unless it grows too large.
+            dispatch, default = { }, None
+            if cls.regex_module is not re:
+                default = master_re
+            elif cls.automaton:
+                try:
+                    default = DFAPattern(parts, cls.reflags)
+                except Unsupported:
+                    pass
+            if default is None:
+                dispatch, default = _build_dispatch(parts, cls.reflags, re.compile)
+            _build_cache[signature] = (master_re, dispatch, default)
+
+        cls._master_re, cls._dispatch, cls._dispatch_default = _build_cache[signature]
+
+        # Pattern that finds where a run of unmatched characters ends
+        if cls.coalesce_errors:
+            pattern = cls._master_re.pattern
+            stops = ''.join(sorted(set(cls.ignore) | set(cls.whitespace) | set(cls.literals)))
+            if stops:
+                pattern += f'|[{re.escape(stops)}]'
+            cls._error_re = cls.regex_module.compile(pattern, cls.reflags)
 
         # Verify that that ignore and literals specifiers match the input type
         if not isinstance(cls.ignore, str):
@@ -333,14 +1693,147 @@ class Lexer(metaclass=LexerMeta):
         if not all(isinstance(lit, str) for lit in cls.literals):
             raise LexerBuildError('literals must be specified as strings')
 
+    @classmethod
+    def freeze(cls):
+        '''
+        Pack the tables of this lexer class and of every lexer state
+        derived from it into immutable structures, and build the state
+        tables of tokenize() for str and for bytes. Frozen tables are
+        never modified again, so they can be excluded from garbage
+        collection with gc.freeze() and shared with forked workers.
+        States entered with begin() that don't derive from this class
+        must be frozen too.
+        '''
+        if not vars(cls).get('_frozen'):
+            cls._token_names = frozenset(cls._token_names)
+            cls._ignored_tokens = frozenset(cls._ignored_tokens)
+            cls._token_funcs = MappingProxyType(dict(cls._token_funcs))
+            cls._converters = MappingProxyType(dict(cls._converters))
+            cls._remapping = MappingProxyType({ key: MappingProxyType(dict(val))
+                                                for key, val in cls._remapping.items() })
+            cls._remapping_nocase = MappingProxyType({ key: MappingProxyType(dict(val))
+                                                       for key, val in cls._remapping_nocase.items() })
+            # Nothing more is remembered once frozen
+            cls._nocase_lookup = MappingProxyType({ key: _NoCaseLookup(key, val, val.folded, len(val))
+                                                    for key, val in cls._nocase_lookup.items() })
+            cls.literals = frozenset(cls.literals)
+            cls._str_state = cls._bytes_state = None
+            cls._state_tables()
+            # Rules that can't be matched on bytes raise when tokenizing bytes
+            try:
+                cls._state_tables(binary=True)
+            except LexerBuildError:
+                pass
+            cls._frozen = True
+
+        for subcls in cls.__subclasses__():
+            subcls.freeze()
+
+    @classmethod
+    def _bytes_tables(cls):
+        '''
+        Tables for tokenizing bytes, built the first time they are needed.
+        '''
+        tables = vars(cls).get('_bytes')
+        if tables is None:
+            tables = cls._bytes = _BytesTables(cls)
+        return tables
+
+    @classmethod
+    def _rule_counts_path(cls):
+        '''
+        Path of the rule_counts file of this lexer, or None.
+        '''
+        path = cls.rule_counts
+        if not isinstance(path, str):
+            return None
+        if not os.path.isabs(path):
+            owner = next(base for base in cls.__mro__ if 'rule_counts' in vars(base))
+            module = sys.modules.get(owner.__module__)
+            path = os.path.join(os.path.dirname(getattr(module, '__file__', None) or ''), path)
+        return path
+
+    @classmethod
+    def _load_rule_counts(cls):
+        '''
+        Dictionary of the rule_counts of this lexer, read from its file if
+        it is a path (None if the file doesn't exist yet).
+        '''
+        path = cls._rule_counts_path()
+        if path is None:
+            return cls.rule_counts
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            raise LexerBuildError(f'Invalid rule counts in {path}') from e
+
+    @classmethod
+    def _state_tables(cls, binary=False):
+        '''
+        Tables tokenize() uses while in this lexer state, for str or for
+        bytes, as a tuple built the first time they are needed.
+        '''
+        key = '_bytes_state' if binary else '_str_state'
+        state = vars(cls).get(key)
+        if state is None:
+            if binary:
+                tables = cls._bytes_tables()
+                state = (cls._ignored_tokens, cls._token_funcs, tables.dispatch, tables.default,
+                         tables.ignore, tables.literals, tables.remapping, tables.nocase_lookup,
+                         tables.error_re if cls.coalesce_errors else None,
+                         tables.whitespace, tables.whitespace_re, cls._converters)
+            else:
+                state = (cls._ignored_tokens, cls._token_funcs, cls._dispatch, cls._dispatch_default,
+                         cls.ignore, cls.literals, cls._remapping, cls._nocase_lookup,
+                         cls._error_re if cls.coalesce_errors else None,
+                         cls.whitespace, cls._whitespace_re, cls._converters)
+            setattr(cls, key, state)
+        return state
+
+    @classmethod
+    def _validate_parts(cls, parts):
+        '''
+        Make sure that every (tokname, regex) part compiles on its own and
+        does not match the empty string.
+        '''
+        for tokname, part in parts:
+            # Make sure the individual regex compiles properly
+            try:
+                cpat = cls.regex_module.compile(part, cls.reflags)
+            except Exception as e:
+                raise PatternError(f'Invalid regex for token {tokname}') from e
+
+            # Verify that the pattern doesn't match the empty string
+            if cpat.match(''):
+                raise PatternError(f'Regex for token {tokname} matches empty input')
+
+    @classmethod
+    def _check_backtracking(cls, parts):
+        '''
+        Return the (tokname, risk) pairs of the (tokname, regex) parts
+        prone to heavy backtracking.
+        '''
+        risks = []
+        for tokname, part in parts:
+            parsed = sre_parse.parse(part, cls.reflags)
+            for risk in dict.fromkeys(_backtracking_risks(parsed, parsed.state.flags)):
+                risks.append((tokname, risk))
+        return risks
+
     def begin(self, cls):
         '''
         Begin a new lexer state
         '''
+        if self.__begin:
+            self.__begin(cls)
+            return
         assert isinstance(cls, LexerMeta), "state must be a subclass of Lexer"
-        if self.__set_state:
-            self.__set_state(cls)
         self.__class__ = cls
+        if self.__state_log is not None:
+            self.__state_log.append((self.index, self.lineno, cls, tuple(self.__state_stack or ())))
 
     def push_state(self, cls):
         '''
@@ -348,7 +1841,7 @@ class Lexer(metaclass=LexerMeta):
         '''
         if self.__state_stack is None:
             self.__state_stack = []
-        self.__state_stack.append(type(self))
+        self.__state_stack.append(self.state)
         self.begin(cls)
 
     def pop_state(self):
@@ -357,26 +1850,110 @@ class Lexer(metaclass=LexerMeta):
         '''
         self.begin(self.__state_stack.pop())
 
-    def tokenize(self, text, lineno=1, index=0):
-        _ignored_tokens = _master_re = _ignore = _token_funcs = _literals = _remapping = None
+    @property
+    def state(self):
+        '''
+        Current lexer state class
+        '''
+        return type(self)
+
+    @property
+    def state_stack(self):
+        '''
+        States saved by push_state(), the most recent last
+        '''
+        return tuple(self.__state_stack or ())
+
+    @property
+    def state_log(self):
+        '''
+        States entered during the last call to tokenize(), as (index,
+        lineno, state, stack) tuples starting with the initial state
+        '''
+        return tuple(self.__state_log or ())
+
+    def tokenize(self, text, lineno=1, index=0, limit=None):
+        '''
+        Tokenize text starting at index. If limit is given, lexing stops,
+        without calling any rule or error function, before the first token
+        or error that would start or end beyond limit.
+
+        text may also be bytes, a bytearray or an mmap holding Latin-1 or
+        ASCII text, which is lexed without decoding it: the rules are
+        matched as bytes patterns, positions are byte offsets and tokens are
+        BytesToken objects whose values are only decoded when used. Rule
+        and error functions see the bytes in self.text. The profile is not
+        collected for bytes.
+        '''
+        return self._tokenize((text,), lineno, index, limit)
+
+    def tokenize_many(self, texts, lineno=1):
+        '''
+        Tokenize every one of texts on its own and generate the list of
+        tokens of each. The lexer is only set up once, which matters when
+        lexing many short texts:
 
-        # --- Support for state changes
+            for tokens in GoneLexer().tokenize_many(expressions):
+                ...
+
+        Every text starts at lineno, in the lexer state of the first one
+        and with an empty state stack.
+        '''
+        tokens = []
+        for tok in self._tokenize(texts, lineno, 0, None, True):
+            if tok is None:
+                yield tokens
+                tokens = []
+            else:
+                tokens.append(tok)
+
+    def _tokenize(self, texts, lineno, index, limit, separate=False, convert=True):
+        # Generate the tokens of each text in turn, followed by None if
+        # separate is set.  Texts after the first start again at lineno,
+        # index and in the initial state.  Values left as matched are not
+        # converted unless convert is set.
+        profile = self.profile
+        binary = False
+        state = _error = None
+        _ignored_tokens = _dispatch = _default = _ignore = _token_funcs = _literals = None
+        _remapping = _nocase_lookup = _error_re = _whitespace = _whitespace_re = _converters = None
+
+        # --- Support for state changes.  The tables of every state entered
+        # are unpacked from a tuple built once per class and text type.
+        _states = { }
         def _set_state(cls):
-            nonlocal _ignored_tokens, _master_re, _ignore, _token_funcs, _literals, _remapping
-            _ignored_tokens = cls._ignored_tokens
-            _master_re = cls._master_re
-            _ignore = cls.ignore
-            _token_funcs = cls._token_funcs
-            _literals = cls.literals
-            _remapping = cls._remapping
+            nonlocal _ignored_tokens, _dispatch, _default, _ignore, _token_funcs, _literals
+            nonlocal _remapping, _nocase_lookup, _error_re, _whitespace, _whitespace_re, _converters
+            nonlocal state, _error
+            tables = _states.get(cls)
+            if tables is None:
+                assert isinstance(cls, LexerMeta), "state must be a subclass of Lexer"
+                tables = cls._state_tables(binary)
+                error = cls.error
+                if profile is not None and not binary:
+                    dispatch, default, funcs, error = profile.tables(cls)
+                    tables = (tables[0], funcs, dispatch, default, *tables[4:])
+                tables = _states[cls] = (*tables, partial(error, self))
+            (_ignored_tokens, _token_funcs, _dispatch, _default, _ignore, _literals,
+             _remapping, _nocase_lookup, _error_re, _whitespace, _whitespace_re, _converters,
+             _error) = tables
+            state = cls
+            if type(self) is not cls:
+                self.__class__ = cls
+
+        # begin() while tokenizing
+        def _begin(cls):
+            _set_state(cls)
+            self.__state_log.append((self.index, self.lineno, cls, tuple(self.__state_stack or ())))
+        self.__begin = _begin
 
-        self.__set_state = _set_state
-        _set_state(type(self))
+        initial = self.state
+        _set_state(initial)
 
         # --- Support for backtracking
         _mark_stack = []
         def _mark():
-            _mark_stack.append((type(self), index, lineno))
+            _mark_stack.append((state, index, lineno))
         self.mark = _mark
 
         def _accept():
@@ -391,70 +1968,288 @@ class Lexer(metaclass=LexerMeta):
 
 
         # --- Main tokenization function
-        self.text = text
+        start, text, lines = (index, lineno), '', None
         try:
-            while True:
-                try:
-                    if text[index] in _ignore:
+            for text in texts:
+                if separate:
+                    index, lineno = start
+                    if state is not initial:
+                        _set_state(initial)
+                    self.__state_stack = None
+                    _mark_stack.clear()
+                textlimit = len(text) if limit is None else limit
+
+                # Switch tables if the text is not of the same type as the last one
+                if binary == isinstance(text, str):
+                    binary = not binary
+                    _states.clear()
+                    _set_state(state)
+                newlines = _newline_counter(text)
+                if self.line_index:
+                    token_class = IndexedBytesToken if binary else IndexedToken
+                else:
+                    token_class = BytesToken if binary else Token
+
+                # Line numbers of the tokens, if computed from the text
+                lines = LineIndex(text, lineno, index) if self.line_index else None
+
+                # Record of the state changes, used by relex()
+                self.__state_log = [(index, lineno, state, tuple(self.__state_stack or ()))]
+
+                self.text = text
+                while True:
+                    try:
+                        c = text[index]
+                    except IndexError:
+                        break
+
+                    if c in _ignore:
                         index += 1
                         continue
-                except IndexError:
-                    return
-
-                tok = Token()
-                tok.lineno = lineno
-                tok.index = index
-                m = _master_re.match(text, index)
-                if m:
-                    tok.end = index = m.end()
-                    tok.value = m.group()
-                    tok.type = m.lastgroup
-
-                    if tok.type in _remapping:
-                        tok.type = _remapping[tok.type].get(tok.value, tok.type)
-
-                    if tok.type in _token_funcs:
-                        self.index = index
-                        self.lineno = lineno
-                        tok = _token_funcs[tok.type](self, tok)
-                        index = self.index
-                        lineno = self.lineno
-                        if not tok:
-                            continue
 
-                    if tok.type in _ignored_tokens:
+                    if c in _whitespace:
+                        end = _whitespace_re.match(text, index).end()
+                        if lines is None:
+                            lineno += newlines(index, end)
+                        index = end
                         continue
 
-                    yield tok
+                    if index >= textlimit:
+                        break
+
+                    tok = token_class()
+                    if lines is None:
+                        tok.lineno = lineno
+                    else:
+                        tok.lines = lines
+                    tok.index = index
+                    pattern = _dispatch.get(c, _default)
+                    m = pattern.match(text, index) if pattern else None
+                    if m:
+                        if m.end() > textlimit:
+                            break
+                        tok.end = index = m.end()
+                        tok.value = value = m.group()
+                        tok.type = m.lastgroup
+
+                        if tok.type in _nocase_lookup:
+                            tok.type = _nocase_lookup[tok.type][value]
+                        elif tok.type in _remapping:
+                            tok.type = _remapping[tok.type].get(value, tok.type)
+
+                        if tok.type in _token_funcs:
+                            self.index = index
+                            self.lineno = lineno if lines is None else lines.lineno(tok.index)
+                            try:
+                                tok = _token_funcs[tok.type](self, tok)
+                            except _Incomplete:
+                                index = tok.index
+                                break
+                            index = self.index
+                            lineno = self.lineno
+                            if not tok:
+                                continue
+
+                        if tok.type in _ignored_tokens:
+                            continue
+
+                        # Unless convert is set, only values replaced by a rule function
+                        if tok.type in _converters and (convert or tok.value is not value):
+                            tok.value = _converters[tok.type](tok.value)
 
-                else:
-                    # No match, see if the character is in literals
-                    if text[index] in _literals:
-                        tok.value = text[index]
-                        tok.end = index + 1
-                        tok.type = tok.value
-                        index += 1
                         yield tok
+
                     else:
-                        # A lexing error
-                        self.index = index
-                        self.lineno = lineno
-                        tok.type = 'ERROR'
-                        tok.value = text[index:]
-                        tok = self.error(tok)
-                        if tok is not None:
-                            tok.end = self.index
+                        # No match, see if the character is in literals
+                        if c in _literals:
+                            tok.value = text[index:index + 1]
+                            tok.end = index + 1
+                            tok.type = tok.value
+                            index += 1
                             yield tok
-
-                        index = self.index
-                        lineno = self.lineno
+                        else:
+                            # A lexing error
+                            self.index = index
+                            self.lineno = lineno if lines is None else lines.lineno(index)
+                            tok.type = 'ERROR'
+                            if _error_re:
+                                m = _error_re.search(text, index + 1)
+                                stop = m.start() if m else len(text)
+                                if stop > textlimit:
+                                    break
+                                tok.value = TextView(text, index, stop)
+                                tok = _error(tok)
+                                self.index = max(self.index, stop)
+                            else:
+                                tok.value = TextView(text, index)
+                                tok = _error(tok)
+                            if tok is not None:
+                                tok.end = self.index
+                                yield tok
+
+                            index = self.index
+                            lineno = self.lineno
+
+                if separate:
+                    yield None
 
         # Set the final state of the lexer before exiting (even if exception)
         finally:
             self.text = text
             self.index = index
-            self.lineno = lineno
+            self.lineno = lineno if lines is None else lines.lineno(index)
+
+    def tokenize_stream(self, source, lineno=1, chunksize=65536, margin=256, encoding='utf-8'):
+        '''
+        Tokenize text read in chunks from source, a file object or mmap.
+        Binary data is decoded incrementally with the given encoding.
+        Token positions are character offsets in the whole input, exactly
+        as if tokenize() were given the complete text.
+
+        Text is only tokenized up to the last newline found at least margin
+        characters before the end of the data read so far; the unfinished
+        tail is carried over and lexed again once the next chunk is
+        available. Rules therefore see at least the rest of the line plus
+        margin characters past the end of any token they match, and a
+        region() is only lexed once its closing delimiter has been read.
+        Memory use is bounded by chunksize + margin plus the longest line
+        or token. The text seen by rule and error functions (self.text,
+        self.index and the value of error tokens) is the current buffer.
+        '''
+        buffer = ''
+        offset = 0
+        start = 0
+        decoder = None
+        eof = False
+        while not eof:
+            data = source.read(chunksize)
+            if isinstance(data, (bytes, bytearray)):
+                if decoder is None:
+                    decoder = codecs.getincrementaldecoder(encoding)()
+                data = decoder.decode(data, final=not data)
+            if data:
+                buffer += data
+            else:
+                eof = True
+
+            limit = len(buffer) if eof else buffer.rfind('\n', 0, len(buffer) - margin) + 1
+            self._partial = not eof
+            try:
+                for tok in self.tokenize(buffer, lineno, start, limit):
+                    if self.line_index:
+                        tok.lines.offset = offset
+                    tok.index += offset
+                    tok.end += offset
+                    yield tok
+            finally:
+                self._partial = False
+
+            # Keep the buffer starting at a line start, for the columns
+            lineno = self.lineno
+            linestart = buffer.rfind('\n', 0, self.index) + 1
+            start = self.index - linestart
+            buffer = buffer[linestart:]
+            offset += linestart
+
+    def relex(self, previous_tokens, text, edit_start, deleted_len, inserted_text):
+        '''
+        Return the list of tokens of text, the result of replacing
+        deleted_len characters at edit_start by inserted_text in the text
+        that produced previous_tokens in the last call to tokenize() or
+        relex() on this lexer. Only the region affected by the edit is
+        lexed again: lexing restarts one token before the edit, in the
+        state recorded for that point, and stops as soon as a new token
+        lines up with an old one after the edit (same type, value and
+        lexer state, including the push_state stack). The remaining old
+        tokens are reused with shifted positions and line numbers.
+        '''
+        log = self.__state_log or [(0, 1, self.state, ())]
+        positions = [entry[0] for entry in log]
+        delta = len(inserted_text) - deleted_len
+        edit_end = edit_start + deleted_len
+
+        def state_at(log, positions, index):
+            return log[bisect_right(positions, index) - 1][2:]
+
+        # Restart one token before the first token touched by the edit
+        first = 0
+        while first < len(previous_tokens) and previous_tokens[first].end < edit_start:
+            first += 1
+        if first > 0:
+            restart = previous_tokens[first - 1]
+            first -= 1
+            index, lineno = restart.index, restart.lineno
+        else:
+            index, lineno = log[0][:2]
+        cls, stack = state_at(log, positions, index)
+
+        # Lex the new text until the token stream lines up again
+        tokens = list(previous_tokens[:first])
+        self.__class__ = cls
+        self.__state_stack = list(stack)
+        old = first
+        resync = None
+        lexer = self.tokenize(text, lineno, index)
+        for tok in lexer:
+            while (old < len(previous_tokens) and
+                   (previous_tokens[old].index < edit_end or previous_tokens[old].index + delta < tok.index)):
+                old += 1
+            # The character before a resync token must be unchanged text
+            if old < len(previous_tokens) and tok.index > edit_start + len(inserted_text):
+                prev = previous_tokens[old]
+                if (prev.index + delta == tok.index and prev.type == tok.type and prev.value == tok.value):
+                    newlog = self.__state_log
+                    newpositions = [entry[0] for entry in newlog]
+                    if state_at(newlog, newpositions, tok.index) == state_at(log, positions, prev.index):
+                        resync = old
+                        break
+            tokens.append(tok)
+        lexer.close()
+        newlog = self.__state_log
+
+        # Splice the state log and shift the tokens after the resync point
+        head = [entry for entry in log if entry[0] < index]
+        if resync is None:
+            self.__state_log = head + newlog
+        else:
+            prev = previous_tokens[resync]
+            dline = tok.lineno - prev.lineno
+            self.__state_log = (head + [entry for entry in newlog if entry[0] < tok.index] +
+                                [(pos + delta, line + dline, cls, stack)
+                                 for pos, line, cls, stack in log if pos >= prev.index])
+            for prev in previous_tokens[resync:]:
+                tok = Token()
+                tok.type = prev.type
+                tok.value = prev.value
+                tok.lineno = prev.lineno + dline
+                tok.index = prev.index + delta
+                tok.end = prev.end + delta
+                tokens.append(tok)
+
+        _, _, cls, stack = self.__state_log[-1]
+        self.__class__ = cls
+        self.__state_stack = list(stack)
+        self.text = text
+        return tokens
+
+    def tokenize_columns(self, text, lineno=1, index=0, limit=None):
+        '''
+        Tokenize text like tokenize() but collect the tokens in a
+        TokenColumns object instead of yielding Token objects. Values
+        are only converted when they are read from the columns.
+        '''
+        initial = self.state
+        columns = TokenColumns(text, sorted(initial._token_names), initial._converters)
+        for tok in self._tokenize((text,), lineno, index, limit, convert=False):
+            state = type(self)
+            columns.append(tok, None if state is initial else state)
+        return columns
 
     # Default implementations of the error handler. May be changed in subclasses
     def error(self, t):
-        raise LexError(f'Illegal character {t.value[0]!r} at index {self.index}', t.value, self.index)
+        raise LexError(f'Illegal character {t.value[0]!r} at index {self.index}', str(t.value), self.index)
+
+    # Called for a region() without its closing delimiter. t.value is the
+    # rest of the input and self.lineno the line number at its end
+    def unterminated(self, t):
+        raise LexError(f'Unterminated {t.type} at index {t.index}', str(t.value), t.index)
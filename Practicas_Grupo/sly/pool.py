@@ -0,0 +1,440 @@
+# sly/pool.py
+#
+# Support for sharing lexers and parsers with multiprocessing workers
+
+__all__ = [ 'freeze', 'get_context', 'split_units', 'parse_units', 'tokenize_files',
+            'tokenize_parallel' ]
+
+import gc
+import importlib
+import multiprocessing
+import signal
+import time
+from array import array
+from bisect import bisect_left
+from functools import partial
+
+from .lex import TextView, TokenColumns
+
+def freeze(*classes):
+    '''
+    Freeze the tables of the given Lexer and Parser classes and move every
+    object tracked so far to the permanent garbage collector generation.
+    Call it in the parent process right before starting forked workers so
+    that the children share the tables copy-on-write:
+
+        from sly.pool import freeze, get_context
+        from Lexer import CoolLexer
+
+        freeze(CoolLexer)
+        with get_context('fork').Pool(32) as pool:
+            ...
+    '''
+    for cls in classes:
+        cls.freeze()
+    gc.collect()
+    gc.freeze()
+
+def get_context(method=None, preload=()):
+    '''
+    Return a multiprocessing context whose workers start with the lexer
+    and parser classes of the modules named in preload already built.
+
+    With 'fork' the modules are imported in the calling process and
+    inherited by every worker. With 'forkserver' they are imported once
+    by the server process, which then forks the workers. With 'spawn'
+    nothing can be shared and each worker imports (and builds) them again.
+    '''
+    ctx = multiprocessing.get_context(method)
+    method = ctx.get_start_method()
+    if method == 'fork':
+        for name in preload:
+            importlib.import_module(name)
+    elif method == 'forkserver' and preload:
+        ctx.set_forkserver_preload(list(preload))
+    return ctx
+
+def split_units(tokens, boundary, nesting=(('{', '}'),)):
+    '''
+    Split a sequence of tokens into units. A new unit starts at every
+    token whose type is boundary and that is not nested inside any of the
+    (open, close) token type pairs given in nesting.
+    '''
+    opening = { op for op, _ in nesting }
+    closing = { cl for _, cl in nesting }
+    units = []
+    unit = []
+    depth = 0
+    for tok in tokens:
+        if tok.type == boundary and depth == 0 and unit:
+            units.append(unit)
+            unit = []
+        if tok.type in opening:
+            depth += 1
+        elif tok.type in closing and depth > 0:
+            depth -= 1
+        unit.append(tok)
+    if unit:
+        units.append(unit)
+    return units
+
+class _UnitError(Exception):
+    pass
+
+def _unit_error(token):
+    raise _UnitError()
+
+# Attributes that Parser.parse() leaves behind on the parser instance
+_PARSE_STATE = { 'tokens', 'statestack', 'symstack', 'state', 'production', 'errorok',
+                 '_line_positions', '_index_positions' }
+
+def _parse_unit(cls, attributes, tokens):
+    # Any syntax error aborts the unit.  Error reporting is left to the
+    # sequential parse so that messages and recovery are unchanged.
+    parser = cls.__new__(cls)
+    parser.__dict__.update(attributes)
+    parser.error = _unit_error
+    try:
+        return True, parser.parse(iter(tokens))
+    except _UnitError:
+        return False, None
+
+def parse_units(parser, tokens, join, boundary, nesting=(('{', '}'),), pool=None, context=None):
+    '''
+    Parse a token stream made of independent top-level units (for example
+    the classes of a Cool program) in a pool of worker processes. Each
+    unit is parsed on its own with a copy of parser and join() is called
+    with the list of results, in source order, to build the final value:
+
+        program = parse_units(parser, lexer.tokenize(text),
+                              join=lambda progs: Programa(secuencia=[c for p in progs
+                                                                     for c in p.secuencia]),
+                              boundary='CLASS')
+
+    If any unit has a syntax error, the whole stream is parsed again
+    sequentially with parser itself, so error messages, line numbers and
+    error recovery are exactly those of parser.parse(). Position
+    tracking (line_position/index_position) is not available for values
+    built in the workers.
+    '''
+    tokens = list(tokens)
+    units = split_units(tokens, boundary, nesting)
+    if len(units) < 2:
+        return parser.parse(iter(tokens))
+
+    attributes = { key: value for key, value in vars(parser).items() if key not in _PARSE_STATE }
+    func = partial(_parse_unit, type(parser), attributes)
+    if pool is None:
+        with get_context(context).Pool() as pool:
+            results = pool.map(func, units)
+    else:
+        results = pool.map(func, units)
+
+    if not all(ok for ok, _ in results):
+        return parser.parse(iter(tokens))
+    return join([value for _, value in results])
+
+class FileTokens(object):
+    '''
+    Tokens of one file lexed by tokenize_files(). columns is a
+    TokenColumns object without the text of the file (call load() to read
+    it back before asking for token values), or None if lexing failed or
+    timed out, in which case error describes what happened.
+    '''
+    __slots__ = ('path', 'columns', 'elapsed', 'error')
+    def __init__(self, path, columns=None, elapsed=0.0, error=None):
+        self.path = path
+        self.columns = columns
+        self.elapsed = elapsed
+        self.error = error
+
+    def __repr__(self):
+        return f'FileTokens({self.path!r}, tokens={self.tokens}, elapsed={self.elapsed:.4f}, error={self.error!r})'
+
+    @property
+    def tokens(self):
+        return len(self.columns) if self.columns is not None else 0
+
+    @property
+    def tokens_per_second(self):
+        return self.tokens / self.elapsed if self.elapsed else 0.0
+
+    def load(self, encoding='utf-8'):
+        '''
+        Read the text of the file back into columns and return columns.
+        '''
+        if self.columns is not None and self.columns.text is None:
+            with open(self.path, encoding=encoding, newline='') as f:
+                self.columns.text = f.read()
+        return self.columns
+
+class TokenizedFiles(list):
+    '''
+    List of the FileTokens returned by tokenize_files(), in the order of
+    the paths, with the wall time of the whole batch in elapsed.
+    '''
+    elapsed = 0.0
+
+    @property
+    def tokens(self):
+        return sum(result.tokens for result in self)
+
+    @property
+    def tokens_per_second(self):
+        return self.tokens / self.elapsed if self.elapsed else 0.0
+
+    def report(self):
+        '''
+        Text report of the tokens per second of every file and the batch.
+        '''
+        lines = []
+        for result in self:
+            status = result.error or f'{result.tokens_per_second:12,.0f} tokens/s'
+            lines.append(f'{result.path}: {result.tokens} tokens  {status}')
+        lines.append(f'{len(self)} files: {self.tokens} tokens in {self.elapsed:.3f} s  '
+                     f'{self.tokens_per_second:12,.0f} tokens/s')
+        return '\n'.join(lines)
+
+class _Timeout(Exception):
+    pass
+
+def _timeout(signum, frame):
+    raise _Timeout()
+
+def _tokenize_file(lexer_class, timeout, encoding, path):
+    # Runs in the worker.  Only the token arrays are sent back: the text is
+    # dropped and error values are cut to the characters they skipped.
+    alarm = timeout and hasattr(signal, 'setitimer')
+    t0 = time.perf_counter()
+    try:
+        if alarm:
+            signal.signal(signal.SIGALRM, _timeout)
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            with open(path, encoding=encoding, newline='') as f:
+                text = f.read()
+            columns = lexer_class().tokenize_columns(text)
+        finally:
+            if alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    except _Timeout:
+        return FileTokens(path, None, time.perf_counter() - t0, f'timed out after {timeout} s')
+    except Exception as e:
+        return FileTokens(path, None, time.perf_counter() - t0, f'{type(e).__name__}: {e}')
+
+    for n, value in columns.values.items():
+        if isinstance(value, TextView):
+            columns.values[n] = text[columns.index[n]:columns.end[n]]
+    columns.text = None
+    return FileTokens(path, columns, time.perf_counter() - t0)
+
+def tokenize_files(lexer_class, paths, processes=None, timeout=None, context=None,
+                   encoding='utf-8', pool=None):
+    '''
+    Tokenize many files with instances of lexer_class in a pool of worker
+    processes and return a TokenizedFiles list with one FileTokens per
+    path. Workers send back compact TokenColumns arrays instead of pickled
+    Token objects:
+
+        results = tokenize_files(CoolLexer, glob.glob('01/grading/*.cool'), timeout=5)
+        print(results.report())
+
+    lexer_class must be importable by the workers (not defined in
+    __main__ when using 'spawn'). Its module is imported before the
+    workers start so that they don't build it again (call freeze() first
+    to share its tables with forked workers). Lexing of a file is
+    abandoned after timeout seconds (where SIGALRM timers are available).
+    Error token values are the characters skipped by the error function.
+    '''
+    func = partial(_tokenize_file, lexer_class, timeout, encoding)
+    paths = list(paths)
+    t0 = time.perf_counter()
+    if pool is None:
+        ctx = get_context(context, preload=[lexer_class.__module__])
+        with ctx.Pool(processes) as pool:
+            results = TokenizedFiles(pool.map(func, paths, chunksize=1))
+    else:
+        results = TokenizedFiles(pool.map(func, paths, chunksize=1))
+    results.elapsed = time.perf_counter() - t0
+    return results
+
+# -----------------------------------------------------------------------------
+# One large text split in chunks
+# -----------------------------------------------------------------------------
+
+def _cut_points(text, chunksize):
+    # The first line start after every chunksize characters, past any blank
+    # lines since rules often match runs of newlines.  Whether a cut is
+    # outside strings and comments is only known once the chunk before it
+    # has been lexed.
+    cuts = [0]
+    pos = chunksize
+    while pos < len(text):
+        newline = text.find('\n', pos)
+        if newline < 0:
+            break
+        while text.startswith('\n', newline + 1):
+            newline += 1
+        if newline + 1 >= len(text):
+            break
+        cuts.append(newline + 1)
+        pos = newline + 1 + chunksize
+    cuts.append(len(text))
+    return cuts
+
+def _chunk_text(text, start, limit, margin):
+    # Text of a chunk pickled for a worker: up to the first line start at
+    # least margin characters past the cut, or the rest of the text
+    stop = text.find('\n', limit + margin) + 1 if limit is not None else 0
+    return text[start:stop] if stop else text[start:]
+
+# Text being lexed by tokenize_parallel(), inherited by forked workers
+_shared_text = None
+
+def _tokenize_chunk(lexer_class, margin, task):
+    # Runs in the worker.  text is the whole input or, if it had to be
+    # pickled, the input from offset on as cut by _chunk_text().  Lexing
+    # stops at the next cut and token positions are made absolute before
+    # the arrays are sent back.  A chunk lexed up to less than margin
+    # characters from the end of a cut text fails, to be lexed again with
+    # the whole text.
+    text, offset, lineno, start, limit = task
+    cut = text is not None and limit is not None
+    if text is None:
+        text = _shared_text
+    lexer = lexer_class()
+    try:
+        columns = lexer.tokenize_columns(text, lineno, start - offset, limit and limit - offset)
+    except Exception:
+        return None, 0, 0, False, False
+    if cut and lexer.index > len(text) - margin:
+        return None, 0, 0, False, False
+
+    for n, value in columns.values.items():
+        if isinstance(value, TextView):
+            columns.values[n] = text[columns.index[n]:columns.end[n]]
+    if offset:
+        columns.index = array('q', [ index + offset for index in columns.index ])
+        columns.end = array('q', [ end + offset for end in columns.end ])
+    columns.text = None
+    resumable = lexer.state is lexer_class and not lexer.state_stack
+    stateless = len(lexer.state_log) == 1
+    return columns, offset + lexer.index, lexer.lineno, resumable, stateless
+
+def _resync(lexer, lexer_class, tokens, part, columns):
+    # Lex sequentially until a token is also the j-th one of part, lexed
+    # from a rejected cut, with both lexers then in the initial state
+    # lexer_class: the rest of part is the same but for line numbers.
+    # Return j + 1 and the line number correction, or None once tokens
+    # are exhausted.
+    for tok in tokens:
+        state = type(lexer)
+        columns.append(tok, None if state is lexer_class else state)
+        if part is None:
+            continue
+        j = bisect_left(part.index, tok.index)
+        if (j < len(part) and part.index[j] == tok.index and part.end[j] == tok.end
+            and part.types[part.type[j]] == tok.type
+            and lexer.state is lexer_class and not lexer.state_stack):
+            tokens.close()
+            return j + 1, tok.lineno - part.lineno[j]
+    return None
+
+def tokenize_parallel(lexer, text, lineno=1, chunksize=1 << 20, margin=256, processes=None, pool=None,
+                      context=None):
+    '''
+    Tokenize one large text in a pool of worker processes and return its
+    TokenColumns, the same as lexer.tokenize_columns(text, lineno):
+
+        columns = tokenize_parallel(CoolLexer(), text)
+
+    The text is cut at the first line start after every chunksize
+    characters and each chunk is lexed by a new instance of the class of
+    lexer, starting in its initial state. A cut is only accepted if the
+    chunk before it stops right there, with nothing but ignored characters
+    left before the cut, in the initial state and with an empty state
+    stack: no string, comment or other token crosses it. Line numbers of
+    the chunks are corrected with the number of newlines before them.
+
+    Chunks after a cut that can't be accepted, or whose worker failed, are
+    lexed again sequentially with lexer itself (so exceptions are raised
+    there), until one of them ends at its cut. Rule and error functions
+    must only keep state in the lexer state, index and lineno. Messages
+    they print come from the workers and may be repeated for the chunks
+    lexed again.
+
+    The class of lexer must be importable by the workers, as for
+    tokenize_files(). Forked workers of the pool started here inherit the
+    text. Other workers get their chunk pickled, with the rest of the line
+    margin characters past its end: as in tokenize_stream(), rules must
+    match or reject a token without looking further than that. Chunks
+    lexed up to less than margin characters from the end of their text
+    are lexed again sequentially.
+    '''
+    lexer_class = type(lexer)
+    cuts = _cut_points(text, chunksize)
+    if len(cuts) < 3 or lexer.state is not lexer_class or lexer.state_stack:
+        return lexer.tokenize_columns(text, lineno)
+
+    # Line number assumed at each cut
+    starts = [lineno]
+    for start, stop in zip(cuts, cuts[1:-1]):
+        starts.append(starts[-1] + text.count('\n', start, stop))
+
+    # Forked workers started here inherit the text, others get their chunk
+    # pickled
+    global _shared_text
+    func = partial(_tokenize_chunk, lexer_class, margin)
+    limits = [ *cuts[1:-1], None ]
+    if pool is None:
+        ctx = get_context(context, preload=[lexer_class.__module__])
+        shared = ctx.get_start_method() == 'fork'
+        tasks = [ (None, 0, line, start, limit) if shared else
+                  (_chunk_text(text, start, limit, margin), start, line, start, limit)
+                  for start, limit, line in zip(cuts, limits, starts) ]
+        _shared_text = text if shared else None
+        try:
+            with ctx.Pool(processes) as pool:
+                results = pool.map(func, tasks, chunksize=1)
+        finally:
+            _shared_text = None
+    else:
+        tasks = ((_chunk_text(text, start, limit, margin), start, line, start, limit)
+                 for start, limit, line in zip(cuts, limits, starts))
+        results = list(pool.imap(func, tasks))
+
+    # Take the chunks in order.  A chunk of a worker is used if it starts
+    # at an accepted cut.  Otherwise lexer lexes it from where the last one
+    # stopped, until it finds a token after which the chunk of the worker
+    # agrees with it, or else up to the next cut.
+    skipped = lexer_class.ignore + lexer_class.whitespace
+    counted = lexer_class.line_index or '\n' in lexer_class.whitespace
+    columns = TokenColumns(text, sorted(lexer_class._token_names), lexer_class._converters)
+    index, line, accepted = 0, lineno, True
+    for k, (part, end, end_line, resumable, stateless) in enumerate(results):
+        last = k == len(results) - 1
+        if accepted and part is not None and (resumable or last):
+            delta = line - starts[k]
+            columns.extend(part, delta)
+            end_line += delta
+        else:
+            tokens = lexer._tokenize((text,), line, index, None if last else cuts[k + 1], convert=False)
+            synced = _resync(lexer, lexer_class, tokens, part if stateless else None, columns)
+            if synced:
+                start, delta = synced
+                columns.extend(part, delta, start)
+                end_line += delta
+            else:
+                end, end_line = lexer.index, lexer.lineno
+                resumable = lexer.state is lexer_class and not lexer.state_stack
+        if last:
+            break
+        index, line = end, end_line
+        cut = cuts[k + 1]
+        accepted = resumable and end >= cut and not text[cut:end].strip(skipped)
+        if accepted:
+            # Ignored characters after the cut are skipped by both chunks
+            index = cut
+            if counted:
+                line -= text.count('\n', cut, end)
+    return columns
@@ -33,6 +33,7 @@
 
 import sys
 import inspect
+from types import MappingProxyType
 from collections import OrderedDict, defaultdict, Counter
 
 __all__        = [ 'Parser' ]
@@ -1566,6 +1567,27 @@ class LRTable(object):
 
         return '\n'.join(out)
 
+# -----------------------------------------------------------------------------
+#                           === Frozen LR Tables ===
+#
+# Once a parser has been built, only the action, goto and defaulted state
+# tables are needed at parse time.  FrozenLRTable keeps just those, stored
+# as tuples of read-only mappings with identical rows shared between states.
+# -----------------------------------------------------------------------------
+
+class FrozenLRTable(object):
+    __slots__ = ('lr_action', 'lr_goto', 'defaulted_states')
+
+    def __init__(self, lrtable):
+        rows = {}
+        def share(row):
+            return rows.setdefault(tuple(sorted(row.items())), MappingProxyType(row))
+
+        nstates = len(lrtable.lr_action)
+        self.lr_action = tuple(share(lrtable.lr_action[st]) for st in range(nstates))
+        self.lr_goto = tuple(share(lrtable.lr_goto[st]) for st in range(nstates))
+        self.defaulted_states = MappingProxyType(dict(lrtable.defaulted_states))
+
 # Collect grammar rules from a function
 def _collect_grammar_rules(func):
     grammar = []
@@ -2027,6 +2049,17 @@ class Parser(metaclass=ParserMeta):
                 f.write(str(cls._lrtable))
             cls.log.info('Parser debugging for %s written to %s', cls.__qualname__, cls.debugfile)
 
+    @classmethod
+    def freeze(cls):
+        '''
+        Replace the LR tables by a compact, immutable FrozenLRTable. The
+        diagnostic data kept by the table generator is released. Frozen
+        tables can be excluded from garbage collection with gc.freeze()
+        and shared with forked workers without dirtying their pages.
+        '''
+        if not isinstance(cls._lrtable, FrozenLRTable):
+            cls._lrtable = FrozenLRTable(cls._lrtable)
+
     # ----------------------------------------------------------------------
     # Parsing Support.  This is the parsing runtime that users use to
     # ----------------------------------------------------------------------
@@ -0,0 +1,199 @@
+# coding: utf-8
+#
+# Tests of the matching engines: the sly.dfa automaton and the regex
+# modules of sly.engine.
+#
+#     python -m pytest test_engine.py
+
+import contextlib
+import os
+import random
+import re
+
+import pytest
+
+from benchmark import _grading_files, lexers
+from sly import Lexer
+import sly.dfa
+from sly import engine
+from sly.dfa import DFAPattern
+from sly.engine import RegexModule, available_engines, compare_engines
+
+
+def _parts(*rules):
+    return [ (f'R{n}', f'(?P<R{n}>{rule})') for n, rule in enumerate(rules) ]
+
+
+def _same_matches(rules, texts):
+    parts = _parts(*rules)
+    master = re.compile('|'.join(part for _, part in parts))
+    dfa = DFAPattern(parts)
+    for text in texts:
+        m, d = master.match(text), dfa.match(text, 0)
+        assert (m and (m.lastgroup, m.end())) == (d and (d.lastgroup, d.end())), (rules, text)
+    return dfa
+
+
+# ----------------------------------------------------------------------
+# Automaton
+
+def test_automaton_matches_like_re():
+    # Rules whose longest match isn't the match of re are left to re
+    for rules, text in ((['a+(ab)*'], 'aab'), (['a|ab'], 'ab'), (['(a|)b*'], 'ab'),
+                        (['[^a]{1,2}.*?'], 'cc')):
+        dfa = _same_matches(rules, [text])
+        assert [ n for n, _ in dfa.fallback ] == [0], rules
+
+    # Rules decided by their next character stay in the automaton
+    rules = [r'/\*(.|\n)*?\*/', r'//[^\n]*\n', r'"([^"\\\n]|\\.)*"', r'\d+\.\d*|\.\d+',
+             r'(?:\d+(?:\.\d*)?|\.\d+)[eE][+-]?\d+', r'\d+', r'[a-zA-Z_][a-zA-Z0-9_]*', r'[-+*/]']
+    dfa = _same_matches(rules, ['/* a */ b', '// x\n', '"a\\"b"', '1.5e3', '12.', '.5', 'x1', '*'])
+    assert dfa.fallback == []
+
+
+def _tokens(lexer_class, text):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+        return [ (tok.type, tok.value, tok.lineno, tok.index, tok.end) for tok in lexer_class().tokenize(text) ]
+
+
+def test_automaton_lexers():
+    # The shipped lexers give the same tokens with the automaton, which
+    # matches all of their rules
+    for lexer_class, _ in lexers():
+        class dfa_class(lexer_class):
+            tokens = lexer_class.tokens
+            automaton = True
+
+        assert isinstance(dfa_class._dispatch_default, DFAPattern)
+        assert dfa_class._dispatch_default.fallback == []
+        for path in _grading_files(lexer_class):
+            with open(path, newline='') as f:
+                text = f.read()
+            assert _tokens(dfa_class, text) == _tokens(lexer_class, text), path
+
+
+def _random_rule(depth=0):
+    rule = ''
+    for _ in range(random.randint(1, 3)):
+        r = random.random()
+        if depth > 1 or r < 0.5:
+            atom = random.choice(['a', 'b', '[ab]', '.', '[^a]'])
+        elif r < 0.75:
+            atom = f'({_random_rule(depth + 1)}|{_random_rule(depth + 1)})'
+        else:
+            atom = f'(?:{_random_rule(depth + 1)})'
+        rule += atom + random.choice(['', '', '*', '+', '?', '*?', '{1,2}'])
+    return rule
+
+
+def test_automaton_random_rules():
+    random.seed(34)
+    checked = 0
+    while checked < 100:
+        rules = [ _random_rule() for _ in range(random.randint(1, 3)) ]
+        if any(re.match(rule, '') for rule in rules):
+            continue
+        texts = [ ''.join(random.choice('ab\n') for _ in range(random.randint(1, 6)))
+                  for _ in range(20) ]
+        _same_matches(rules, texts)
+        checked += 1
+
+
+# ----------------------------------------------------------------------
+# Engines of sly.engine
+
+class NamedGroupLexer(Lexer):
+    tokens = { 'ASSIGN', 'ID', 'NUM' }
+    ignore = ' \n'
+    ASSIGN = r'(?P<target>[a-z]+)\s*='
+    ID = r'[a-z]+'
+    NUM = r'\d+'
+
+
+class VerboseLexer(Lexer):
+    tokens = { 'ID', 'NUM' }
+    ignore = ' \n'
+    reflags = re.VERBOSE
+    ID = r'''[a-z]+      # name
+                [0-9]*'''
+    NUM = r'\d+ (?: \.\d+ )?'
+
+
+class FallbackLexer(Lexer):
+    tokens = { 'PAIR', 'ID', 'NUM' }
+    ignore = ' \n'
+    PAIR = r'(?P<first>[a-z])(?P=first)'
+    ID = r'[a-z]+(?=[\d\s])'
+    NUM = r'\d+'
+
+
+def test_alternatives():
+    assert engine._alternatives(r'(?P<A>a|b)|[|(]|c\|d|(?:e|f)') == \
+        ['(?P<A>a|b)', '[|(]', r'c\|d', '(?:e|f)']
+    assert engine._alternatives('') == ['']
+
+
+def test_automaton_compile(monkeypatch):
+    pattern = '(?P<ID>[a-z]+)|(?P<NUM>\\d+)'
+    compiled = engine._automaton_compile(pattern, 0)
+    assert isinstance(compiled, engine._AutomatonPattern) and compiled.pattern == pattern
+    m = compiled.match('ab12', 0)
+    assert (m.lastgroup, m.group()) == ('ID', 'ab')
+    assert compiled.search('-- 12').group() == '12'
+
+    # Verbose patterns, and patterns whose automaton grows too large, are
+    # left to re
+    assert isinstance(engine._automaton_compile(pattern, re.VERBOSE), re.Pattern)
+    monkeypatch.setattr(sly.dfa, 'MAXSTATES', 1)
+    assert isinstance(engine._automaton_compile(pattern, 0), re.Pattern)
+
+
+def test_automaton_fallback_rules():
+    # Backreferences and lookaheads are matched with re inside the automaton
+    compiled = engine._automaton_compile(FallbackLexer._master_re.pattern, FallbackLexer.reflags)
+    assert isinstance(compiled, engine._AutomatonPattern)
+    assert [ n for n, _ in compiled.match.__self__.fallback ] == [0, 1]
+
+
+def test_regex_module():
+    module = RegexModule('upper', lambda pattern, flags: re.compile(pattern.upper(), flags))
+    assert repr(module) == "RegexModule('upper')" and module.error is re.error
+    assert module.compile('a').pattern == 'A'
+    assert repr(engine.automaton) == "RegexModule('sly.dfa')"
+    assert set(available_engines()) >= { 're', 'automaton' }
+
+
+def test_regex_flags():
+    regex = pytest.importorskip('regex')
+    compiled = engine._regex_compile('(?P<A>a b)', re.IGNORECASE | re.VERBOSE)
+    assert compiled.flags & (regex.IGNORECASE | regex.VERBOSE) == regex.IGNORECASE | regex.VERBOSE
+    assert compiled.match('AB').lastgroup == 'A'
+    with pytest.raises(re.error):
+        engine._regex_compile('(?P<A>a', 0)
+    assert available_engines()['regex'] is engine.regex
+
+
+TEXTS = {
+    NamedGroupLexer: ['x = 1 y=22 z 3\n' * 5, 'a ='],
+    VerboseLexer: ['ab12 3.5 c 7\n' * 5],
+    FallbackLexer: ['aa ab b1 12 ccc\n' * 5],
+}
+
+
+def test_engines_token_streams():
+    # Every available engine gives the token stream of re
+    cases = list(TEXTS.items()) + [ (lexer_class, [text]) for lexer_class, text in lexers() ]
+    for lexer_class, texts in cases:
+        runs = compare_engines(lexer_class, texts)
+        assert [ run.name for run in runs ] == list(available_engines())
+        assert [ run.mismatches for run in runs ] == [[]] * len(runs), lexer_class
+        assert len({ run.tokens for run in runs }) == 1
+
+
+def test_compare_engines_mismatches():
+    def greedy(pattern, flags):
+        return re.compile(pattern.replace('[a-z]+', '[a-z]'), flags)
+    engines = { 're': re, 'short': RegexModule('short', greedy) }
+    runs = compare_engines(NamedGroupLexer, ['x = 1', 'xy = 1', '1 2'], engines=engines)
+    assert [ (run.name, run.mismatches) for run in runs ] == [('re', []), ('short', [1])]
+    assert runs[1].tokens == runs[0].tokens + 1
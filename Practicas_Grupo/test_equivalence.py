@@ -0,0 +1,445 @@
+# coding: utf-8
+#
+# Checks that the optimized paths of sly give the same results as the
+# plain ones, on the corpora used by benchmark.py.
+#
+#     python -m pytest test_equivalence.py
+
+import contextlib
+import glob
+import io
+import mmap
+import os
+import random
+import re
+import time
+import warnings
+
+from benchmark import (COMPILERS, _ADVERSARIAL, _DELIMITERS, _WORST_CASES, _comment_lexers, _converter_lexers, _generated,
+                       _grading_files, _growth, _keyword_lexers, _line_lexers, _whitespace_lexers, cool_corpus, lexers, scale)
+from sly import Lexer, LexerProfile
+
+
+def _tokens(lexer_class, text, lineno=1):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+        return [(tok.type, tok.value, tok.lineno, tok.index, tok.end)
+                for tok in lexer_class().tokenize(text, lineno)]
+
+
+def _stderr(func, *args):
+    output = io.StringIO()
+    with contextlib.redirect_stderr(output):
+        func(*args)
+    return output.getvalue()
+
+
+# ----------------------------------------------------------------------
+# Syntax errors of the Gone parser
+
+# Messages of the parser before the lexer converted the values of literals
+SYNTAX_ERRORS = [
+    ('print 1 true;', "1: Syntax error in input at token 'true'\n"),
+    ('print 2 1.;', "1: Syntax error in input at token '1.'\n"),
+    ('print 3 0x1F;', "1: Syntax error in input at token '0x1F'\n"),
+    ("print 4 'a';", "1: Syntax error in input at token ''a''\n"),
+    ('print 5 1e3;', "1: Syntax error in input at token '1e3'\n"),
+    ("print 6 '\\n';", "1: Syntax error in input at token ''\\n''\n"),
+    ('print 7 0b11 false;', "1: Syntax error in input at token '0b11'\n"),
+]
+
+
+def test_syntax_errors_quote_source():
+    from gone.parser import parse
+    for source, message in SYNTAX_ERRORS:
+        assert _stderr(parse, source) == message
+    for path in glob.glob(os.path.join(COMPILERS, 'Tests', '*.g')):
+        with open(path) as f:
+            source = f.read()
+        for token in re.findall(r"Syntax error in input at token '(.*)'\n", _stderr(parse, source)):
+            assert token in source, (path, token)
+
+
+# ----------------------------------------------------------------------
+# Token columns
+
+def test_columns():
+    for lexer_class, text in lexers():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+            columns = lexer_class().tokenize_columns(text)
+        assert [(tok.type, tok.value, tok.lineno, tok.index, tok.end)
+                for tok in columns] == _tokens(lexer_class, text)
+
+
+# ----------------------------------------------------------------------
+# Delimited regions
+
+def test_region():
+    # Block comments matched by a regex and scanned as a region()
+    regex, scanned = _comment_lexers()
+    for text in ('a /*' + 'x\n' * 100 + '*/ b', 'a /* x */ /**/ b /*/ c */\nd', 'a ' + '/* x\n' * 20, 'a /'):
+        assert _tokens(scanned, text) == _tokens(regex, text), text
+
+
+# ----------------------------------------------------------------------
+# Streams
+
+def test_tokenize_stream():
+    # Every grading file gives the same tokens and errors read in chunks
+    def stream(lexer_class, data, chunksize, margin):
+        return [(tok.type, tok.value, tok.lineno, tok.index, tok.end) for tok in
+                lexer_class().tokenize_stream(io.BytesIO(data), chunksize=chunksize, margin=margin)]
+
+    for lexer_class, _ in lexers():
+        for path in _grading_files(lexer_class):
+            with open(path, 'rb') as f:
+                data = f.read()
+            errors = _stderr(list, lexer_class().tokenize(data.decode('utf-8')))
+            for chunksize, margin in ((7, 3), (1000, 256)):
+                assert _stderr(stream, lexer_class, data, chunksize, margin) == errors, path
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+                    assert stream(lexer_class, data, chunksize, margin) == \
+                        _tokens(lexer_class, data.decode('utf-8')), path
+
+
+# ----------------------------------------------------------------------
+# Line numbers from a newline index
+
+def test_line_index():
+    # Line numbers kept by rules and computed from the text
+    tracking, indexed = _line_lexers()
+    comments = ''.join(f'x = {n}; /* block\n comment */\n\n-- line comment\n\n' for n in range(200))
+    for text in [ text for _, text in lexers() ] + [comments]:
+        assert _tokens(indexed, text) == _tokens(tracking, text)
+
+
+# ----------------------------------------------------------------------
+# Keywords without regard to case
+
+def test_nocase_keywords():
+    # Keywords matched by a regex each and remapped from identifiers
+    regex, mapped = _keyword_lexers()
+    for path in _grading_files(mapped):
+        with open(path, newline='') as f:
+            text = f.read()
+        assert _tokens(mapped, text) == _tokens(regex, text), path
+
+
+# ----------------------------------------------------------------------
+# Relexing after an edit
+
+EDITS = ['', 'x', '\n', '/*', '*/', '(*', '*)', '"', "'", ' 12 ', '--', 'true']
+
+
+def test_relex():
+    # Random edits of the grading files give the tokens of the edited text
+    random.seed(31)
+    for lexer_class, _ in lexers():
+        for path in _grading_files(lexer_class)[::4]:
+            with open(path, newline='') as f:
+                text = f.read()
+            if not text:
+                continue
+            for _ in range(5):
+                start = random.randrange(len(text))
+                deleted = random.randrange(min(5, len(text) - start) + 1)
+                inserted = random.choice(EDITS)
+                new = text[:start] + inserted + text[start + deleted:]
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+                    lexer = lexer_class()
+                    tokens = lexer.relex(list(lexer.tokenize(text)), new, start, deleted, inserted)
+                assert [(tok.type, tok.value, tok.lineno, tok.index, tok.end) for tok in tokens] == \
+                    _tokens(lexer_class, new), (path, start, deleted, inserted)
+
+
+# ----------------------------------------------------------------------
+# Many files in a process pool
+
+class SlowLexer(Lexer):
+    tokens = { 'ID' }
+
+    @_(r'\w+')
+    def ID(self, t):
+        time.sleep(1)
+        return t
+
+
+def test_tokenize_files(tmp_path):
+    from sly.pool import tokenize_files
+    for lexer_class, _ in lexers():
+        paths = _grading_files(lexer_class)
+        results = tokenize_files(lexer_class, paths, processes=2, context='fork')
+        assert [ result.path for result in results ] == paths
+        assert results.tokens == sum(result.tokens for result in results) > 0
+        for path, result in zip(paths, results):
+            assert result.error is None and result.columns.text is None
+            with open(path, newline='') as f:
+                assert [(tok.type, tok.value, tok.lineno, tok.index, tok.end)
+                        for tok in result.load()] == _tokens(lexer_class, f.read()), path
+
+    # Failures are reported per file
+    path = tmp_path / 'slow'
+    path.write_text('abc')
+    missing = str(tmp_path / 'missing')
+    results = tokenize_files(SlowLexer, [str(path), missing], processes=2, context='fork', timeout=0.1)
+    assert [ result.columns for result in results ] == [None, None]
+    assert results[0].error == 'timed out after 0.1 s'
+    assert results[1].error == f"FileNotFoundError: [Errno 2] No such file or directory: '{missing}'"
+    assert results.report().splitlines()[-1].startswith('2 files: 0 tokens')
+
+
+# ----------------------------------------------------------------------
+# Profile
+
+def test_profile():
+    # The profile doesn't change the tokens
+    for lexer_class, text in lexers():
+        lexer = lexer_class()
+        lexer.profile = LexerProfile()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+            tokens = [(tok.type, tok.value, tok.lineno, tok.index, tok.end) for tok in lexer.tokenize(text)]
+        assert tokens == _tokens(lexer_class, text)
+        assert sum(lexer.profile.counts.values()) >= len(tokens)
+
+
+# ----------------------------------------------------------------------
+# Rule ordering
+
+def test_rule_ordering():
+    # The shipped lexers, ordered by their rule counts, give the tokens of
+    # the rules as written, also matched with the master pattern only
+    from sly.engine import RegexModule
+    master = RegexModule('re (master pattern)', re.compile)
+    for lexer_class, text in lexers():
+        assert lexer_class._load_rule_counts()
+        for module in (re, master):
+            class written_class(lexer_class):
+                tokens = lexer_class.tokens
+                regex_module = module
+                rule_counts = None
+
+            class ordered_class(written_class):
+                tokens = lexer_class.tokens
+                rule_counts = lexer_class._load_rule_counts()
+
+            assert ordered_class._parts != written_class._parts
+            assert _tokens(ordered_class, text) == _tokens(written_class, text)
+
+
+# ----------------------------------------------------------------------
+# Backtracking-prone rules
+
+def test_rewrite_patterns():
+    # Rules rewritten into cheaper forms match the same text
+    from sly.lex import LexerBuildWarning
+    for lexer_class, _ in lexers():
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', LexerBuildWarning)
+            class rewritten(lexer_class):
+                tokens = lexer_class.tokens
+                rewrite_patterns = True
+
+        texts = [make(4096) for _, make in _ADVERSARIAL[lexer_class.__name__]]
+        for path in _grading_files(lexer_class):
+            with open(path, newline='') as f:
+                texts.append(f.read())
+        for text in texts:
+            assert _tokens(rewritten, text) == _tokens(lexer_class, text)
+
+
+# ----------------------------------------------------------------------
+# Worst cases and scaling
+
+def test_scaling():
+    assert round(_growth([(1, 3), (2, 6), (4, 12)]), 6) == 1
+    assert round(_growth([(1, 3), (2, 12), (4, 48)]), 6) == 2
+
+    # Sizes double up to kilobytes, or until a run is too slow
+    for lexer_class, _ in lexers():
+        block, line = _DELIMITERS[lexer_class.__name__]
+        for name, make in _WORST_CASES:
+            assert abs(len(make(4096, block, line)) - 4096) < 4, name
+            points = scale(lexer_class, lambda n: make(n, block, line), kilobytes=16, runs=1)
+            assert [ size for size, _, _ in points ] == [4096, 8192, 16384], name
+        points = scale(lexer_class, lambda n: make(n, block, line), kilobytes=16, seconds=0, runs=1)
+        assert len(points) == 1
+
+
+# ----------------------------------------------------------------------
+# One large text in a process pool
+
+class _RecordingPool(object):
+    # Pool recording the length of the text of every task
+    def __init__(self, pool):
+        self.pool = pool
+        self.lengths = []
+
+    def imap(self, func, tasks):
+        tasks = list(tasks)
+        self.lengths = [len(task[0]) for task in tasks]
+        return self.pool.imap(func, tasks)
+
+
+def test_tokenize_parallel():
+    # Chunks lexed by forked workers sharing the text, and pickled to the
+    # workers of a given pool, with long comments across the cuts
+    from sly.pool import get_context, tokenize_parallel
+    comment = {'CoolLexer': '(* {} *)\n', 'GoneLexer': '/* {} */\n'}
+    with get_context('fork').Pool(2) as pool:
+        pool = _RecordingPool(pool)
+        for lexer_class, _ in lexers():
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), \
+                 contextlib.redirect_stderr(devnull):
+                text = _generated(lexer_class, 0.125)
+                text = text.replace('\n\n', '\n' + comment[lexer_class.__name__].format('x\n' * 1000), 30)
+                expected = [(tok.type, tok.value, tok.lineno, tok.index, tok.end)
+                            for tok in lexer_class().tokenize_columns(text, 3)]
+                for options in ({'context': 'fork'}, {'pool': pool}, {'pool': pool, 'margin': 16}):
+                    columns = tokenize_parallel(lexer_class(), text, 3, chunksize=4096, **options)
+                    assert [(tok.type, tok.value, tok.lineno, tok.index, tok.end)
+                            for tok in columns] == expected, options
+                    if 'pool' in options:
+                        assert sum(pool.lengths[:-1]) < len(text) + len(pool.lengths) * 512
+
+
+# ----------------------------------------------------------------------
+# Value converters
+
+def test_converters():
+    # Values converted by rule functions and by converters
+    extra = {'GoneLexer': " 123 4.5 'a' '\\n' true", 'CoolLexer': ' true false'}
+    corpora = {lexer_class.__name__: text for lexer_class, text in lexers()}
+    for before_class, after_class in _converter_lexers():
+        name = after_class.__name__
+        text = corpora[name].replace('\n', extra[name] * 5 + '\n')
+        before = _tokens(before_class, text)
+        after = _tokens(after_class, text)
+        if name == 'CoolLexer':
+            # Values are only converted by the second one
+            assert { value for type, value, *_ in after if type == 'BOOL_CONST' } == {True, False}
+            before = [(type, lineno, index) for type, _, lineno, index, _ in before]
+            after = [(type, lineno, index) for type, _, lineno, index, _ in after]
+        assert before == after
+
+
+# ----------------------------------------------------------------------
+# Value converters of lexer states
+
+class OuterLexer(Lexer):
+    tokens = { 'ID', 'NUM', 'OPEN', 'CLOSE' }
+    ignore = ' \n'
+    ID = r'[a-z]+'
+    NUM = r'\d+'
+
+    @_(r'\[')
+    def OPEN(self, t):
+        self.push_state(InnerLexer)
+        return t
+
+
+class InnerLexer(Lexer):
+    tokens = OuterLexer.tokens
+    ignore = ' \n'
+    NUM = r'\d+'
+    NUM.convert = int
+
+    @_(r'\]')
+    def CLOSE(self, t):
+        self.pop_state()
+        return t
+
+
+def test_state_converters():
+    # Values are converted by the converters of the state that lexed them
+    # in tokenize(), tokenize_columns() and tokenize_parallel()
+    from sly.pool import tokenize_parallel
+    text = 'x 12 [34 5] 6\n' * 3000
+    expected = _tokens(OuterLexer, text)
+    assert expected[1][1] == '12' and expected[3][1] == 34
+    columns = OuterLexer().tokenize_columns(text)
+    assert [(tok.type, tok.value, tok.lineno, tok.index, tok.end) for tok in columns] == expected
+    columns = tokenize_parallel(OuterLexer(), text, chunksize=4096, processes=2, context='fork')
+    assert [(tok.type, tok.value, tok.lineno, tok.index, tok.end) for tok in columns] == expected
+
+
+# ----------------------------------------------------------------------
+# Many short texts
+
+def test_tokenize_many():
+    # Every text is lexed as if on its own, from the initial state
+    def rows(tokens):
+        return [(tok.type, tok.value, tok.lineno, tok.index, tok.end) for tok in tokens]
+
+    for lexer_class, text in lexers():
+        lines = [line for line in text.splitlines() if line.strip()]
+        lines += [line.encode('ascii') for line in lines[:50]]
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+            many = [rows(tokens) for tokens in lexer_class().tokenize_many(lines, 3)]
+        assert many == [_tokens(lexer_class, line, 3) for line in lines]
+    texts = ['x [1', '2 [3] y', '', '[4']
+    assert [rows(tokens) for tokens in OuterLexer().tokenize_many(texts)] == \
+        [rows(OuterLexer().tokenize(text)) for text in texts]
+
+
+# ----------------------------------------------------------------------
+# Whitespace
+
+def test_whitespace():
+    # Whitespace skipped by rules and by whitespace runs, with line
+    # numbers kept by the rules and computed from the text
+    text = cool_corpus()
+    text += text.replace('\n', ' \t\n\r\n\f\v \n')
+    for rules_class, runs_class in _whitespace_lexers():
+        assert _tokens(runs_class, text) == _tokens(rules_class, text)
+
+
+# ----------------------------------------------------------------------
+# Bytes
+
+def test_binary_tokens():
+    # Every grading file gives the same tokens from str, bytes and mmap
+    for lexer_class, _ in lexers():
+        for path in _grading_files(lexer_class):
+            with open(path, 'rb') as f:
+                data = f.read()
+                expected = _tokens(lexer_class, data.decode('ascii'))
+                assert _tokens(lexer_class, data) == expected, path
+                if data:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        assert _tokens(lexer_class, mm) == expected, path
+
+
+# ----------------------------------------------------------------------
+# Parsing in a pool
+
+def test_parse_units():
+    # Top-level statements of Gone, split at every print, give the same
+    # tree (and the same syntax errors) as parsing the whole file
+    from gone.ast import flatten
+    from gone.parser import GoneParser
+    from gone.tokenizer import GoneLexer
+    from sly.pool import get_context, parse_units
+
+    def tree(statements):
+        return [(depth, repr(node), getattr(node, 'lineno', None))
+                for depth, node in flatten(statements)]
+
+    def join(units):
+        return [statement for statements in units for statement in statements]
+
+    with get_context('fork').Pool(2) as pool:
+        for path in sorted(glob.glob(os.path.join(COMPILERS, 'Tests', '*.g'))):
+            with open(path) as f:
+                source = f.read()
+            tokens = list(GoneLexer().tokenize(source))
+            parser = GoneParser()
+            parser.source = source
+            output = io.StringIO()
+            with contextlib.redirect_stderr(output):
+                expected = parser.parse(iter(tokens))
+            errors = output.getvalue()
+            output = io.StringIO()
+            with contextlib.redirect_stderr(output):
+                result = parse_units(parser, tokens, join, 'PRINT',
+                                     nesting=(('LBRACE', 'RBRACE'),), pool=pool)
+            assert output.getvalue() == errors, path
+            assert tree(result) == tree(expected), path
@@ -0,0 +1,647 @@
+# coding: utf-8
+#
+# Tests of the features sly.lex adds to the lexers.
+#
+#     python -m pytest test_lexer.py
+
+import copy
+import io
+import json
+import mmap
+import os
+import pickle
+import re
+import subprocess
+import sys
+import warnings
+
+import pytest
+
+from benchmark import COMPILERS, DIRECTORIO
+import sly.engine
+import sly.lex
+from sly import Lexer, LexerProfile
+from sly.lex import (_Equals, _NoCaseLookup, _Unescape, BytesToken, IndexedBytesToken, IndexedToken, LexerBuildError, LexerBuildWarning, LineIndex,
+                     TextView, Token, TokenColumns, TokenStream)
+
+
+def _rows(tokens):
+    return [ (tok.type, tok.value, tok.lineno, tok.index, tok.end) for tok in tokens ]
+
+
+# ----------------------------------------------------------------------
+# TextView
+
+def test_text_view():
+    view = TextView('abc def', 2, 6)
+    assert view == 'c de' and len(view) == 4
+    assert view[0] == 'c' and view[-1] == 'e' and view[1:3] == ' d'
+    assert 'de' in view and 'f' not in view
+    assert view + '!' == 'c de!' and '>' + view == '>c de' and view + view == 'c dec de'
+    assert f'{view:>6}|{view!r}' == '  c de|\'c de\''
+    assert 'b' < view < 'd' and view <= 'c de' and view >= TextView('c', 0) and view > 'c'
+    assert view.upper() == 'C DE'
+    for value in (pickle.loads(pickle.dumps(view)), copy.copy(view), copy.deepcopy(view)):
+        assert value == 'c de' and type(value) is str
+    assert TextView(b'abc', 1) == 'bc'
+
+
+# ----------------------------------------------------------------------
+# Bytes
+
+class EuroLexer(Lexer):
+    tokens = { 'EURO', 'ID' }
+    EURO = '\u20ac'
+    ID = r'[a-z]+'
+
+
+def test_bytes_tokens():
+    tokens = list(ColumnLexer().tokenize(bytearray(b'ab 12 "\xe9"')))
+    assert all(type(tok) is BytesToken for tok in tokens)
+
+    # Values stay bytes until they are used, by a rule function or after
+    assert [ Token.value.__get__(tok) for tok in tokens ] == [b'ab', 12, '\xe9']
+    assert [ tok.value for tok in tokens ] == ['ab', 12, '\xe9']
+    assert Token.value.__get__(tokens[0]) == 'ab'
+    tokens[0].value = b'cd'
+    assert tokens[0].value == 'cd'
+
+    # Rules that can't be encoded as Latin-1 only fail on bytes
+    assert [ tok.type for tok in EuroLexer().tokenize('a\u20ac') ] == ['ID', 'EURO']
+    with pytest.raises(LexerBuildError):
+        list(EuroLexer().tokenize(b'a'))
+
+
+# ----------------------------------------------------------------------
+# Frozen lexers
+
+def test_freeze():
+    class FrozenLexer(Lexer):
+        tokens = { 'ID', 'OPEN' }
+        ignore = ' '
+        ID = r'[a-z]+'
+
+        @_(r'\(')
+        def OPEN(self, t):
+            self.begin(InnerLexer)
+            return t
+
+    class InnerLexer(FrozenLexer):
+        tokens = { 'NUM', 'CLOSE' }
+        NUM = r'\d+'
+
+        @_(r'\)')
+        def CLOSE(self, t):
+            self.begin(FrozenLexer)
+            return t
+
+    class FrozenEuroLexer(FrozenLexer):
+        tokens = { 'EURO' }
+        EURO = '\u20ac'
+
+    FrozenLexer.freeze()
+    states = (FrozenLexer, InnerLexer, FrozenEuroLexer)
+    assert all(vars(cls)['_str_state'] is not None for cls in states)
+    assert vars(FrozenEuroLexer)['_bytes_state'] is None
+    before = [ dict(vars(cls)) for cls in states ]
+
+    # Tokenizing doesn't build anything more in the frozen classes
+    for source in ('a (12) b', b'a (12) b'):
+        assert [ tok.type for tok in FrozenLexer().tokenize(source) ] == ['ID', 'OPEN', 'NUM', 'CLOSE', 'ID']
+    assert [ tok.type for tok in FrozenEuroLexer().tokenize('a\u20ac') ] == ['ID', 'EURO']
+    with pytest.raises(LexerBuildError):
+        list(FrozenEuroLexer().tokenize(b'a'))
+    assert [ dict(vars(cls)) for cls in states ] == before
+
+
+# ----------------------------------------------------------------------
+# Lexing errors
+
+class ErrorLexer(Lexer):
+    tokens = { 'ID' }
+    ignore = ' '
+    literals = { '+' }
+    ID = r'[a-z]+'
+
+    def error(self, t):
+        self.index += 1
+        return t
+
+
+class CoalescingLexer(ErrorLexer):
+    tokens = ErrorLexer.tokens
+    coalesce_errors = True
+
+
+def test_errors():
+    text = 'ab ?!# cd ??+x $$'
+    tokens = list(ErrorLexer().tokenize(text))
+    assert [ (tok.type, tok.index, tok.end) for tok in tokens if tok.type == 'ERROR' ] == \
+        [('ERROR', 3, 4), ('ERROR', 4, 5), ('ERROR', 5, 6), ('ERROR', 10, 11), ('ERROR', 11, 12),
+         ('ERROR', 15, 16), ('ERROR', 16, 17)]
+    assert type(tokens[1].value) is TextView and tokens[1].value == text[3:]
+
+    # Runs of unmatched characters up to a rule, literal or ignored character
+    expected = [('ID', 'ab', 0, 2), ('ERROR', '?!#', 3, 6), ('ID', 'cd', 7, 9), ('ERROR', '??', 10, 12),
+                ('+', '+', 12, 13), ('ID', 'x', 13, 14), ('ERROR', '$$', 15, 17)]
+    for source in (text, text.encode('ascii')):
+        tokens = CoalescingLexer().tokenize(source)
+        assert [ (tok.type, str(tok.value), tok.index, tok.end) for tok in tokens ] == expected
+
+    # Runs split across the chunks of a stream
+    text = '\n'.join([text] * 20)
+    tokens = CoalescingLexer().tokenize_stream(io.StringIO(text), chunksize=5, margin=2)
+    assert [ (tok.type, str(tok.value), tok.index, tok.end) for tok in tokens ] == \
+        [ (tok.type, str(tok.value), tok.index, tok.end) for tok in CoalescingLexer().tokenize(text) ]
+
+
+# ----------------------------------------------------------------------
+# Dispatch on the first character
+
+class FoldLexer(Lexer):
+    tokens = { 'LONG', 'KELVIN', 'DOTTED', 'LATIN', 'WORD' }
+    ignore = ' '
+    reflags = re.IGNORECASE
+    LONG = '\u017fs'
+    KELVIN = '\u212ak'
+    DOTTED = '\u0130i'
+    LATIN = '[\u0100-\u0200]x'
+    WORD = r'[a-z\u0100-\u2200]+'
+
+
+def test_casefold_dispatch():
+    # Case partners outside ASCII, as matched by re
+    assert sly.lex._casefold({ '\u017f' }, re.I) == ({ 's', 'S', '\u017f' }, True)
+    assert sly.lex._casefold({ '\u0130' }, re.I)[0] >= { 'i', 'I' }
+    assert sly.lex._casefold({ '\xe9' }, re.I | re.A) == ({ '\xe9' }, False)
+    assert sly.lex._casefold({ 'k' }, re.I | re.A) == ({ 'k', 'K' }, False)
+
+    class MasterLexer(FoldLexer):
+        tokens = FoldLexer.tokens
+        regex_module = sly.engine.RegexModule('re', re.compile)
+
+    text = 'ss Ss \u017fS kk \u212aK iI \u0130i sx Sx ix ab s k i'
+    tokens = [ (tok.type, tok.value) for tok in FoldLexer().tokenize(text) ]
+    assert tokens == [ (tok.type, tok.value) for tok in MasterLexer().tokenize(text) ]
+    assert [ type for type, _ in tokens ] == ['LONG'] * 3 + ['KELVIN'] * 2 + ['DOTTED'] * 2 + \
+        ['LATIN'] * 3 + ['WORD'] * 4
+
+
+# ----------------------------------------------------------------------
+# Backtracking warnings
+
+def _risky_lexer():
+    class RiskyLexer(Lexer):
+        tokens = { 'COMMENT' }
+        COMMENT = r'/\*(.|\n)*?\*/'
+    return RiskyLexer
+
+
+def test_build_warnings(tmp_path, monkeypatch):
+    # Reported at the class definition, and again when the rule set is
+    # found in the cache instead of being validated
+    monkeypatch.setattr(sly.lex, 'CACHE_DIR', str(tmp_path))
+    for _ in range(2):
+        monkeypatch.setattr(sly.lex, '_build_cache', { })
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            _risky_lexer()
+        assert [ (w.category, w.filename) for w in caught ] == [(LexerBuildWarning, __file__)]
+        assert 'rule COMMENT' in str(caught[0].message)
+        assert len(os.listdir(tmp_path)) == 1
+
+
+def test_rewrite_patterns():
+    for pattern, rewritten, plain in ((r'/\*(.|\n)*?\*/', r'/\*(?s:.)*?\*/', r'/\*(?s:.)*?\*/'),
+                                      (r'"[^"\n]*"', r'"[^"\n]*+"', r'"[^"\n]*"'),
+                                      (r'//.*\n', r'//.*+\n', r'//.*\n'),
+                                      (r'(a|b)*c', r'(a|b)*c', r'(a|b)*c')):
+        assert sly.lex._rewrite_pattern(pattern, 0) == rewritten
+        assert sly.lex._rewrite_pattern(pattern, 0, possessive=False) == plain
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', LexerBuildWarning)
+        risky = _risky_lexer()
+        class RewrittenLexer(risky):
+            tokens = { 'COMMENT' }
+            rewrite_patterns = True
+    assert RewrittenLexer._master_re.pattern == r'(?P<COMMENT>/\*(?s:.)*?\*/)'
+    text = '/* a\n */'
+    assert _rows(RewrittenLexer().tokenize(text)) == _rows(risky().tokenize(text))
+
+
+def test_shipped_lexers_build_cleanly():
+    code = 'import Lexer, gone.tokenizer'
+    path = os.pathsep.join([DIRECTORIO, COMPILERS])
+    env = dict(os.environ, PYTHONPATH=path)
+    env.pop('SLY_CACHE_DIR', None)
+    result = subprocess.run([sys.executable, '-W', 'error::sly.lex.LexerBuildWarning', '-c', code],
+                            env=env, capture_output=True, text=True)
+    assert result.returncode == 0 and result.stderr == '', result.stderr
+
+
+# ----------------------------------------------------------------------
+# Line numbers from a newline index
+
+class IndexedLexer(Lexer):
+    tokens = { 'ID' }
+    ignore = ' '
+    line_index = True
+    ID = r'[a-z]+'
+    ignore_newline = r'\n+'
+
+
+def test_line_index():
+    lines = LineIndex('ab\ncd\n\nef', 1)
+    assert [ lines.lineno(index) for index in (0, 3, 7, 9, 4, 0) ] == [1, 2, 4, 4, 2, 1]
+    assert [ lines.column(index) for index in (0, 4, 6, 8) ] == [1, 2, 1, 2]
+    lines = LineIndex('x\nab\ncd', 5, 2)
+    assert [ lines.lineno(index) for index in (2, 5, 3) ] == [5, 6, 5]
+
+    text = 'a\n  bb\n\nc\n' * 50
+    tokens = list(IndexedLexer().tokenize(text))
+    assert all(type(tok) is IndexedToken for tok in tokens)
+    positions = [ (tok.lineno, tok.column) for tok in tokens ]
+    assert positions[:4] == [(1, 1), (2, 3), (4, 1), (5, 1)] and positions[-1] == (200, 1)
+
+    # Assigned line numbers replace the computed ones
+    tokens[1].lineno = 10
+    assert (tokens[1].lineno, tokens[1].column) == (10, 3)
+
+    tokens = list(IndexedLexer().tokenize(text.encode('ascii')))
+    assert all(type(tok) is IndexedBytesToken for tok in tokens)
+    assert [ (tok.lineno, tok.column) for tok in tokens ] == positions
+    tokens = IndexedLexer().tokenize_stream(io.StringIO(text), chunksize=16, margin=4)
+    assert [ (tok.lineno, tok.column) for tok in tokens ] == positions
+
+
+# ----------------------------------------------------------------------
+# Keywords without regard to case
+
+class KeywordLexer(Lexer):
+    tokens = { 'ID', 'IF', 'ELSE', 'TRUE' }
+    ignore = ' '
+    ID = r'[a-zA-Z_]+'
+    ID.nocase['if'] = IF
+    ID.nocase['ELSE'] = ELSE
+    ID.nocase['true'] = TRUE
+    del ID['Else']
+
+
+class NoTrueLexer(KeywordLexer):
+    tokens = KeywordLexer.tokens
+    del ID.nocase['TRUE']
+
+
+def test_nocase_keywords():
+    text = 'if IF iF else Else ELSE true TRUE ifx x_if'
+    types = ['IF', 'IF', 'IF', 'ELSE', 'ID', 'ELSE', 'TRUE', 'TRUE', 'ID', 'ID']
+    assert [ tok.type for tok in KeywordLexer().tokenize(text) ] == types
+    assert [ tok.type for tok in KeywordLexer().tokenize(text.encode('ascii')) ] == types
+    assert [ tok.type for tok in NoTrueLexer().tokenize(text) ] == [ 'ID' if type == 'TRUE' else type
+                                                                     for type in types ]
+
+    # Only the first limit values are remembered
+    lookup = _NoCaseLookup('ID', { 'Else': 'ID' }, { 'else': 'ELSE' }, limit=2)
+    assert [ lookup[value] for value in ('ELSE', 'Else', 'x', 'else') ] == ['ELSE', 'ID', 'ID', 'ELSE']
+    assert dict(lookup) == { 'Else': 'ID', 'ELSE': 'ELSE' }
+
+
+# ----------------------------------------------------------------------
+# Delimited regions
+
+class RegionLexer(Lexer):
+    tokens = { 'ID', 'COMMENT' }
+    ignore = ' '
+    ID = r'[a-z]+'
+    COMMENT = region('(*', '*)', nested=True, escape='\\')
+    ignore_line = region('--', '\n')
+
+    def COMMENT(self, t):
+        t.value = t.value[2:-2]
+        return t
+
+    @_(r'\n+')
+    def newline(self, t):
+        self.lineno += len(t.value)
+
+    def unterminated(self, t):
+        self.unterminated_at = (t.type, t.index, self.lineno, str(t.value))
+
+
+class PlainLexer(RegionLexer):
+    tokens = RegionLexer.tokens
+    ignore_line = r'--[^\n]*'
+
+
+def test_region():
+    for text, expected in (('a (* b (* c *) \\*) d *) e', [('ID', 'a', 1), ('COMMENT', ' b (* c *) \\*) d ', 1),
+                                                            ('ID', 'e', 1)]),
+                           ('a -- (* x\nb\n', [('ID', 'a', 1), ('ID', 'b', 2)]),
+                           ('a (*\n*)\n(* c *) b', [('ID', 'a', 1), ('COMMENT', '\n', 1),
+                                                     ('COMMENT', ' c ', 3), ('ID', 'b', 3)])):
+        for lexer_class in (RegionLexer, PlainLexer):
+            for source in (text, text.encode('ascii')):
+                tokens = [ (tok.type, tok.value, tok.lineno) for tok in lexer_class().tokenize(source) ]
+                assert tokens == expected, (lexer_class, source)
+
+    # The rest of the text is given to unterminated()
+    for source in ('a (* b\n(* c *)\n', b'a (* b\n(* c *)\n'):
+        lexer = RegionLexer()
+        assert [ tok.value for tok in lexer.tokenize(source) ] == ['a']
+        assert lexer.unterminated_at == ('COMMENT', 2, 3, '(* b\n(* c *)\n')
+    lexer = RegionLexer()
+    assert [ tok.value for tok in lexer.tokenize('a -- b') ] == ['a']
+    assert lexer.unterminated_at == ('line', 2, 1, '-- b')
+    assert [ tok.value for tok in PlainLexer().tokenize('a -- b') ] == ['a']
+
+
+# ----------------------------------------------------------------------
+# Token streams
+
+def test_token_stream():
+    pulled = [ ]
+    def tokens():
+        for n in range(40):
+            pulled.append(n)
+            yield n
+
+    stream = TokenStream(tokens(), size=2)
+    assert stream.peek() == 0 and stream.peek(2) == 2 and pulled == [0, 1, 2]
+    assert next(stream) == 0 and stream.advance(2) == 2 and stream.last == 2 and stream.position == 3
+
+    # Marks keep the tokens after them while the buffer grows
+    outer = stream.mark()
+    assert stream.advance(10) == 12
+    inner = stream.mark()
+    assert [ next(stream) for _ in range(3) ] == [13, 14, 15]
+    stream.reset(inner)
+    assert (stream.position, stream.last, stream.peek()) == (13, 12, 13)
+    stream.reset(outer)
+    assert (stream.position, stream.last, next(stream)) == (3, 2, 3)
+    with pytest.raises(ValueError):
+        stream.reset(inner)
+    mark = stream.mark()
+    stream.advance(5)
+    stream.release(mark)
+    with pytest.raises(ValueError):
+        stream.reset(mark)
+
+    # End of the tokens
+    assert stream.peek(30) == 39 and stream.peek(31) is None and stream.advance(100) == 39 and stream.position == 40
+    assert stream.peek() is None and stream.advance() is None and list(stream) == []
+    assert len(pulled) == 40
+
+
+# ----------------------------------------------------------------------
+# Value converters
+
+class LiteralLexer(Lexer):
+    tokens = { 'BOOL', 'STR', 'NUM' }
+    ignore = ' '
+    BOOL = r'[tT][rR][uU][eE]|[fF][aA][lL][sS][eE]'
+    BOOL.convert = equals('true', nocase=True)
+    STR = r'"([^"\\]|\\.)*"'
+    STR.convert = unescape(1)
+    NUM = r'\d+'
+    NUM.convert = int
+
+
+def test_converters():
+    text = 'TRUE false True 12 "a\\n\\x41\\"" "\xe9\\t" "\u20ac"'
+    expected = [True, False, True, 12, 'a\nA"', '\xe9\t', '\u20ac']
+    assert [ tok.value for tok in LiteralLexer().tokenize(text) ] == expected
+    assert [ tok.value for tok in LiteralLexer().tokenize(text.rsplit(' ', 1)[0].encode('latin-1')) ] == expected[:-1]
+    assert [ tok.value for tok in LiteralLexer().tokenize_columns(text) ] == expected
+    assert 'equals' not in vars(LiteralLexer) and 'unescape' not in vars(LiteralLexer)
+
+    # Converted values are remembered up to a limit, and not pickled
+    convert = _Equals('x')
+    convert.limit = 2
+    assert [ convert[value] for value in ('x', 'X', 'y', 'x') ] == [True, False, False, True]
+    assert dict(convert) == { 'x': True, 'X': False }
+    copy = pickle.loads(pickle.dumps(convert))
+    assert type(copy) is _Equals and (copy.text, copy.nocase, len(copy)) == ('x', False, 0)
+    assert pickle.loads(pickle.dumps(_Unescape(2))).strip == 2
+
+
+# ----------------------------------------------------------------------
+# Token columns
+
+class ColumnLexer(Lexer):
+    tokens = { 'ID', 'NUM', 'STR' }
+    ignore = ' '
+    ID = r'[a-z]+'
+    NUM = r'\d+'
+    NUM.convert = int
+
+    @_(r'"[^"]*"')
+    def STR(self, t):
+        t.value = t.value[1:-1]
+        return t
+
+    @_(r'\n+')
+    def newline(self, t):
+        self.lineno += len(t.value)
+
+
+def test_tokenize_columns():
+    text = 'ab 12 "x y"\ncd 3\n'
+    columns = ColumnLexer().tokenize_columns(text)
+    assert _rows(columns) == _rows(ColumnLexer().tokenize(text))
+    assert len(columns) == 5 and columns[-1].value == 3 and columns.value(1) == 12
+    assert columns.types == ['ID', 'NUM', 'STR'] and list(columns.type) == [0, 1, 2, 0, 1]
+    assert list(columns.lineno) == [1, 1, 1, 2, 2] and columns.end[2] == 11
+
+    # Only the values replaced by rule functions are kept
+    assert columns.values == { 2: 'x y' }
+    assert _rows(pickle.loads(pickle.dumps(columns))) == _rows(columns)
+
+    # Codes are mapped to those of the columns extended
+    tail = TokenColumns(text, ['STR', 'NUM'], ColumnLexer._converters)
+    tail.extend(columns, lineno_delta=10, start=2)
+    assert tail.types == ['STR', 'NUM', 'ID'] and list(tail.type) == [0, 2, 1]
+    assert _rows(tail) == [ (type, value, lineno + 10, index, end)
+                            for type, value, lineno, index, end in _rows(columns)[2:] ]
+
+
+# ----------------------------------------------------------------------
+# Relexing after an edit
+
+class EditLexer(Lexer):
+    tokens = { 'ID', 'NUM', 'QUOTE', 'CHARS' }
+    ignore = ' '
+    NUM = r'\d+'
+    lexed = [ ]
+
+    @_(r'[a-z]+')
+    def ID(self, t):
+        self.lexed.append(t.index)
+        return t
+
+    @_(r'"')
+    def QUOTE(self, t):
+        self.push_state(StringLexer)
+        return t
+
+    @_(r'\n+')
+    def newline(self, t):
+        self.lineno += len(t.value)
+
+
+class StringLexer(Lexer):
+    tokens = EditLexer.tokens
+    CHARS = r'[^"]+'
+
+    @_(r'"')
+    def QUOTE(self, t):
+        self.pop_state()
+        return t
+
+
+def _edit(lexer, tokens, text, start, deleted, inserted):
+    new = text[:start] + inserted + text[start + deleted:]
+    del EditLexer.lexed[:]
+    tokens = lexer.relex(tokens, new, start, deleted, inserted)
+    lexed = len(EditLexer.lexed)
+    assert _rows(tokens) == _rows(EditLexer().tokenize(new)), (text, start, deleted, inserted)
+    return tokens, new, lexed
+
+
+def test_relex():
+    text = 'ab 1\n' * 500
+    lexer = EditLexer()
+    tokens = list(lexer.tokenize(text))
+
+    # Only the tokens around the edit are lexed again
+    tokens, text, lexed = _edit(lexer, tokens, text, 1000, 2, 'xyz\n\n')
+    assert lexed <= 3 and tokens[-1].lineno == 502
+    tokens, text, lexed = _edit(lexer, tokens, text, 1001, 0, 'q')
+    assert lexed <= 3
+
+    # An edit that changes the state of the rest of the text, then
+    # restores it
+    tokens, text, lexed = _edit(lexer, tokens, text, 10, 0, '"')
+    assert tokens[-1].type == 'CHARS' and lexer.state is StringLexer
+    tokens, text, lexed = _edit(lexer, tokens, text, 10, 1, '')
+    assert tokens[-1].type == 'NUM' and lexer.state is EditLexer
+    tokens, text, lexed = _edit(lexer, tokens, text, 0, 0, '"x" ')
+    assert lexed <= 3
+    tokens, text, lexed = _edit(lexer, tokens, text, len(text), 0, 'end')
+    _edit(lexer, tokens, text, 0, len(text), '')
+
+
+# ----------------------------------------------------------------------
+# Streams
+
+class StreamLexer(Lexer):
+    tokens = { 'ID', 'COMMENT' }
+    ignore = ' '
+    ID = r'\w+'
+    COMMENT = region('/*', '*/')
+
+    @_(r'\n+')
+    def newline(self, t):
+        self.lineno += len(t.value)
+
+
+def test_tokenize_stream(tmp_path):
+    # Comments and UTF-8 characters split across chunks
+    text = ''.join(f'\xe9{n} /* comment\n spanning lines */ x{n}\n' for n in range(200))
+    expected = _rows(StreamLexer().tokenize(text))
+    assert expected[-2] == ('COMMENT', '/* comment\n spanning lines */', 399, len(text) - 35, len(text) - 6)
+    path = tmp_path / 'text'
+    path.write_bytes(text.encode('utf-8'))
+    for chunksize, margin in ((7, 3), (64, 16), (4096, 256)):
+        assert _rows(StreamLexer().tokenize_stream(io.StringIO(text), 1, chunksize, margin)) == expected
+        assert _rows(StreamLexer().tokenize_stream(io.BytesIO(text.encode('utf-8')), 1, chunksize, margin)) == expected
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            assert _rows(StreamLexer().tokenize_stream(mm, 1, chunksize, margin)) == expected
+
+
+# ----------------------------------------------------------------------
+# Profile
+
+class ProfiledLexer(Lexer):
+    tokens = { 'A', 'OPEN' }
+    literals = { '+' }
+    A = r'a'
+
+    @_(r'\[')
+    def OPEN(self, t):
+        self.begin(ProfiledState)
+        return t
+
+    def error(self, t):
+        self.errors.append(t.value[0])
+        self.index += 1
+
+
+class ProfiledState(Lexer):
+    tokens = { 'B', 'CLOSE' }
+    B = r'b'
+
+    @_(r'\]')
+    def CLOSE(self, t):
+        self.begin(ProfiledLexer)
+        return t
+
+    def error(self, t):
+        self.errors.append(t.value[0])
+        self.index += 1
+
+
+def test_profile(tmp_path):
+    lexer = ProfiledLexer()
+    lexer.errors = [ ]
+    lexer.profile = LexerProfile()
+    assert [ tok.type for tok in lexer.tokenize('a?+[b!]a') ] == ['A', '+', 'OPEN', 'B', 'CLOSE', 'A']
+    assert lexer.errors == ['?', '!'] and 'error' not in vars(lexer)
+    assert lexer.profile.counts == {
+        ('match', 'A'): 2, ('match', 'OPEN'): 1, ('match', 'B'): 1, ('match', 'CLOSE'): 1,
+        ('callback', 'OPEN'): 1, ('callback', 'CLOSE'): 1, ('literal', '+'): 1,
+        ('error', 'no match'): 2, ('error', 'error()'): 2,
+    }
+    assert set(lexer.profile.times) == set(lexer.profile.counts)
+
+    report = lexer.profile.report().splitlines()
+    assert report[0].split() == ['entry', 'count', 'total', 'ms', 'us/call', '%'] and len(report) == 10
+    counts = { 'A': 2, 'OPEN': 1, 'B': 1, 'CLOSE': 1 }
+    assert lexer.profile.rule_counts() == counts
+    lexer.profile.save(tmp_path / 'counts.json')
+    assert json.loads((tmp_path / 'counts.json').read_text()) == counts
+
+
+# ----------------------------------------------------------------------
+# Rule ordering
+
+def _ordered_lexer(counts):
+    class OrderedLexer(Lexer):
+        tokens = { 'IF', 'ID', 'NUM' }
+        ignore = ' '
+        rule_counts = counts
+        IF = r'if'
+        ID = r'[a-z]+'
+        NUM = r'\d+'
+    return OrderedLexer
+
+
+def test_rule_ordering(tmp_path):
+    text = 'if x 12 ifx'
+    expected = [ (tok.type, tok.value) for tok in _ordered_lexer(None)().tokenize(text) ]
+
+    # Rules only move ahead of the rules they can't match with
+    for counts, order in (({ 'ID': 100, 'NUM': 50, 'IF': 1 }, ['IF', 'ID', 'NUM']),
+                          ({ 'ID': 10, 'NUM': 50, 'IF': 1 }, ['NUM', 'IF', 'ID'])):
+        lexer_class = _ordered_lexer(counts)
+        assert [ name for name, _ in lexer_class._parts ] == order
+        assert [ (tok.type, tok.value) for tok in lexer_class().tokenize(text) ] == expected
+
+    # Counts read from a file, if there is one
+    path = tmp_path / 'counts.json'
+    assert [ name for name, _ in _ordered_lexer(str(path))._parts ] == ['IF', 'ID', 'NUM']
+    path.write_text('{"NUM": 5}')
+    assert [ name for name, _ in _ordered_lexer(str(path))._parts ] == ['NUM', 'IF', 'ID']
+    path.write_text('{')
+    with pytest.raises(LexerBuildError):
+        _ordered_lexer(str(path))
@@ -80,6 +80,10 @@ class GoneParser(Parser):
     # Same token set as defined in the lexer
     tokens = GoneLexer.tokens
 
+    # Source text being parsed.  Syntax errors quote tokens as written in
+    # it, since the lexer converts the values of literals.
+    source = None
+
     # ----------------------------------------------------------------------
     # Operator precedence table.   Operators must follow the same 
     # precedence rules as in Python.  Instructions to be given in the project.
@@ -212,22 +216,19 @@ class GoneParser(Parser):
 
     @_('INTEGER')
     def literal(self, p):
-        return IntegerLiteral(int(p.INTEGER),lineno=p.lineno)
+        return IntegerLiteral(p.INTEGER,lineno=p.lineno)
 
     @_('FLOAT')
     def literal(self, p):
-        return FloatLiteral(float(p.FLOAT),lineno=p.lineno)
+        return FloatLiteral(p.FLOAT,lineno=p.lineno)
 
     @_('CHAR')
     def literal(self, p):
-        return CharLiteral(eval(p.CHAR),lineno=p.lineno)
+        return CharLiteral(p.CHAR,lineno=p.lineno)
     
     @_('BOOL')
     def literal(self, p):
-        if p.BOOL == 'true':
-            return BooleanLiteral(True,lineno=p.lineno)
-        else:
-            return BooleanLiteral(False,lineno=p.lineno)
+        return BooleanLiteral(p.BOOL,lineno=p.lineno)
     
     @_('ID')
     def location(self, p):
@@ -244,7 +245,8 @@ class GoneParser(Parser):
     # bad input.  p is the offending token or None if end-of-file (EOF).
     def error(self, p):
         if p:
-            error(p.lineno, "Syntax error in input at token '%s'" % p.value)
+            text = self.source[p.index:p.end] if self.source is not None else p.value
+            error(p.lineno, "Syntax error in input at token '%s'" % text)
         else:
             error('EOF','Syntax error. No more input.')
 
@@ -258,6 +260,7 @@ def parse(source):
     '''
     lexer = GoneLexer()
     parser = GoneParser()
+    parser.source = source
     ast = parser.parse(lexer.tokenize(source))
     return ast
 
@@ -82,6 +82,8 @@ in sequence.  Run your tokenize like this:
 Bonus: Think about how to write proper unit tests.
 '''
 
+from functools import partial
+
 # ----------------------------------------------------------------------
 # The following import loads a function error(lineno, msg) that should be
 # used to report all error messages issued by your lexer.  Unit tests and
@@ -127,6 +129,11 @@ class GoneLexer(Lexer):
     # when they appear between tokens.  Do not change.
     ignore = ' \t\r'
 
+    # Match counts of the rules over Tests/*.g, used to try the most frequent
+    # rules first where the order can't change the result.  Regenerate with
+    # "python benchmark.py ordering train" from Practicas_Grupo.
+    rule_counts = 'GoneLexer.counts.json'
+
     # ----------------------------------------------------------------------
     # Ignored patterns.  You'll need to supply appropriate regexes.
     # For example:
@@ -142,16 +149,16 @@ class GoneLexer(Lexer):
     #
     
     # block-style comment (/* ... */)
-    @_(r'/\*(.|\n)*?\*/')
+    @_(r'/\*(?s:.)*?\*/')
     def COMMENT(self, t):
         self.lineno += t.value.count('\n')
 
     # line-style comment (//...)
-    @_(r'//.*\n')
+    @_(r'//[^\n]*\n')
     def COMMENT_LINE(self, t):
         self.lineno += 1
     
-    @_(r'/\*(.|\n)*')
+    @_(r'/\*(?s:.)*')
     def comment_error(self, t):
         error(self.lineno,"Unterminated comment")
 
@@ -197,8 +204,10 @@ class GoneLexer(Lexer):
     #   123.
     #   .123
     #
-    FLOAT_EXP = r'\d+\.\d+[eE][+-]?\d+|\d+\.[eE][+-]?\d+|\.\d+[eE][+-]?\d+|\d+[eE][+-]?\d+'
-    FLOAT = r'\d+\.\d+|\d+\.|\.\d+'
+    FLOAT_EXP = r'(?:\d+(?:\.\d*)?|\.\d+)[eE][+-]?\d+'
+    FLOAT = r'\d+\.\d*|\.\d+'
+    FLOAT_EXP.convert = float
+    FLOAT.convert = float
     # Bonus: Recognize floating point numbers in scientific notation 
     #
     #   1.23e1
@@ -220,6 +229,11 @@ class GoneLexer(Lexer):
     INTEGER_OCT = r'0o[0-7]+'
     INTEGER_BIN = r'0b[01]+'
     INTEGER = r'\d+'
+
+    # Token values are converted to int by the lexer itself (base=0 takes
+    # the base from the prefix)
+    INTEGER_HEX.convert = INTEGER_OCT.convert = INTEGER_BIN.convert = partial(int, base=0)
+    INTEGER.convert = int
     
 
     # Character constant. You must recognize a single letter enclosed in single quotes
@@ -236,6 +250,7 @@ class GoneLexer(Lexer):
 
     # ----- YOU IMPLEMENT
     CHAR = r'\'([^\'\\]|\\[n\\\'x][0-9a-fA-F]{0,2})\''
+    CHAR.convert = unescape(1)     # The character, without quotes or escapes
 
     @_(r'\'[^\']')
     def char_error(self, t):
@@ -243,6 +258,7 @@ class GoneLexer(Lexer):
     
     # Boolean literals
     BOOL = r'true|false'
+    BOOL.convert = equals('true')
         
 
     # ----------------------------------------------------------------------